@@ -0,0 +1,191 @@
+"""
+Registro de los clientes de servicios externos (Mongo, Neo4j, Gemini,
+Cloudinary, Redis y un cliente HTTP compartido). Ninguno se crea al importar: cada uno se construye la primera
+vez que se usa, con los pools y timeouts configurados por entorno, y el
+lifespan de la app los cierra al apagar. Así importar la app es barato y una
+variable faltante solo falla en el servicio que la necesita.
+
+`reemplazar(...)` inyecta dobles (bench/fakes.py, pruebas locales).
+"""
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+from backend.utils.metricas import MonitorMongo, medir_neo4j
+
+load_dotenv()
+
+MONGO_DB = os.getenv("MONGO_DB", "zarpado_db")
+MONGO_POOL_MAX = int(os.getenv("MONGO_POOL_MAX", "50"))
+MONGO_POOL_MIN = int(os.getenv("MONGO_POOL_MIN", "0"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))             # selección de servidor y conexión
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+NEO4J_POOL_MAX = int(os.getenv("NEO4J_POOL_MAX", "20"))
+NEO4J_TIMEOUT = float(os.getenv("NEO4J_TIMEOUT", "5"))                      # segundos
+NEO4J_ADQUISICION_TIMEOUT = float(os.getenv("NEO4J_ADQUISICION_TIMEOUT", "10"))
+GEMINI_TIMEOUT_MS = int(os.getenv("GEMINI_TIMEOUT_MS", "120000"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))                        # segundos
+HTTP_POOL_MAX = int(os.getenv("HTTP_POOL_MAX", "20"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))                    # segundos
+# Cuánto dura en cache el resultado del probe de readiness
+SALUD_CACHE_TTL = float(os.getenv("SALUD_CACHE_TTL", "10"))
+
+
+def _requerida(nombre: str) -> str:
+    valor = os.environ.get(nombre)
+    if not valor:
+        raise RuntimeError(f"No se encontró {nombre} en el entorno.")
+    return valor
+
+
+class Clientes:
+    def __init__(self):
+        self._mongo = None
+        self._neo4j = None
+        self._genai = None
+        self._http = None
+        self._redis = None
+        self._cloudinary = False
+        self._salud = None
+        self._salud_en = 0.0
+        self._salud_en_curso: asyncio.Task = None
+
+    def mongo(self):
+        if self._mongo is None:
+            from pymongo import AsyncMongoClient
+            self._mongo = AsyncMongoClient(
+                _requerida("MONGO_URI"),
+                maxPoolSize=MONGO_POOL_MAX,
+                minPoolSize=MONGO_POOL_MIN,
+                serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                event_listeners=[MonitorMongo()],
+            )
+        return self._mongo
+
+    def db(self):
+        return self.mongo()[MONGO_DB]
+
+    def neo4j(self):
+        if self._neo4j is None:
+            from neo4j import AsyncGraphDatabase
+            self._neo4j = AsyncGraphDatabase.driver(
+                _requerida("NEO4J_URI"),
+                auth=(_requerida("NEO4J_USER"), _requerida("NEO4J_PASS")),
+                max_connection_pool_size=NEO4J_POOL_MAX,
+                connection_timeout=NEO4J_TIMEOUT,
+                connection_acquisition_timeout=NEO4J_ADQUISICION_TIMEOUT,
+            )
+        return self._neo4j
+
+    def genai(self):
+        if self._genai is None:
+            from google import genai
+            from google.genai import types
+            self._genai = genai.Client(
+                api_key=_requerida("GOOGLE_API_KEY"),
+                http_options=types.HttpOptions(timeout=GEMINI_TIMEOUT_MS),
+            )
+        return self._genai
+
+    def http(self):
+        """Cliente HTTP compartido (descargas de Cloudinary): reusa conexiones entre requests."""
+        if self._http is None:
+            import httpx
+            self._http = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                limits=httpx.Limits(max_connections=HTTP_POOL_MAX),
+            )
+        return self._http
+
+    def redis(self):
+        """Solo si se configura un backend compartido (p. ej. USUARIOS_CACHE_BACKEND=redis)."""
+        if self._redis is None:
+            from redis import asyncio as aioredis
+            self._redis = aioredis.from_url(
+                REDIS_URL,
+                socket_timeout=REDIS_TIMEOUT,
+                socket_connect_timeout=REDIS_TIMEOUT,
+            )
+        return self._redis
+
+    def cloudinary(self):
+        if not self._cloudinary:
+            import cloudinary
+            cloudinary.config(
+                cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+                api_key=os.getenv("CLOUDINARY_API_KEY"),
+                api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+                secure=True,
+            )
+            self._cloudinary = True
+
+    def reemplazar(self, mongo=None, neo4j=None, genai=None, http=None, redis=None):
+        if mongo is not None:
+            self._mongo = mongo
+        if neo4j is not None:
+            self._neo4j = neo4j
+        if genai is not None:
+            self._genai = genai
+        if http is not None:
+            self._http = http
+        if redis is not None:
+            self._redis = redis
+
+    async def cerrar(self):
+        """Cierra lo que se haya creado; los errores se informan pero no cortan el apagado."""
+        for nombre, cerrar in (
+            ("mongo", self._mongo and self._mongo.close),
+            ("neo4j", self._neo4j and self._neo4j.close),
+            ("genai", self._genai and getattr(getattr(self._genai, "aio", None), "aclose", None)),
+            ("http", self._http and self._http.aclose),
+            ("redis", self._redis and self._redis.aclose),
+        ):
+            if not cerrar:
+                continue
+            try:
+                res = cerrar()
+                if asyncio.iscoroutine(res):
+                    await res
+            except Exception as e:
+                print(f"Error cerrando el cliente de {nombre}: {e}")
+        self._mongo = self._neo4j = self._genai = self._http = self._redis = None
+
+    async def _chequear(self) -> dict:
+        async def mongo():
+            await asyncio.wait_for(self.mongo().admin.command("ping"), MONGO_TIMEOUT_MS / 1000)
+
+        async def neo4j():
+            with medir_neo4j("ping"):
+                await asyncio.wait_for(self.neo4j().verify_connectivity(), NEO4J_TIMEOUT)
+
+        servicios = {}
+        for nombre, chequeo in (("mongo", mongo), ("neo4j", neo4j)):
+            try:
+                await chequeo()
+                servicios[nombre] = {"estado": "ok"}
+            except Exception as e:
+                servicios[nombre] = {"estado": "error", "detalle": str(e) or type(e).__name__}
+        return {
+            # Sin Neo4j la app sigue atendiendo (el grafo encola y reintenta): no la saca de servicio
+            "listo": servicios["mongo"]["estado"] == "ok",
+            "servicios": servicios,
+            "chequeado": time.time(),
+        }
+
+    async def salud(self) -> dict:
+        """Readiness cacheado SALUD_CACHE_TTL segundos; probes simultáneos comparten un chequeo."""
+        if self._salud is not None and time.monotonic() - self._salud_en < SALUD_CACHE_TTL:
+            return self._salud
+        if self._salud_en_curso is None or self._salud_en_curso.done():
+            self._salud_en_curso = asyncio.create_task(self._chequear())
+        self._salud = await asyncio.shield(self._salud_en_curso)
+        self._salud_en = time.monotonic()
+        return self._salud
+
+
+clientes = Clientes()
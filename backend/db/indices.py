@@ -0,0 +1,130 @@
+"""
+Registro de índices de Mongo y verificación de planes de las consultas críticas.
+
+Los índices se aplican de forma idempotente desde el lifespan de la app.
+Para revisar los planes a mano:
+
+    python -m backend.db.indices           # crea índices y muestra los planes
+"""
+import asyncio
+import json
+
+from pymongo.errors import OperationFailure
+
+from backend.db.mongo import db
+from backend.utils.descripcion_cache import DESCRIPCION_CACHE_TTL
+from backend.utils.historial import HISTORIAL_RETENCION_DIAS
+
+# (colección, claves, opciones)
+INDICES = [
+    ("usuarios", [("email", 1)], {"name": "email_unico", "unique": True}),
+    # Catálogo: igualdad por tipo/marca + orden por _id para el cursor de paginación
+    ("prendas", [("tipo", 1), ("_id", 1)], {"name": "tipo_id"}),
+    ("prendas", [("marca", 1), ("_id", 1)], {"name": "marca_id"}),
+    ("prendas", [("tipo", 1), ("marca", 1), ("_id", 1)], {"name": "tipo_marca_id"}),
+    # Favoritos guardan la URL de la imagen: se resuelve a la prenda para el grafo
+    ("prendas", [("image_path", 1)], {"name": "image_path"}),
+    # Subida directa: cada imagen confirmada es de una sola prenda (confirmar es idempotente)
+    ("prendas", [("image_public_id", 1)], {"name": "image_public_id_unico", "unique": True, "sparse": True}),
+    # Búsqueda por relevancia (/prendas/buscar); pesos alineados con utils/buscador.py
+    ("prendas", [("nombre", "text"), ("marca", "text"), ("descripcion", "text")], {
+        "name": "texto",
+        "weights": {"nombre": 10, "marca": 5, "descripcion": 1},
+        "default_language": "spanish",
+    }),
+    # Historial del probador: página por usuario de la más nueva a la más vieja + retención
+    ("historial", [("user_id", 1), ("_id", -1)], {"name": "usuario_id"}),
+    ("historial", [("creado", 1)], {"name": "creado_ttl", "expireAfterSeconds": HISTORIAL_RETENCION_DIAS * 86400}),
+    ("descripciones_prenda", [("creado", 1)], {"name": "creado_ttl", "expireAfterSeconds": DESCRIPCION_CACHE_TTL}),
+    ("probador_jobs", [("expira", 1)], {"name": "expira_ttl", "expireAfterSeconds": 0}),
+    ("probador_jobs", [("estado", 1), ("lease_hasta", 1)], {"name": "estado_lease"}),
+    ("cloudinary_borrados", [("estado", 1), ("proximo_intento", 1)], {"name": "estado_proximo"}),
+]
+
+# (nombre, colección, filtro, orden) de las consultas calientes
+CONSULTAS_CRITICAS = [
+    ("login", "usuarios", {"email": "a@b.com", "password": "x"}, None),
+    ("email_duplicado", "usuarios", {"email": "a@b.com"}, None),
+    ("catalogo_por_tipo", "prendas", {"tipo": "remera"}, {"_id": 1}),
+    ("catalogo_por_marca", "prendas", {"marca": "nike"}, {"_id": 1}),
+    ("catalogo_tipo_y_marca", "prendas", {"tipo": {"$in": ["remera", "buzo"]}, "marca": "nike"}, {"_id": 1}),
+    ("subida_confirmada", "prendas", {"image_public_id": "prendas/x"}, None),
+    ("historial_usuario", "historial", {"user_id": 0}, {"_id": -1}),
+    ("jobs_pendientes", "probador_jobs", {"estado": "pendiente"}, None),
+    ("borrados_vencidos", "cloudinary_borrados", {"estado": "pendiente", "proximo_intento": {"$lte": 0}}, {"proximo_intento": 1}),
+]
+
+# IndexOptionsConflict / IndexKeySpecsConflict
+_CONFLICTOS = (85, 86)
+
+
+async def asegurar_indices() -> list[dict]:
+    """Crea los índices declarados. Nunca tira: devuelve el resultado de cada uno."""
+    resultados = []
+    for coleccion, claves, opciones in INDICES:
+        res = {"coleccion": coleccion, "nombre": opciones["name"]}
+        try:
+            await db[coleccion].create_index(claves, **opciones)
+            res["estado"] = "ok"
+        except OperationFailure as e:
+            if e.code in _CONFLICTOS and "expireAfterSeconds" in opciones:
+                # Cambió el TTL configurado: se ajusta el índice existente
+                await db.command({
+                    "collMod": coleccion,
+                    "index": {"name": opciones["name"], "expireAfterSeconds": opciones["expireAfterSeconds"]},
+                })
+                res["estado"] = "ttl_actualizado"
+            else:
+                res["estado"] = "error"
+                res["detalle"] = str(e)
+        except Exception as e:
+            res["estado"] = "error"
+            res["detalle"] = str(e)
+        if res["estado"] == "error":
+            print(f"No se pudo crear el índice {coleccion}.{opciones['name']}: {res['detalle']}")
+        resultados.append(res)
+    return resultados
+
+
+def _etapas(plan) -> list[str]:
+    if isinstance(plan, dict):
+        etapas = [plan["stage"]] if "stage" in plan else []
+        for v in plan.values():
+            etapas += _etapas(v)
+        return etapas
+    if isinstance(plan, list):
+        return [e for p in plan for e in _etapas(p)]
+    return []
+
+
+async def explicar_consultas() -> list[dict]:
+    """Corre explain() sobre las consultas críticas y marca las que escanean la colección."""
+    informe = []
+    for nombre, coleccion, filtro, orden in CONSULTAS_CRITICAS:
+        find = {"find": coleccion, "filter": filtro}
+        if orden:
+            find["sort"] = orden
+        try:
+            plan = await db.command({"explain": find, "verbosity": "queryPlanner"})
+            etapas = _etapas(plan["queryPlanner"]["winningPlan"])
+            informe.append({
+                "consulta": nombre,
+                "coleccion": coleccion,
+                "etapas": etapas,
+                "collscan": "COLLSCAN" in etapas,
+            })
+        except Exception as e:
+            informe.append({"consulta": nombre, "coleccion": coleccion, "error": str(e)})
+    return informe
+
+
+async def _main():
+    print(json.dumps(await asegurar_indices(), indent=2))
+    informe = await explicar_consultas()
+    print(json.dumps(informe, indent=2))
+    if any(c.get("collscan") for c in informe):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,6 +1,6 @@
-import os
-from pymongo import MongoClient
+from backend.db.clientes import clientes
+from backend.db.perezoso import Perezoso
 
-MONGO_URI = os.environ["MONGO_URI"]
-client = MongoClient(MONGO_URI)
-db = client["zarpado_db"]
+# El cliente se crea en el primer uso (ver backend/db/clientes.py)
+client = Perezoso(clientes.mongo)
+db = Perezoso(clientes.db)
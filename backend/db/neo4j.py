@@ -1,8 +1,5 @@
-import os
-from neo4j import GraphDatabase
+from backend.db.clientes import clientes
+from backend.db.perezoso import Perezoso
 
-NEO4J_URI = os.environ["NEO4J_URI"]
-NEO4J_USER = os.environ["NEO4J_USER"]
-NEO4J_PASS = os.environ["NEO4J_PASS"]
-
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASS))
+# El driver se crea en el primer uso (ver backend/db/clientes.py)
+driver = Perezoso(clientes.neo4j)
@@ -0,0 +1,15 @@
+class Perezoso:
+    """
+    Se comporta como el objeto que devuelve `fabrica()`, pero lo pide recién
+    al usarlo (db["x"], driver.execute_query, ...). Permite seguir importando
+    `db` y `driver` a nivel de módulo sin crear conexiones al importar.
+    """
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+
+    def __getattr__(self, nombre):
+        return getattr(self._fabrica(), nombre)
+
+    def __getitem__(self, clave):
+        return self._fabrica()[clave]
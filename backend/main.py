@@ -1,12 +1,41 @@
-from backend.db.mongo import db
-from backend.db.neo4j import driver
+import asyncio
+from backend.db.clientes import clientes
+from backend.db.indices import asegurar_indices, explicar_consultas
 from backend.routers.users import router as user_router
 from backend.routers.prendas import router as prendas_router
 from backend.routers.imagen import router as imagen_router
-from fastapi import FastAPI
+from backend.routers.subidas import router as subidas_router
+from backend.utils.probador_jobs import probador_workers
+from backend.utils.grafo import grafo
+from backend.utils.borrados import borrados
+from backend.utils.cache_usuarios import cache_usuarios
+from backend.utils.historial import migrar_embebidos
+from backend.utils.metricas import MiddlewareMetricas, exportar
+from backend.utils.subidas import LimiteCuerpo
+from backend.utils.catalogo import iniciar_indices
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los clientes se crean en el primer uso; índices y migración del historial corren sin demorar el arranque
+    indices = asyncio.create_task(asegurar_indices())
+    migracion = asyncio.create_task(migrar_embebidos())
+    await probador_workers.iniciar()
+    await grafo.iniciar()
+    iniciar_indices()
+    borrados.iniciar()
+    yield
+    indices.cancel()
+    migracion.cancel()
+    await borrados.detener()
+    await probador_workers.detener()
+    await grafo.detener()
+    await clientes.cerrar()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",                     
@@ -15,34 +44,53 @@ origins = [
     "https://web-production-986ac.up.railway.app" 
 ]
 
+# El último agregado es el más externo: CORS envuelve a LimiteCuerpo, así el 413 lleva sus headers
+app.add_middleware(LimiteCuerpo)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing", "Retry-After"],
     max_age=600,
 )
+app.add_middleware(MiddlewareMetricas)
 
 
 app.include_router(user_router, prefix="/api", tags=["usuarios"])
 app.include_router(prendas_router, prefix="/api", tags=["prendas"])
 app.include_router(imagen_router, prefix="/api", tags=["imagen"])
+app.include_router(subidas_router, prefix="/api", tags=["subidas"])
+
+# Liveness: solo que el proceso responde, nunca toca las bases
+@app.get("/salud/vivo")
+async def salud_vivo():
+    return {"estado": "ok"}
+
+# Readiness: ping a Mongo y Neo4j, cacheado (SALUD_CACHE_TTL) para no pegarles en cada probe
+@app.get("/salud/listo")
+async def salud_listo():
+    salud = await clientes.salud()
+    return JSONResponse(salud, status_code=200 if salud["listo"] else 503)
+
+@app.get("/diagnostico/consultas")
+async def diagnostico_consultas():
+    informe = await explicar_consultas()
+    return {
+        "collscan": [c["consulta"] for c in informe if c.get("collscan")],
+        "consultas": informe,
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    contenido, content_type = exportar()
+    return Response(content=contenido, media_type=content_type)
+
+@app.get("/diagnostico/borrados")
+async def diagnostico_borrados():
+    return await borrados.resumen()
 
-@app.get("/mongo-test")
-def mongo_test():
-    try:
-        count = db["usuarios"].count_documents({})
-        return {"mongo_status": "ok", "usuarios_count": count}
-    except Exception as e:
-        return {"mongo_status": "error", "detail": str(e)}
-
-@app.get("/neo4j-test")
-def neo4j_test():
-    try:
-        with driver.session() as session:
-            result = session.run("RETURN 1 AS test")
-            value = result.single()["test"]
-        return {"neo4j_status": "ok", "test_value": value}
-    except Exception as e:
-        return {"neo4j_status": "error", "detail": str(e)}
+@app.get("/diagnostico/cache_usuarios")
+async def diagnostico_cache_usuarios():
+    return cache_usuarios.resumen()
@@ -1,6 +1,9 @@
-from typing import Optional
+from typing import Dict, Literal, Optional
 from pydantic import BaseModel
 
+# Selector de tamaño de imagen (?tamano=) de prendas y usuarios
+TamanoImagen = Literal["thumb", "card", "full"]
+
 class PrendaCreate(BaseModel):
     nombre: str
     tipo: str
@@ -15,3 +18,14 @@ class PrendaOut(BaseModel):
     marca: str
     image_path: Optional[str] = None        
     image_public_id: Optional[str] = None   
+    imagenes: Optional[Dict[str, str]] = None
+
+class PrendaParcial(BaseModel):
+    """Prenda de los listados: con ?fields= solo vienen los campos pedidos."""
+    id: str
+    nombre: Optional[str] = None
+    tipo: Optional[str] = None
+    descripcion: Optional[str] = None
+    marca: Optional[str] = None
+    image_path: Optional[str] = None
+    imagenes: Optional[Dict[str, str]] = None
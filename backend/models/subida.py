@@ -0,0 +1,28 @@
+from typing import Dict, Literal, Optional
+from pydantic import BaseModel
+
+from backend.models.prenda import PrendaCreate
+
+# A qué se asocia una subida directa: la imagen de una prenda o el perfil de un usuario
+DestinoSubida = Literal["prenda", "perfil"]
+
+class FirmaSubidaIn(BaseModel):
+    destino: DestinoSubida
+    # prenda_id a editar o user_id; sin él (destino "prenda") se crea una prenda nueva
+    destino_id: Optional[str] = None
+
+class FirmaSubidaOut(BaseModel):
+    """`campos` van tal cual, junto con el archivo (`file`), en el POST a `url`."""
+    url: str
+    campos: Dict[str, str]
+    token: str
+    expira: int
+
+class ConfirmarSubidaIn(BaseModel):
+    """Lo que devolvió Cloudinary (public_id, version, signature) y el token de la firma."""
+    token: str
+    public_id: str
+    version: int
+    signature: str
+    # Datos de la prenda nueva (destino "prenda" sin destino_id)
+    prenda: Optional[PrendaCreate] = None
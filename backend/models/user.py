@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, EmailStr
 
 class UserCreate(BaseModel):
@@ -13,5 +13,23 @@ class UserOut(BaseModel):
     email: EmailStr
     rol: str
     profile_image_path: Optional[str] = None
+    profile_imagenes: Optional[Dict[str, str]] = None
+    # La primera página de /usuarios/{id}/historial
     historial: List[str] = []
     favoritos: List[str] = []
+
+class UserParcial(BaseModel):
+    """Usuario de las lecturas: con ?fields= solo vienen los campos pedidos."""
+    id: str
+    username: Optional[str] = None
+    email: Optional[EmailStr] = None
+    rol: Optional[str] = None
+    profile_image_path: Optional[str] = None
+    profile_imagenes: Optional[Dict[str, str]] = None
+    favoritos: Optional[List[str]] = None
+    # La primera página de /usuarios/{id}/historial
+    historial: Optional[List[str]] = None
+
+class FavoritosBulk(BaseModel):
+    agregar: List[str] = []
+    quitar: List[str] = []
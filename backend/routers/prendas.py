@@ -1,14 +1,109 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+import os
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from backend.db.mongo import db
-from backend.models.prenda import PrendaCreate, PrendaOut
-from backend.utils.cloudinary_helper import upload_image_to_cloudinary, delete_image_cloudinary
+from backend.models.prenda import PrendaCreate, PrendaOut, PrendaParcial, TamanoImagen
+from backend.utils.cloudinary_helper import upload_image_to_cloudinary, imagen_en_tamano, urls_derivadas
+from backend.utils.cache_prendas import cache_prendas
+from backend.utils.subidas import archivo_subido
+from backend.utils.probador import precalcular_descripcion
+from backend.utils.borrados import borrados
+from backend.utils.catalogo_cache import catalogo_cache
+from backend.utils.exportar import FormatoExport, exportar
+from backend.utils.buscador import buscar_ids
+from backend.utils.catalogo import registrar_cambio
+from backend.utils.similitud import firma_visual, indice as indice_visual
+from backend.utils.grafo import grafo
+
+PRENDAS_LIMITE_DEFECTO = int(os.getenv("PRENDAS_LIMITE_DEFECTO", "100"))
+PRENDAS_LIMITE_MAX = int(os.getenv("PRENDAS_LIMITE_MAX", "500"))
+CAMPOS_PRENDA = ("nombre", "tipo", "descripcion", "marca", "image_path", "imagenes")
 
 router = APIRouter(
     prefix="/prendas",
     tags=["prendas"]
 )
 
+async def preparar_imagen_prenda(image_url: str, public_id: str, contenido) -> tuple[dict, Optional[bytes]]:
+    """
+    Campos de imagen a guardar para una imagen ya subida a Cloudinary: sobre
+    `contenido` (bytes o archivo) calcula la firma visual y deja la copia
+    normalizada para el probador en el cache local. Devuelve esos campos y
+    el JPEG normalizado (None si no se pudo).
+    """
+    campos = {
+        "image_path": image_url,
+        "image_public_id": public_id,
+        "imagenes": urls_derivadas(image_url),
+    }
+    try:
+        campos["firma_visual"] = await run_in_threadpool(firma_visual, contenido)
+    except Exception as e:
+        # Sin firma la prenda simplemente no aparece en /similares
+        print(f"No se pudo calcular la firma visual: {e}")
+        campos["firma_visual"] = None
+    try:
+        campos["probador_clave"], jpeg = await cache_prendas.guardar(contenido)
+    except Exception as e:
+        # Se completa en la primera prueba (bajando la imagen de Cloudinary)
+        print(f"No se pudo preparar la imagen para el probador: {e}")
+        jpeg = None
+    return campos, jpeg
+
+async def subir_imagen_prenda(file: UploadFile) -> tuple[dict, Optional[bytes]]:
+    """Sube la imagen y prepara sus campos sobre los mismos bytes."""
+    # Upload, firma y copia para el probador leen del spool del archivo, sin cargarlo entero
+    contenido = archivo_subido(file)
+    image_url, public_id = await upload_image_to_cloudinary(contenido, folder="prendas")
+    return await preparar_imagen_prenda(image_url, public_id, contenido)
+
+async def insertar_prenda(datos: dict, campos_imagen: dict, jpeg: Optional[bytes]) -> PrendaOut:
+    """Alta de una prenda con su imagen ya preparada (multipart o subida directa)."""
+    prenda_dict = {**datos, **campos_imagen}
+    res = await db["prendas"].insert_one(prenda_dict)
+    if jpeg:
+        precalcular_descripcion(str(res.inserted_id), campos_imagen["probador_clave"], jpeg)
+    await registrar_cambio(str(res.inserted_id), prenda_dict)
+    grafo.registrar("prenda", id=str(res.inserted_id), tipo=prenda_dict["tipo"], marca=prenda_dict["marca"])
+    return PrendaOut(id=str(res.inserted_id), **prenda_dict)
+
+async def actualizar_prenda(
+    prenda: dict,
+    cambios: dict,
+    campos_imagen: Optional[dict] = None,
+    jpeg: Optional[bytes] = None,
+) -> PrendaOut:
+    """Aplica `cambios` y, si viene, la imagen nueva (la anterior se borra en segundo plano)."""
+    prenda_id = str(prenda["_id"])
+    update = {"$set": {**cambios, **(campos_imagen or {})}}
+    if campos_imagen:
+        # La descripción para el probador era de la imagen anterior
+        update["$unset"] = {"probador_descripcion": ""}
+        if "probador_clave" not in campos_imagen:
+            update["$unset"]["probador_clave"] = ""
+    await db["prendas"].update_one({"_id": prenda["_id"]}, update)
+    if campos_imagen:
+        # Elimino antigua, en segundo plano (salvo que sea la misma)
+        if prenda.get("image_public_id") != campos_imagen["image_public_id"]:
+            await borrados.encolar(prenda.get("image_public_id"))
+        if jpeg:
+            precalcular_descripcion(prenda_id, campos_imagen["probador_clave"], jpeg)
+    prenda_actualizada = await db["prendas"].find_one({"_id": prenda["_id"]})
+    await registrar_cambio(prenda_id, prenda_actualizada)
+    grafo.registrar("prenda", id=prenda_id, tipo=prenda_actualizada["tipo"], marca=prenda_actualizada["marca"])
+    return PrendaOut(
+        id=str(prenda_actualizada["_id"]),
+        nombre=prenda_actualizada["nombre"],
+        tipo=prenda_actualizada["tipo"],
+        descripcion=prenda_actualizada["descripcion"],
+        marca=prenda_actualizada["marca"],
+        image_path=prenda_actualizada["image_path"],
+        imagenes=prenda_actualizada.get("imagenes"),
+    )
+
 @router.post("", response_model=PrendaOut)
 async def crear_prenda(
     nombre: str = Form(...),
@@ -20,20 +115,14 @@ async def crear_prenda(
     try:
         # Reset buffer
         file.file.seek(0)
-        image_url, public_id = await upload_image_to_cloudinary(file, folder="prendas")
+        campos_imagen, jpeg = await subir_imagen_prenda(file)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"No se pudo subir imagen: {e}")
 
-    prenda_dict = {
-        "nombre": nombre,
-        "tipo": tipo,
-        "descripcion": descripcion,
-        "marca": marca,
-        "image_path": image_url,
-        "image_public_id": public_id
-    }
-    res = db["prendas"].insert_one(prenda_dict)
-    return PrendaOut(id=str(res.inserted_id), **prenda_dict)
+    datos = {"nombre": nombre, "tipo": tipo, "descripcion": descripcion, "marca": marca}
+    return await insertar_prenda(datos, campos_imagen, jpeg)
 
 @router.patch("/{prenda_id}", response_model=PrendaOut)
 async def editar_prenda(
@@ -44,7 +133,7 @@ async def editar_prenda(
     marca: str = Form(None),
     file: UploadFile = File(None)
 ):
-    prenda = db["prendas"].find_one({"_id": ObjectId(prenda_id)})
+    prenda = await db["prendas"].find_one({"_id": ObjectId(prenda_id)})
     if not prenda:
         raise HTTPException(status_code=404, detail="Prenda no encontrada")
 
@@ -54,88 +143,221 @@ async def editar_prenda(
     if descripcion: cambios["descripcion"] = descripcion
     if marca:       cambios["marca"]       = marca
 
+    campos_imagen, jpeg = None, None
     if file:
-        # Elimino antigua
-        antiguo_id = prenda.get("image_public_id")
-        if antiguo_id:
-            await delete_image_cloudinary(antiguo_id)
-
         try:
             file.file.seek(0)
-            image_url, public_id = await upload_image_to_cloudinary(file, folder="prendas")
+            campos_imagen, jpeg = await subir_imagen_prenda(file)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"No se pudo actualizar imagen: {e}")
 
-        cambios["image_path"]        = image_url
-        cambios["image_public_id"]   = public_id
-
-    if not cambios:
+    if not cambios and not campos_imagen:
         raise HTTPException(status_code=400, detail="Nada para actualizar")
 
-    db["prendas"].update_one({"_id": ObjectId(prenda_id)}, {"$set": cambios})
-    prenda_actualizada = db["prendas"].find_one({"_id": ObjectId(prenda_id)})
-    return PrendaOut(
-        id=str(prenda_actualizada["_id"]),
-        nombre=prenda_actualizada["nombre"],
-        tipo=prenda_actualizada["tipo"],
-        descripcion=prenda_actualizada["descripcion"],
-        marca=prenda_actualizada["marca"],
-        image_path=prenda_actualizada["image_path"]
-    )
+    return await actualizar_prenda(prenda, cambios, campos_imagen, jpeg)
 
 @router.delete("/{prenda_id}")
 async def eliminar_prenda(prenda_id: str):
-    prenda = db["prendas"].find_one({"_id": ObjectId(prenda_id)})
+    prenda = await db["prendas"].find_one({"_id": ObjectId(prenda_id)})
     if not prenda:
         raise HTTPException(status_code=404, detail="Prenda no encontrada")
 
-    # Borro en Cloudinary
-    public_id = prenda.get("image_public_id")
-    if public_id:
-        await delete_image_cloudinary(public_id)
-
-    res = db["prendas"].delete_one({"_id": ObjectId(prenda_id)})
+    res = await db["prendas"].delete_one({"_id": ObjectId(prenda_id)})
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Prenda no encontrada")
+    # Borro en Cloudinary, en segundo plano
+    await borrados.encolar(prenda.get("image_public_id"))
+    await registrar_cambio(prenda_id)
+    grafo.registrar("prenda_borrada", id=prenda_id)
     return {"msg": "Prenda eliminada"}
 
+@router.get("/buscar", response_model=list[PrendaParcial], response_model_exclude_unset=True)
+async def buscar_prendas(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    modo: Literal["relevancia", "prefijo"] = "relevancia",
+    fields: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    tamano: Optional[TamanoImagen] = None,
+):
+    async def generar():
+        proyeccion = proyeccion_prendas(fields)
+        ids = await buscar_ids(q, modo, limit)
+        # Se respeta el orden de relevancia
+        return await prendas_por_ids(ids, proyeccion, tamano), {}
+
+    return await catalogo_cache.responder(request, generar)
+
+@router.get("/export")
+async def exportar_prendas(
+    tipo: list[str] = Query([]),
+    marca: list[str] = Query([]),
+    formato: FormatoExport = "ndjson",
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    tamano: Optional[TamanoImagen] = None,
+):
+    """Catálogo completo en streaming (NDJSON o CSV); se reanuda con ?cursor=<último id>."""
+    proyeccion = proyeccion_prendas(fields)
+    return exportar(
+        "prendas",
+        filtro_prendas(tipo, marca),
+        proyeccion_con_tamano(proyeccion, tamano),
+        lambda d: datos_prenda(d, proyeccion, tamano),
+        tuple(proyeccion),
+        formato,
+        cursor,
+    )
+
+@router.get("/{prenda_id}/similares", response_model=list[PrendaParcial], response_model_exclude_unset=True)
+async def prendas_similares(
+    prenda_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    limit: int = Query(12, ge=1, le=100),
+    tamano: Optional[TamanoImagen] = None,
+):
+    async def generar():
+        proyeccion = proyeccion_prendas(fields)
+        await indice_visual.asegurar_vigente()
+        if prenda_id not in indice_visual.filas:
+            existe = ObjectId.is_valid(prenda_id) and await db["prendas"].find_one({"_id": ObjectId(prenda_id)}, {"_id": 1})
+            if not existe:
+                raise HTTPException(status_code=404, detail="Prenda no encontrada")
+            return [], {}
+        ids = [i for i, _ in indice_visual.similares(prenda_id, limit)]
+        # De más parecida a menos
+        return await prendas_por_ids(ids, proyeccion, tamano), {}
+
+    return await catalogo_cache.responder(request, generar)
+
 @router.get("/{prenda_id}", response_model=PrendaOut)
-def obtener_prenda(prenda_id: str):
-    prenda = db["prendas"].find_one({"_id": ObjectId(prenda_id)})
-    if not prenda:
-        raise HTTPException(status_code=404, detail="Prenda no encontrada")
-    return PrendaOut(
-        id=str(prenda["_id"]),
-        nombre=prenda["nombre"],
-        tipo=prenda["tipo"],
-        descripcion=prenda["descripcion"],
-        marca=prenda["marca"],
-        image_path=prenda.get("image_path")
+async def obtener_prenda(prenda_id: str, request: Request, tamano: Optional[TamanoImagen] = None):
+    async def generar():
+        prenda = await db["prendas"].find_one({"_id": ObjectId(prenda_id)})
+        if not prenda:
+            raise HTTPException(status_code=404, detail="Prenda no encontrada")
+        return PrendaOut(
+            id=str(prenda["_id"]),
+            nombre=prenda["nombre"],
+            tipo=prenda["tipo"],
+            descripcion=prenda["descripcion"],
+            marca=prenda["marca"],
+            image_path=imagen_en_tamano(prenda.get("image_path"), prenda.get("imagenes"), tamano),
+            imagenes=prenda.get("imagenes"),
+        ).dict(), {}
+
+    return await catalogo_cache.responder(request, generar)
+
+def filtro_prendas(tipos: list[str], marcas: list[str]) -> dict:
+    filtro: dict = {}
+    tipos = [t for t in tipos if t]
+    marcas = [m for m in marcas if m]
+    if tipos:
+        filtro["tipo"] = tipos[0] if len(tipos) == 1 else {"$in": tipos}
+    if marcas:
+        filtro["marca"] = marcas[0] if len(marcas) == 1 else {"$in": marcas}
+    return filtro
+
+def proyeccion_prendas(fields: Optional[str]) -> dict:
+    if not fields:
+        campos = CAMPOS_PRENDA
+    else:
+        campos = tuple(f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id")
+        invalidos = [c for c in campos if c not in CAMPOS_PRENDA]
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalidos)}")
+    return {c: 1 for c in campos}
+
+def datos_prenda(d: dict, proyeccion: dict, tamano: Optional[str] = None) -> dict:
+    """Con ?tamano= el image_path es el del derivado pedido (thumb/card/full)."""
+    campos = {c: d.get(c) for c in proyeccion}
+    if tamano and "image_path" in campos:
+        campos["image_path"] = imagen_en_tamano(d.get("image_path"), d.get("imagenes"), tamano)
+    return {"id": str(d["_id"]), **campos}
+
+def proyeccion_con_tamano(proyeccion: dict, tamano: Optional[str]) -> dict:
+    # Hace falta leer los derivados aunque el cliente no los haya pedido.
+    # Siempre una copia: el driver puede completarla (_id) y `proyeccion`
+    # define las claves de cada fila
+    if tamano and "image_path" in proyeccion:
+        return {**proyeccion, "imagenes": 1}
+    return {**proyeccion}
+
+async def prendas_por_ids(ids: list[str], proyeccion: dict, tamano: Optional[str]) -> list[dict]:
+    """Las prendas de `ids` en ese mismo orden (las que ya no existen se omiten)."""
+    docs = await db["prendas"].find(
+        {"_id": {"$in": [ObjectId(i) for i in ids]}},
+        proyeccion_con_tamano(proyeccion, tamano),
+    ).to_list(None)
+    por_id = {str(d["_id"]): d for d in docs}
+    return [datos_prenda(por_id[i], proyeccion, tamano) for i in ids if i in por_id]
+
+async def consultar_prendas(
+    filtro: dict,
+    fields: Optional[str],
+    limit: int,
+    cursor: Optional[str],
+    tamano: Optional[str] = None,
+) -> tuple[list[dict], dict]:
+    """
+    Filtro, proyección y paginación por keyset sobre _id, todo resuelto en
+    Mongo. Si hay más resultados, el cursor de la página siguiente va en el
+    header X-Next-Cursor.
+    """
+    proyeccion = proyeccion_prendas(fields)
+    if cursor:
+        try:
+            filtro = {**filtro, "_id": {"$gt": ObjectId(cursor)}}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    docs = await db["prendas"].find(filtro, proyeccion_con_tamano(proyeccion, tamano)).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = str(docs[-1]["_id"])
+
+    return [datos_prenda(d, proyeccion, tamano) for d in docs], headers
+
+async def responder_listado(request: Request, filtro: dict, fields, limit, cursor, tamano=None):
+    return await catalogo_cache.responder(
+        request,
+        lambda: consultar_prendas(filtro, fields, limit, cursor, tamano),
     )
 
-@router.get("", response_model=list[PrendaOut])
-def listar_prendas():
-    docs = db["prendas"].find()
-    return [
-        PrendaOut(
-            id=str(d["_id"]),
-            nombre=d["nombre"],
-            tipo=d["tipo"],
-            descripcion=d["descripcion"],
-            marca=d["marca"],
-            image_path=d.get("image_path")
-        )
-        for d in docs
-    ]
-
-@router.get("/tipo/{tipo}", response_model=list[PrendaOut])
-def listar_por_tipo(tipo: str):
-    return listar_prendas() if tipo == "" else [
-        p for p in listar_prendas() if p.tipo == tipo
-    ]
-
-@router.get("/marca/{marca}", response_model=list[PrendaOut])
-def listar_por_marca(marca: str):
-    return listar_prendas() if marca == "" else [
-        p for p in listar_prendas() if p.marca == marca
-    ]
+@router.get("", response_model=list[PrendaParcial], response_model_exclude_unset=True)
+async def listar_prendas(
+    request: Request,
+    tipo: list[str] = Query([]),
+    marca: list[str] = Query([]),
+    fields: Optional[str] = None,
+    limit: int = Query(PRENDAS_LIMITE_DEFECTO, ge=1, le=PRENDAS_LIMITE_MAX),
+    cursor: Optional[str] = None,
+    tamano: Optional[TamanoImagen] = None,
+):
+    return await responder_listado(request, filtro_prendas(tipo, marca), fields, limit, cursor, tamano)
+
+@router.get("/tipo/{tipo}", response_model=list[PrendaParcial], response_model_exclude_unset=True)
+async def listar_por_tipo(
+    tipo: str,
+    request: Request,
+    fields: Optional[str] = None,
+    limit: int = Query(PRENDAS_LIMITE_DEFECTO, ge=1, le=PRENDAS_LIMITE_MAX),
+    cursor: Optional[str] = None,
+    tamano: Optional[TamanoImagen] = None,
+):
+    return await responder_listado(request, filtro_prendas([tipo], []), fields, limit, cursor, tamano)
+
+@router.get("/marca/{marca}", response_model=list[PrendaParcial], response_model_exclude_unset=True)
+async def listar_por_marca(
+    marca: str,
+    request: Request,
+    fields: Optional[str] = None,
+    limit: int = Query(PRENDAS_LIMITE_DEFECTO, ge=1, le=PRENDAS_LIMITE_MAX),
+    cursor: Optional[str] = None,
+    tamano: Optional[TamanoImagen] = None,
+):
+    return await responder_listado(request, filtro_prendas([], [marca]), fields, limit, cursor, tamano)
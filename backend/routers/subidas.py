@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from backend.db.mongo import db
+from backend.models.prenda import PrendaOut
+from backend.models.subida import ConfirmarSubidaIn, FirmaSubidaIn, FirmaSubidaOut
+from backend.routers.prendas import CAMPOS_PRENDA, actualizar_prenda, insertar_prenda, preparar_imagen_prenda
+from backend.routers.users import cambiar_profile_image
+from backend.utils.cloudinary_helper import descargar_imagen, url_limitada
+from backend.utils.imagenes import IMAGEN_MAX_LADO
+from backend.utils.subida_directa import firmar, verificar
+
+# Subida directa a Cloudinary: firma -> el cliente sube -> confirmar.
+# La imagen no pasa por la API, que solo recibe estos JSON
+router = APIRouter(prefix="/subidas", tags=["subidas"])
+
+async def _buscar(coleccion: str, id_: str, detalle: str, proyeccion: dict = None) -> dict:
+    doc = ObjectId.is_valid(id_) and await db[coleccion].find_one({"_id": ObjectId(id_)}, proyeccion)
+    if not doc:
+        raise HTTPException(status_code=404, detail=detalle)
+    return doc
+
+async def _prenda_de_subida(public_id: str) -> PrendaOut:
+    """La prenda ya creada con esa imagen (índice único prendas.image_public_id), o None."""
+    d = await db["prendas"].find_one({"image_public_id": public_id}, {c: 1 for c in (*CAMPOS_PRENDA, "image_public_id")})
+    return PrendaOut(id=str(d.pop("_id")), **d) if d else None
+
+@router.post("/firma", response_model=FirmaSubidaOut)
+async def firmar_subida(pedido: FirmaSubidaIn):
+    # El destino se valida antes de firmar: no se reparten firmas para ids que no existen
+    if pedido.destino == "perfil":
+        if not pedido.destino_id:
+            raise HTTPException(status_code=400, detail="Falta destino_id (user_id)")
+        await _buscar("usuarios", pedido.destino_id, "Usuario no encontrado", {"_id": 1})
+    elif pedido.destino_id:
+        await _buscar("prendas", pedido.destino_id, "Prenda no encontrada", {"_id": 1})
+    return firmar(pedido.destino, pedido.destino_id)
+
+@router.post("/confirmar")
+async def confirmar_subida(pedido: ConfirmarSubidaIn):
+    """
+    Asocia la imagen subida a su destino. Devuelve la prenda (creada o
+    editada) o, para el perfil, {"profile_image_path", "profile_imagenes"}.
+    """
+    subida = await verificar(pedido.token, pedido.public_id, pedido.version, pedido.signature)
+
+    if subida["destino"] == "perfil":
+        u = await _buscar("usuarios", subida["destino_id"], "Usuario no encontrado", {"profile_image_public_id": 1})
+        return await cambiar_profile_image(u, subida["url"], subida["public_id"])
+
+    if not subida["destino_id"]:
+        if pedido.prenda is None:
+            raise HTTPException(status_code=400, detail="Faltan los datos de la prenda")
+        # Confirmar dos veces la misma subida no crea dos prendas: devuelve la que ya está
+        existente = await _prenda_de_subida(subida["public_id"])
+        if existente:
+            return existente
+    else:
+        prenda = await _buscar("prendas", subida["destino_id"], "Prenda no encontrada")
+
+    # Firma visual y copia para el probador salen de una versión reducida, no del original
+    try:
+        contenido = await descargar_imagen(url_limitada(subida["url"], IMAGEN_MAX_LADO))
+    except Exception as e:
+        print(f"No se pudo bajar la imagen subida {subida['public_id']}: {e}")
+        contenido = b""
+    campos_imagen, jpeg = await preparar_imagen_prenda(subida["url"], subida["public_id"], contenido)
+
+    if not subida["destino_id"]:
+        try:
+            return await insertar_prenda(pedido.prenda.dict(), campos_imagen, jpeg)
+        except DuplicateKeyError:
+            # Otra confirmación de la misma subida insertó primero
+            existente = await _prenda_de_subida(subida["public_id"])
+            if not existente:
+                raise HTTPException(status_code=409, detail="Esa imagen ya está asociada a una prenda")
+            return existente
+    return await actualizar_prenda(prenda, {}, campos_imagen, jpeg)
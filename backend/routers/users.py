@@ -1,71 +1,217 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, status
+import os
+from typing import Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Response, status
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from backend.db.mongo import db
-from backend.models.user import UserCreate, UserOut
-from backend.utils.cloudinary_helper import upload_image_to_cloudinary, delete_image_cloudinary
+from backend.models.user import UserCreate, UserOut, UserParcial, FavoritosBulk
+from backend.models.prenda import PrendaOut, TamanoImagen
+from backend.utils.cloudinary_helper import upload_image_to_cloudinary, imagen_en_tamano, urls_derivadas
+from backend.utils.borrados import borrados
+from backend.utils.cache_usuarios import cache_usuarios
+from backend.utils.exportar import FormatoExport, exportar
+from backend.utils.respuestas import RespuestaJSON
+from backend.utils.grafo import grafo, prenda_id_por_imagen, prenda_ids_por_imagen
+from backend.utils import historial
+from backend.utils.historial import HISTORIAL_PAGINA, HISTORIAL_PAGINA_MAX
+
+USUARIOS_LIMITE_DEFECTO = int(os.getenv("USUARIOS_LIMITE_DEFECTO", "100"))
+USUARIOS_LIMITE_MAX = int(os.getenv("USUARIOS_LIMITE_MAX", "500"))
 
 router = APIRouter(prefix="/usuarios", tags=["usuarios"])
 
-def normalize_user(u: dict) -> dict:
-    return {
-        "id": str(u["_id"]),
-        "username": u.get("username", ""),
-        "email": u.get("email", ""),
-        "rol": u.get("rol", ""),
-        "profile_image_path": u.get("profile_image_path"),
-        "historial": [
-            entry["url"] if isinstance(entry, dict) and "url" in entry else str(entry)
-            for entry in u.get("historial", [])
-        ],
-        "favoritos": [
+# Campos de ?fields= y lo que hay que leer del documento para cada uno
+CAMPOS_USUARIO = {
+    "username": ("username",),
+    "email": ("email",),
+    "rol": ("rol",),
+    "profile_image_path": ("profile_image_path", "profile_imagenes"),
+    "profile_imagenes": ("profile_imagenes",),
+    "favoritos": ("favoritos",),
+    # Vive en su propia colección (su primera página): se evita con ?fields= sin historial
+    "historial": (),
+}
+CAMPOS_USUARIO_DEFECTO = tuple(CAMPOS_USUARIO)
+# El export no lo ofrece: sería una consulta más por cada usuario
+CAMPOS_USUARIO_EXPORT = tuple(c for c in CAMPOS_USUARIO if c != "historial")
+
+def campos_usuario(fields: Optional[str], permitidos=CAMPOS_USUARIO_DEFECTO) -> tuple:
+    if not fields:
+        return permitidos
+    campos = tuple(f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id")
+    invalidos = [c for c in campos if c not in permitidos]
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalidos)}")
+    return campos
+
+def proyeccion_usuario(campos: tuple) -> dict:
+    # Una proyección vacía traería el documento entero
+    return {k: 1 for c in campos for k in CAMPOS_USUARIO[c]} or {"_id": 1}
+
+def normalize_user(u: dict, tamano: Optional[str] = None, campos: tuple = CAMPOS_USUARIO_DEFECTO) -> dict:
+    """Solo los `campos` pedidos; con `tamano` (thumb/card/full) la imagen de perfil apunta a ese derivado."""
+    valores = {
+        "username": lambda: u.get("username", ""),
+        "email": lambda: u.get("email", ""),
+        "rol": lambda: u.get("rol", ""),
+        "profile_image_path": lambda: imagen_en_tamano(u.get("profile_image_path"), u.get("profile_imagenes"), tamano),
+        "profile_imagenes": lambda: u.get("profile_imagenes"),
+        "favoritos": lambda: [
             entry["url"] if isinstance(entry, dict) and "url" in entry else str(entry)
             for entry in u.get("favoritos", [])
         ],
     }
+    return {"id": str(u["_id"]), **{c: valores[c]() for c in campos if c in valores}}
+
+async def usuario_parcial(u: dict, tamano: Optional[str], campos: tuple) -> dict:
+    datos = normalize_user(u, tamano, campos)
+    if "historial" in campos:
+        entradas, _ = await historial.pagina(str(u["_id"]))
+        datos["historial"] = historial.urls(entradas, tamano)
+    return datos
+
+async def _existe(user_id: str):
+    if not await db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+async def quitar_por_indice(user_id: str, campo: str, idx: int) -> dict:
+    """
+    Quita atómicamente el elemento `idx` del array `campo` con un update por
+    pipeline y devuelve el array tal como estaba antes (solo ese campo).
+    """
+    if idx < 0:
+        raise HTTPException(status_code=400, detail="Índice fuera de rango")
+
+    # Lo anterior a idx + lo posterior (hasta el final); el filtro garantiza que idx existe
+    partes = [{"$slice": [f"${campo}", idx + 1, 2**31 - 1]}]
+    if idx > 0:
+        partes.insert(0, {"$slice": [f"${campo}", idx]})
+
+    antes = await db["usuarios"].find_one_and_update(
+        {"_id": ObjectId(user_id), f"{campo}.{idx}": {"$exists": True}},
+        [{"$set": {campo: {"$concatArrays": partes}}}],
+        projection={campo: 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if antes:
+        return antes
+
+    # No hubo match: o no existe el usuario o el índice no existe
+    await _existe(user_id)
+    raise HTTPException(status_code=400, detail="Índice fuera de rango")
 
 
 @router.post("/", response_model=UserOut)
 async def crear_usuario(user: UserCreate):
-    if db["usuarios"].find_one({"email": user.email}):
+    if await db["usuarios"].find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="El email ya está registrado."
         )
     user_dict = user.dict()
     user_dict.update({
-        "historial": [],
         "favoritos": [],
         "profile_image_path": None,
         "profile_image_public_id": None
     })
-    res = db["usuarios"].insert_one(user_dict)
-    nuevo = db["usuarios"].find_one({"_id": res.inserted_id})
-    return normalize_user(nuevo)
+    try:
+        res = await db["usuarios"].insert_one(user_dict)
+    except DuplicateKeyError:
+        # Índice único usuarios.email: cubre la carrera entre el chequeo y el insert
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El email ya está registrado."
+        )
+    # insert_one completa el _id en user_dict: no hace falta releerlo
+    grafo.registrar("usuario", id=str(res.inserted_id))
+    return {**normalize_user(user_dict), "historial": []}
 
-@router.get("/login", response_model=UserOut)
-def login(email: str, password: str):
-    u = db["usuarios"].find_one({
+@router.get("/login", response_model=UserParcial, response_model_exclude_unset=True)
+async def login(
+    email: str,
+    password: str,
+    tamano: Optional[TamanoImagen] = None,
+    fields: Optional[str] = None,
+):
+    campos = campos_usuario(fields)
+    u = await db["usuarios"].find_one({
         "email": email,
         "password": password
-    })
+    }, proyeccion_usuario(campos))
     if not u:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos"
         )
-    return normalize_user(u)
+    return await usuario_parcial(u, tamano, campos)
 
-@router.get("/", response_model=list[UserOut])
-def obtener_usuarios():
-    users = list(db["usuarios"].find())
-    return [normalize_user(u) for u in users]
+@router.get("/", response_model=list[UserParcial], response_model_exclude_unset=True)
+async def obtener_usuarios(
+    tamano: Optional[TamanoImagen] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=USUARIOS_LIMITE_MAX),
+    cursor: Optional[str] = None,
+):
+    """
+    Todos los usuarios, como siempre. Con `limit` o `cursor` se pagina por
+    _id (X-Next-Cursor); para volcarlos todos conviene /usuarios/export.
+    """
+    campos = campos_usuario(fields)
+    headers = {}
+    if limit is None and cursor is None:
+        users = await db["usuarios"].find({}, proyeccion_usuario(campos)).to_list(None)
+    else:
+        limit = limit or USUARIOS_LIMITE_DEFECTO
+        filtro = {}
+        if cursor:
+            try:
+                filtro["_id"] = {"$gt": ObjectId(cursor)}
+            except InvalidId:
+                raise HTTPException(status_code=400, detail="Cursor inválido")
+        users = await db["usuarios"].find(filtro, proyeccion_usuario(campos)).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+        if len(users) > limit:
+            users = users[:limit]
+            headers["X-Next-Cursor"] = str(users[-1]["_id"])
+    filas = [normalize_user(u, tamano, campos) for u in users]
+    if "historial" in campos:
+        paginas = await historial.primeras_paginas([u["_id"] for u in users])
+        for fila, u in zip(filas, users):
+            fila["historial"] = historial.urls(paginas[u["_id"]], tamano)
+    # Los dicts van directo a JSON: sin validar cada fila contra UserParcial
+    return RespuestaJSON(filas, headers=headers)
 
-@router.get("/{user_id}", response_model=UserOut)
-def obtener_usuario(user_id: str):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
-    if not u:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return normalize_user(u)
+@router.get("/export")
+async def exportar_usuarios(
+    formato: FormatoExport = "ndjson",
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    tamano: Optional[TamanoImagen] = None,
+):
+    """Todos los usuarios en streaming (NDJSON o CSV); se reanuda con ?cursor=<último id>."""
+    campos = campos_usuario(fields, CAMPOS_USUARIO_EXPORT)
+    return exportar(
+        "usuarios",
+        {},
+        proyeccion_usuario(campos),
+        lambda u: normalize_user(u, tamano, campos),
+        campos,
+        formato,
+        cursor,
+    )
+
+@router.get("/{user_id}", response_model=UserParcial, response_model_exclude_unset=True)
+async def obtener_usuario(user_id: str, tamano: Optional[TamanoImagen] = None, fields: Optional[str] = None):
+    campos = campos_usuario(fields)
+
+    async def generar():
+        u = await db["usuarios"].find_one({"_id": ObjectId(user_id)}, proyeccion_usuario(campos))
+        if not u:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        return await usuario_parcial(u, tamano, campos), {}
+
+    return await cache_usuarios.responder(user_id, f"perfil|{','.join(campos)}|{tamano or ''}", generar)
     
 @router.patch("/{user_id}", response_model=UserOut)
 async def editar_usuario(
@@ -81,38 +227,38 @@ async def editar_usuario(
     if not cambios:
         raise HTTPException(status_code=400, detail="Nada para actualizar")
 
-    res = db["usuarios"].update_one(
-        {"_id": ObjectId(user_id)},
-        {"$set": cambios}
-    )
-    if res.matched_count == 0:
+    try:
+        u = await db["usuarios"].find_one_and_update(
+            {"_id": ObjectId(user_id)},
+            {"$set": cambios},
+            projection=proyeccion_usuario(CAMPOS_USUARIO_DEFECTO),
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El email ya está registrado."
+        )
+    if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
-    return normalize_user(u)
+    await cache_usuarios.invalidar(user_id)
+    return await usuario_parcial(u, None, CAMPOS_USUARIO_DEFECTO)
 
 @router.delete("/{user_id}")
 async def eliminar_usuario(user_id: str):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
+    u = await db["usuarios"].find_one_and_delete(
+        {"_id": ObjectId(user_id)},
+        projection={"profile_image_public_id": 1}
+    )
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    # Borrar imagen de perfil en Cloudinary
-    pid = u.get("profile_image_public_id")
-    if pid:
-        await delete_image_cloudinary(pid)
-
-    # Borrar historial
-    for entry in u.get("historial", []):
-        public_id = entry.get("public_id") if isinstance(entry, dict) else None
-        if public_id:
-            await delete_image_cloudinary(public_id)
-
-    # Borrar usuario en Mongo
-    res = db["usuarios"].delete_one({"_id": ObjectId(user_id)})
-    if res.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    # Imagen de perfil e historial se borran de Cloudinary en segundo plano
+    await borrados.encolar(u.get("profile_image_public_id"))
+    await historial.borrar_de_usuario(user_id)
+    await cache_usuarios.invalidar(user_id)
 
+    grafo.registrar("usuario_borrado", id=user_id)
     return {"msg": "Usuario eliminado"}
 
 @router.patch("/{user_id}/profile_image")
@@ -120,97 +266,168 @@ async def subir_profile_image(
     user_id: str,
     file: UploadFile = File(...)
 ):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
+    # Solo lo que hace falta para reemplazar la imagen anterior
+    u = await db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"profile_image_public_id": 1})
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    # Borro la antigua si existe
-    old_pid = u.get("profile_image_public_id")
-    if old_pid:
-        await delete_image_cloudinary(old_pid)
-
     # Subo nueva
     file.file.seek(0)
     url, public_id = await upload_image_to_cloudinary(file, folder="usuarios/profile")
-    db["usuarios"].update_one(
-        {"_id": ObjectId(user_id)},
+    return await cambiar_profile_image(u, url, public_id)
+
+async def cambiar_profile_image(u: dict, url: str, public_id: str) -> dict:
+    """Guarda la imagen de perfil ya subida (multipart o subida directa)."""
+    imagenes = urls_derivadas(url)
+    await db["usuarios"].update_one(
+        {"_id": u["_id"]},
         {"$set": {
             "profile_image_path": url,
-            "profile_image_public_id": public_id
+            "profile_image_public_id": public_id,
+            "profile_imagenes": imagenes,
         }}
     )
-    return {"profile_image_path": url}
+    await cache_usuarios.invalidar(str(u["_id"]))
+    # La antigua se borra en segundo plano (salvo que sea la misma)
+    if u.get("profile_image_public_id") != public_id:
+        await borrados.encolar(u.get("profile_image_public_id"))
+    return {"profile_image_path": url, "profile_imagenes": imagenes}
 
 # Los endpoints de historial y favoritos solo devuelven strings, no dicts
 @router.get("/{user_id}/historial")
-def ver_historial(user_id: str):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
-    if not u:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return {"historial": normalize_user(u)["historial"]}
+async def ver_historial(
+    user_id: str,
+    response: Response,
+    tamano: Optional[TamanoImagen] = None,
+    limit: int = Query(HISTORIAL_PAGINA, ge=1, le=HISTORIAL_PAGINA_MAX),
+    cursor: Optional[str] = None,
+):
+    """De la prueba más nueva a la más vieja; el cursor de la página siguiente va en X-Next-Cursor."""
+    async def generar():
+        await _existe(user_id)
+        entradas, siguiente = await historial.pagina(user_id, limit, cursor)
+        return {"historial": historial.urls(entradas, tamano)}, {"X-Next-Cursor": siguiente} if siguiente else {}
+
+    # Solo la primera página (la que se consulta después de cada prueba) va al cache
+    if cursor:
+        contenido, headers = await generar()
+        response.headers.update(headers)
+        return contenido
+    return await cache_usuarios.responder(user_id, f"historial|{limit}|{tamano or ''}", generar)
 
 @router.delete("/{user_id}/historial/{idx}")
 async def eliminar_img_historial(user_id: str, idx: int):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
-    if not u:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
-    historial = u.get("historial", [])
-    if idx < 0 or idx >= len(historial):
+    """`idx` es la posición en el orden de GET /historial; devuelve su primera página."""
+    if not await historial.quitar(user_id, idx):
+        await _existe(user_id)
         raise HTTPException(status_code=400, detail="Índice fuera de rango")
-
-    # Borro de Cloudinary
-    entry = historial.pop(idx)
-    pid = entry.get("public_id") if isinstance(entry, dict) else None
-    if pid:
-        await delete_image_cloudinary(pid)
-
-    # Actualizo en DB y devuelvo
-    db["usuarios"].update_one(
-        {"_id": ObjectId(user_id)},
-        {"$set": {"historial": historial}}
-    )
-    return {"historial": [e["url"] if isinstance(e, dict) else e for e in historial]}
+    entradas, _ = await historial.pagina(user_id)
+    return {"historial": historial.urls(entradas)}
 
 @router.get("/{user_id}/favoritos")
-def ver_favoritos(user_id: str):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
-    if not u:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return {"favoritos": normalize_user(u)["favoritos"]}
+async def ver_favoritos(user_id: str):
+    async def generar():
+        u = await db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"favoritos": 1})
+        if not u:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        return {"favoritos": normalize_user(u)["favoritos"]}, {}
+
+    return await cache_usuarios.responder(user_id, "favoritos", generar)
 
 @router.post("/{user_id}/favoritos")
 async def agregar_favorito(
     user_id: str,
     image_url: str = Form(...)
 ):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
+    # $addToSet es atómico: dos clics simultáneos no pisan la lista
+    u = await db["usuarios"].find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$addToSet": {"favoritos": image_url}},
+        projection={"favoritos": 1},
+        return_document=ReturnDocument.AFTER
+    )
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    await cache_usuarios.invalidar(user_id)
 
-    favoritos = u.get("favoritos", [])
-    # Suponemos que recibís la URL y el public_id lo sacás de la URL
-    if image_url not in favoritos:
-        favoritos.append(image_url)
-        db["usuarios"].update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": {"favoritos": favoritos}}
-        )
-    return {"favoritos": favoritos}
+    prenda_id = await prenda_id_por_imagen(image_url)
+    if prenda_id:
+        grafo.registrar("favorito", user_id=user_id, prenda_id=prenda_id)
+    return {"favoritos": u.get("favoritos", [])}
 
-@router.delete("/{user_id}/favoritos/{idx}")
-def quitar_favorito(user_id: str, idx: int):
-    u = db["usuarios"].find_one({"_id": ObjectId(user_id)})
+@router.post("/{user_id}/favoritos/bulk")
+async def sincronizar_favoritos(user_id: str, cambios: FavoritosBulk):
+    quitar = list(dict.fromkeys(cambios.quitar))
+    # Si una URL viene en las dos listas, gana quitar
+    agregar = [url for url in dict.fromkeys(cambios.agregar) if url not in quitar]
+    if not agregar and not quitar:
+        raise HTTPException(status_code=400, detail="Nada para actualizar")
+
+    # Un único update por pipeline: primero se filtra lo quitado y después se
+    # agrega al final lo que no estaba, preservando el orden existente.
+    # Las URLs van en $literal: una que empiece con "$" sería un campo del documento
+    u = await db["usuarios"].find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        [
+            {"$set": {"favoritos": {"$filter": {
+                "input": {"$ifNull": ["$favoritos", []]},
+                "cond": {"$eq": [{"$in": ["$$this", {"$literal": quitar}]}, False]},
+            }}}},
+            {"$set": {"favoritos": {"$concatArrays": ["$favoritos", {"$filter": {
+                "input": {"$literal": agregar},
+                "cond": {"$eq": [{"$in": ["$$this", "$favoritos"]}, False]},
+            }}]}}},
+        ],
+        projection={"favoritos": 1},
+        return_document=ReturnDocument.AFTER
+    )
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    await cache_usuarios.invalidar(user_id)
 
-    favs = u.get("favoritos", [])
-    if idx < 0 or idx >= len(favs):
-        raise HTTPException(status_code=400, detail="Índice fuera de rango")
+    prendas = await prenda_ids_por_imagen(agregar + quitar)
+    for url in agregar:
+        if url in prendas:
+            grafo.registrar("favorito", user_id=user_id, prenda_id=prendas[url])
+    for url in quitar:
+        if url in prendas:
+            grafo.registrar("favorito_quitado", user_id=user_id, prenda_id=prendas[url])
+    return {"favoritos": u.get("favoritos", [])}
 
-    favs.pop(idx)
-    db["usuarios"].update_one(
-        {"_id": ObjectId(user_id)},
-        {"$set": {"favoritos": favs}}
-    )
+@router.delete("/{user_id}/favoritos/{idx}")
+async def quitar_favorito(user_id: str, idx: int):
+    antes = await quitar_por_indice(user_id, "favoritos", idx)
+    await cache_usuarios.invalidar(user_id)
+    favs = antes["favoritos"]
+
+    quitado = favs.pop(idx)
+    prenda_id = await prenda_id_por_imagen(quitado)
+    if prenda_id:
+        grafo.registrar("favorito_quitado", user_id=user_id, prenda_id=prenda_id)
     return {"favoritos": favs}
+
+@router.get("/{user_id}/recomendaciones", response_model=list[PrendaOut])
+async def recomendaciones(
+    user_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    tamano: Optional[TamanoImagen] = None,
+):
+    # Sale de la proyección precalculada en memoria, no recorre el grafo
+    ids = grafo.recomendar(user_id, limit)
+    if not ids:
+        return []
+    docs = await db["prendas"].find({"_id": {"$in": [ObjectId(i) for i in ids]}}).to_list(None)
+    por_id = {str(d["_id"]): d for d in docs}
+    return RespuestaJSON([
+        {
+            "id": i,
+            "nombre": por_id[i]["nombre"],
+            "tipo": por_id[i]["tipo"],
+            "descripcion": por_id[i]["descripcion"],
+            "marca": por_id[i]["marca"],
+            "image_path": imagen_en_tamano(por_id[i].get("image_path"), por_id[i].get("imagenes"), tamano),
+            "image_public_id": None,
+            "imagenes": por_id[i].get("imagenes"),
+        }
+        for i in ids if i in por_id
+    ])
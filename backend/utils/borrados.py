@@ -0,0 +1,163 @@
+"""
+Cola durable de borrados de imágenes en Cloudinary.
+
+Los handlers solo encolan los public_id (`await borrados.encolar(...)`), un
+insert en Mongo; una tarea de fondo los borra en lotes con la Admin API
+(`delete_resources`, hasta 100 por llamado) y reintenta con backoff
+exponencial. Un reinicio no pierde nada: la cola vive en la colección
+`cloudinary_borrados`.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import BulkWriteError
+
+from backend.db.mongo import db
+from backend.utils.cloudinary_helper import delete_images_cloudinary
+
+BORRADOS_INTERVALO = float(os.getenv("BORRADOS_INTERVALO", "5"))        # segundos
+BORRADOS_LOTE = min(int(os.getenv("BORRADOS_LOTE", "100")), 100)      # límite de la Admin API
+BORRADOS_BACKOFF_BASE = int(os.getenv("BORRADOS_BACKOFF_BASE", "30"))   # segundos
+BORRADOS_BACKOFF_MAX = int(os.getenv("BORRADOS_BACKOFF_MAX", "3600"))   # segundos
+BORRADOS_MAX_INTENTOS = int(os.getenv("BORRADOS_MAX_INTENTOS", "10"))
+# Mientras un worker procesa un lote, los demás no lo toman
+BORRADOS_LEASE = int(os.getenv("BORRADOS_LEASE", "120"))                # segundos
+
+# Respuestas de delete_resources que dan el borrado por terminado
+_RESUELTOS = ("deleted", "not_found")
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _backoff(intentos: int) -> timedelta:
+    return timedelta(seconds=min(BORRADOS_BACKOFF_BASE * 2 ** (intentos - 1), BORRADOS_BACKOFF_MAX))
+
+
+class ColaBorrados:
+    def __init__(self):
+        self._hay_pendientes = asyncio.Event()
+        self._tarea: asyncio.Task = None
+        self.stats = {"encolados": 0, "borrados": 0, "reintentos": 0, "fallidos": 0}
+
+    @property
+    def coleccion(self):
+        return db["cloudinary_borrados"]
+
+    async def encolar(self, *public_ids, cuando: datetime = None):
+        """
+        Registra los public_id a borrar (ya, o a partir de `cuando`). Ignora
+        vacíos y duplicados; si alguno ya estaba agendado para más adelante,
+        se adelanta.
+        """
+        ids = {p for p in public_ids if p}
+        if not ids:
+            return
+        ahora = _ahora()
+        cuando = cuando or ahora
+        try:
+            await self.coleccion.insert_many([
+                {"_id": p, "estado": "pendiente", "intentos": 0, "proximo_intento": cuando, "creado": ahora}
+                for p in ids
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Los que ya estaban encolados (clave duplicada) no son un error
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+            await self.coleccion.update_many(
+                {"_id": {"$in": list(ids)}, "estado": "pendiente", "proximo_intento": {"$gt": cuando}},
+                {"$set": {"proximo_intento": cuando}},
+            )
+        self.stats["encolados"] += len(ids)
+        if cuando <= ahora:
+            self._hay_pendientes.set()
+
+    def iniciar(self):
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def _reclamar(self) -> list[dict]:
+        ahora = _ahora()
+        docs = await self.coleccion.find(
+            {"estado": "pendiente", "proximo_intento": {"$lte": ahora}},
+            {"intentos": 1},
+        ).sort("proximo_intento", 1).limit(BORRADOS_LOTE).to_list(BORRADOS_LOTE)
+        if docs:
+            # Otro worker podría haber tomado alguno entre medio; borrar dos veces es inocuo
+            await self.coleccion.update_many(
+                {"_id": {"$in": [d["_id"] for d in docs]}},
+                {"$set": {"proximo_intento": ahora + timedelta(seconds=BORRADOS_LEASE)}},
+            )
+        return docs
+
+    async def procesar_lote(self) -> int:
+        """Borra un lote vencido. Devuelve cuántos se tomaron (0 si no había)."""
+        docs = await self._reclamar()
+        if not docs:
+            return 0
+        try:
+            resultado = await delete_images_cloudinary([d["_id"] for d in docs])
+            error = None
+        except Exception as e:
+            resultado, error = {}, str(e)
+            print(f"Error borrando imágenes en Cloudinary: {e}")
+
+        hechos = [d["_id"] for d in docs if resultado.get(d["_id"]) in _RESUELTOS]
+        if hechos:
+            await self.coleccion.delete_many({"_id": {"$in": hechos}})
+            self.stats["borrados"] += len(hechos)
+
+        ahora = _ahora()
+        reintentos = []
+        for d in docs:
+            if d["_id"] in hechos:
+                continue
+            intentos = d.get("intentos", 0) + 1
+            cambios = {
+                "intentos": intentos,
+                "proximo_intento": ahora + _backoff(intentos),
+                "error": error or resultado.get(d["_id"], "sin respuesta"),
+            }
+            if intentos >= BORRADOS_MAX_INTENTOS:
+                # Queda en la colección para revisarlo a mano
+                cambios["estado"] = "fallido"
+                self.stats["fallidos"] += 1
+            else:
+                self.stats["reintentos"] += 1
+            reintentos.append(self.coleccion.update_one({"_id": d["_id"]}, {"$set": cambios}))
+        await asyncio.gather(*reintentos)
+        return len(docs)
+
+    async def _bucle(self):
+        while True:
+            # wait_for (3.11) se traga una cancelación que llega junto con el evento
+            # y detener() quedaba colgado; asyncio.wait la deja pasar
+            espera = asyncio.ensure_future(self._hay_pendientes.wait())
+            try:
+                await asyncio.wait({espera}, timeout=BORRADOS_INTERVALO)
+            finally:
+                espera.cancel()
+            self._hay_pendientes.clear()
+            try:
+                # Lotes llenos seguidos hasta vaciar lo vencido
+                while await self.procesar_lote() >= BORRADOS_LOTE:
+                    pass
+            except Exception as e:
+                print(f"Error procesando la cola de borrados: {e}")
+
+    async def resumen(self) -> dict:
+        return {
+            **self.stats,
+            "pendientes": await self.coleccion.count_documents({"estado": "pendiente"}),
+            "fallidos_en_cola": await self.coleccion.count_documents({"estado": "fallido"}),
+        }
+
+
+borrados = ColaBorrados()
@@ -0,0 +1,138 @@
+import bisect
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+
+from pymongo.errors import OperationFailure
+
+from backend.db.mongo import db
+from backend.utils.catalogo_cache import IndiceCatalogo
+
+BUSCADOR_USAR_MONGO = os.getenv("BUSCADOR_USAR_MONGO", "1") == "1"
+# Cuántos términos del vocabulario se expanden como máximo para un prefijo
+BUSCADOR_MAX_TERMINOS_PREFIJO = int(os.getenv("BUSCADOR_MAX_TERMINOS_PREFIJO", "64"))
+
+# Mismos pesos que el índice de texto de Mongo (db/indices.py)
+PESOS = {"nombre": 10, "marca": 5, "descripcion": 1}
+
+_NO_ALFANUM = re.compile(r"[^0-9a-z]+")
+
+
+def tokenizar(texto: str) -> list[str]:
+    """Minúsculas, sin tildes y partido en palabras alfanuméricas."""
+    if not texto:
+        return []
+    plano = unicodedata.normalize("NFKD", texto.lower())
+    plano = "".join(c for c in plano if not unicodedata.combining(c))
+    return [t for t in _NO_ALFANUM.split(plano) if t]
+
+
+class IndiceInvertido(IndiceCatalogo):
+    """Índice invertido en memoria sobre nombre, marca y descripción."""
+
+    proyeccion = {campo: 1 for campo in PESOS}
+
+    def __init__(self):
+        super().__init__()
+        self.postings: dict[str, dict[str, float]] = defaultdict(dict)
+        self.terminos_por_doc: dict[str, dict[str, float]] = {}
+        self.vocabulario: list[str] = []
+
+    def agregar(self, prenda_id: str, doc: dict):
+        self.quitar(prenda_id)
+        terminos: dict[str, float] = defaultdict(float)
+        for campo, peso in PESOS.items():
+            for t in tokenizar(doc.get(campo)):
+                terminos[t] += peso
+        for t, peso in terminos.items():
+            if t not in self.postings:
+                bisect.insort(self.vocabulario, t)
+            self.postings[t][prenda_id] = peso
+        self.terminos_por_doc[prenda_id] = dict(terminos)
+
+    def quitar(self, prenda_id: str):
+        for t in self.terminos_por_doc.pop(prenda_id, {}):
+            docs = self.postings.get(t)
+            if docs is None:
+                continue
+            docs.pop(prenda_id, None)
+            if not docs:
+                del self.postings[t]
+                i = bisect.bisect_left(self.vocabulario, t)
+                if i < len(self.vocabulario) and self.vocabulario[i] == t:
+                    del self.vocabulario[i]
+
+    def _idf(self, termino: str) -> float:
+        n = len(self.postings.get(termino, ()))
+        return math.log(1 + len(self.terminos_por_doc) / n) if n else 0.0
+
+    def _terminos_con_prefijo(self, prefijo: str) -> list[str]:
+        i = bisect.bisect_left(self.vocabulario, prefijo)
+        terminos = []
+        while i < len(self.vocabulario) and self.vocabulario[i].startswith(prefijo):
+            terminos.append(self.vocabulario[i])
+            if len(terminos) >= BUSCADOR_MAX_TERMINOS_PREFIJO:
+                break
+            i += 1
+        return terminos
+
+    def buscar(self, q: str, limit: int) -> list[tuple[str, float]]:
+        """Ranking tf-idf con semántica OR: suma el aporte de cada término de la consulta."""
+        puntajes: dict[str, float] = defaultdict(float)
+        for t in set(tokenizar(q)):
+            idf = self._idf(t)
+            for prenda_id, peso in self.postings.get(t, {}).items():
+                puntajes[prenda_id] += peso * idf
+        return sorted(puntajes.items(), key=lambda x: -x[1])[:limit]
+
+    def autocompletar(self, q: str, limit: int) -> list[tuple[str, float]]:
+        """Todos los términos deben aparecer; el último puede estar incompleto."""
+        tokens = tokenizar(q)
+        if not tokens:
+            return []
+        *completos, prefijo = tokens
+
+        candidatos = None
+        puntajes: dict[str, float] = defaultdict(float)
+        for t in completos:
+            docs = self.postings.get(t, {})
+            candidatos = set(docs) if candidatos is None else candidatos & set(docs)
+            for prenda_id, peso in docs.items():
+                puntajes[prenda_id] += peso * self._idf(t)
+
+        con_prefijo: dict[str, float] = defaultdict(float)
+        for t in self._terminos_con_prefijo(prefijo):
+            for prenda_id, peso in self.postings[t].items():
+                # Coincidencia exacta del prefijo pesa más que una palabra más larga
+                con_prefijo[prenda_id] = max(con_prefijo[prenda_id], peso * (2 if t == prefijo else 1))
+        candidatos = set(con_prefijo) if candidatos is None else candidatos & set(con_prefijo)
+
+        return sorted(
+            ((i, puntajes[i] + con_prefijo[i]) for i in candidatos),
+            key=lambda x: -x[1],
+        )[:limit]
+
+
+indice = IndiceInvertido()
+
+
+async def buscar_ids(q: str, modo: str, limit: int) -> list[str]:
+    if modo == "prefijo":
+        await indice.asegurar_vigente()
+        return [i for i, _ in indice.autocompletar(q, limit)]
+
+    if BUSCADOR_USAR_MONGO:
+        try:
+            cursor = db["prendas"].find(
+                {"$text": {"$search": q}},
+                {"_id": 1, "score": {"$meta": "textScore"}},
+            ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+            return [str(d["_id"]) async for d in cursor]
+        except OperationFailure as e:
+            # Sin índice de texto (p. ej. todavía creándose): se usa el índice en memoria
+            print(f"Búsqueda de texto en Mongo no disponible: {e}")
+
+    await indice.asegurar_vigente()
+    return [i for i, _ in indice.buscar(q, limit)]
@@ -0,0 +1,102 @@
+"""
+Copias locales de las imágenes del catálogo ya normalizadas para el probador
+(JPEG RGB de a lo sumo IMAGEN_MAX_LADO, lo que viaja a Gemini). Se guardan en
+disco al crear/editar la prenda, indexadas por el sha256 de esos bytes
+(`probador_clave` en el documento). Si otra instancia no la tiene, se baja
+de Cloudinary una vez y queda guardada. El directorio se acota a
+PRENDAS_CACHE_MAX_MB expulsando las de uso más viejo.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+
+from backend.utils.cloudinary_helper import descargar_imagen, url_limitada
+from backend.utils.imagenes import IMAGEN_MAX_LADO, FuenteImagen, normalizar_imagen
+
+PRENDAS_CACHE_DIR = os.getenv("PRENDAS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "zarpado_prendas"))
+PRENDAS_CACHE_MAX_MB = int(os.getenv("PRENDAS_CACHE_MAX_MB", "512"))
+
+
+class CachePrendas:
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self._total = None
+        self.stats = {"hits": 0, "descargas": 0}
+
+    @staticmethod
+    def clave(jpeg: bytes) -> str:
+        return hashlib.sha256(jpeg).hexdigest()
+
+    def _ruta(self, clave: str) -> Path:
+        return self.directorio / f"{clave}.jpg"
+
+    def _leer(self, clave: str):
+        ruta = self._ruta(clave)
+        try:
+            jpeg = ruta.read_bytes()
+        except FileNotFoundError:
+            return None
+        # El mtime hace de "último uso" para la expulsión
+        os.utime(ruta)
+        return jpeg
+
+    def _escribir(self, clave: str, jpeg: bytes):
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        ruta = self._ruta(clave)
+        if ruta.exists():
+            return
+        # Escritura atómica: otro worker nunca lee un archivo a medias
+        temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+        temporal.write_bytes(jpeg)
+        os.replace(temporal, ruta)
+        if self._total is None:
+            self._total = sum(p.stat().st_size for p in self.directorio.glob("*.jpg"))
+        else:
+            self._total += len(jpeg)
+        if self._total > self.max_bytes:
+            self._expulsar()
+
+    def _expulsar(self):
+        archivos = sorted(self.directorio.glob("*.jpg"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in archivos)
+        # Baja hasta el 90% para no expulsar en cada escritura
+        for p in archivos:
+            if total <= self.max_bytes * 0.9:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+        self._total = total
+
+    async def guardar(self, contenido: FuenteImagen) -> tuple[str, bytes]:
+        """Normaliza la imagen original y la guarda: (clave, jpeg). ValueError si no es una imagen."""
+        jpeg = await run_in_threadpool(normalizar_imagen, contenido)
+        clave = self.clave(jpeg)
+        await run_in_threadpool(self._escribir, clave, jpeg)
+        return clave, jpeg
+
+    async def obtener(self, url: str, clave: str = None) -> tuple[str, bytes]:
+        """
+        (clave, jpeg normalizado) de la imagen de una prenda: del disco si
+        está, si no bajándola de `url`. Sin `clave` (prendas anteriores a este
+        cache) siempre se baja y la clave devuelta sirve para guardarla.
+        """
+        if clave:
+            jpeg = await run_in_threadpool(self._leer, clave)
+            if jpeg is not None:
+                self.stats["hits"] += 1
+                return clave, jpeg
+
+        self.stats["descargas"] += 1
+        # Se pide a Cloudinary ya achicada: baja y decodifica mucho menos
+        contenido = await descargar_imagen(url_limitada(url, IMAGEN_MAX_LADO))
+        jpeg = await run_in_threadpool(normalizar_imagen, contenido)
+        clave = self.clave(jpeg)
+        await run_in_threadpool(self._escribir, clave, jpeg)
+        return clave, jpeg
+
+
+cache_prendas = CachePrendas(PRENDAS_CACHE_DIR, PRENDAS_CACHE_MAX_MB * 1024 * 1024)
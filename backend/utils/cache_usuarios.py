@@ -0,0 +1,177 @@
+"""
+Cache read-through de las lecturas del usuario que el frontend consulta
+después de casi cada acción: perfil (GET /usuarios/{id}), favoritos y la
+primera página del historial. Se guardan los bytes JSON ya serializados.
+
+Cada usuario es un hash en el store: un contador `gen` y una respuesta por
+variante (`{gen}:{variante}`, p. ej. `3:favoritos`). Todo el que escribe
+datos del usuario llama a `invalidar(user_id)`, que solo incrementa `gen`:
+las respuestas anteriores quedan inalcanzables de una vez, y una lectura
+que arrancó antes de la escritura guarda su resultado bajo la generación
+vieja, así nunca se sirve algo previo a la escritura. Lo que quedó viejo
+se limpia en la siguiente escritura y cada hash vence a los
+USUARIOS_CACHE_TTL segundos, el límite de desactualización si alguna
+invalidación se pierde.
+
+Backends (USUARIOS_CACHE_BACKEND):
+- "memoria": LRU por proceso de a lo sumo USUARIOS_CACHE_MAX usuarios. Con
+  varios workers cada uno solo ve sus propias invalidaciones.
+- "redis": compartido entre workers (REDIS_URL, ver backend/db/clientes.py);
+  el tamaño lo acota el TTL y la maxmemory del servidor.
+- "ninguno": sin cache.
+
+Si el store falla, se responde desde Mongo y se cuenta el error.
+"""
+import os
+import time
+from collections import OrderedDict
+
+import orjson
+from fastapi import Response
+
+from backend.db.clientes import clientes
+from backend.utils.respuestas import RespuestaJSON, a_json
+
+USUARIOS_CACHE_BACKEND = os.getenv("USUARIOS_CACHE_BACKEND", "memoria")  # "memoria", "redis" o "ninguno"
+USUARIOS_CACHE_MAX = int(os.getenv("USUARIOS_CACHE_MAX", "10000"))         # usuarios (memoria)
+USUARIOS_CACHE_TTL = int(os.getenv("USUARIOS_CACHE_TTL", "60"))            # segundos
+
+
+class MemoriaCacheStore:
+    """Hashes con vencimiento en un LRU del proceso."""
+
+    def __init__(self, max_claves: int):
+        self.max_claves = max_claves
+        self._hashes: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def _vigente(self, clave: str) -> dict:
+        item = self._hashes.get(clave)
+        if item is None:
+            return None
+        expira, campos = item
+        if expira < time.monotonic():
+            del self._hashes[clave]
+            return None
+        self._hashes.move_to_end(clave)
+        return campos
+
+    def _fijar(self, clave: str, campos: dict, ttl: int):
+        self._hashes[clave] = (time.monotonic() + ttl, campos)
+        self._hashes.move_to_end(clave)
+        while len(self._hashes) > self.max_claves:
+            self._hashes.popitem(last=False)
+
+    async def leer(self, clave: str) -> dict:
+        return dict(self._vigente(clave) or {})
+
+    async def escribir(self, clave: str, campos: dict, quitar: list, ttl: int):
+        actuales = self._vigente(clave) or {}
+        for k in quitar:
+            actuales.pop(k, None)
+        self._fijar(clave, {**actuales, **campos}, ttl)
+
+    async def incrementar(self, clave: str, ttl: int):
+        actuales = self._vigente(clave) or {}
+        gen = int(actuales.get("gen", b"0")) + 1
+        self._fijar(clave, {**actuales, "gen": str(gen).encode()}, ttl)
+
+
+class RedisCacheStore:
+    """Hashes de Redis (cliente del registro): compartido entre workers."""
+
+    async def leer(self, clave: str) -> dict:
+        campos = await clientes.redis().hgetall(clave)
+        return {k.decode(): v for k, v in campos.items()}
+
+    async def escribir(self, clave: str, campos: dict, quitar: list, ttl: int):
+        async with clientes.redis().pipeline(transaction=True) as pipe:
+            if quitar:
+                pipe.hdel(clave, *quitar)
+            pipe.hset(clave, mapping=campos)
+            pipe.expire(clave, ttl)
+            await pipe.execute()
+
+    async def incrementar(self, clave: str, ttl: int):
+        async with clientes.redis().pipeline(transaction=True) as pipe:
+            pipe.hincrby(clave, "gen", 1)
+            pipe.expire(clave, ttl)
+            await pipe.execute()
+
+
+class CacheUsuarios:
+    def __init__(self, store, ttl: int):
+        self.store = store
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "invalidaciones": 0, "errores": 0}
+
+    @staticmethod
+    def _clave(user_id: str) -> str:
+        # ObjectId acepta hex en mayúsculas: misma clave que str(ObjectId)
+        return f"usuario:{user_id.lower()}"
+
+    async def responder(self, user_id: str, variante: str, generar) -> Response:
+        """
+        La respuesta cacheada de `variante` para el usuario o, si no está,
+        la genera con `await generar()` -> (contenido, headers_extra) y la
+        guarda. Los errores de `generar` (p. ej. 404) no se cachean.
+        """
+        if self.store is None:
+            contenido, headers = await generar()
+            return RespuestaJSON(contenido, headers=headers)
+
+        clave = self._clave(user_id)
+        try:
+            campos = await self.store.leer(clave)
+        except Exception as e:
+            self.stats["errores"] += 1
+            print(f"Error leyendo el cache de usuarios: {e}")
+            campos = None
+
+        gen = (campos or {}).get("gen", b"0").decode()
+        if campos:
+            valor = campos.get(f"{gen}:{variante}")
+            if valor is not None:
+                self.stats["hits"] += 1
+                headers, cuerpo = valor.split(b"\n", 1)
+                return Response(content=cuerpo, media_type=RespuestaJSON.media_type, headers=orjson.loads(headers))
+
+        self.stats["misses"] += 1
+        contenido, headers = await generar()
+        cuerpo = a_json(contenido)
+        if campos is not None:
+            # Se limpian las respuestas de generaciones anteriores
+            viejos = [k for k in campos if k != "gen" and not k.startswith(f"{gen}:")]
+            try:
+                # orjson nunca emite saltos de línea: separa headers y cuerpo
+                await self.store.escribir(clave, {f"{gen}:{variante}": a_json(headers) + b"\n" + cuerpo}, viejos, self.ttl)
+            except Exception as e:
+                self.stats["errores"] += 1
+                print(f"Error escribiendo el cache de usuarios: {e}")
+        return Response(content=cuerpo, media_type=RespuestaJSON.media_type, headers=headers)
+
+    async def invalidar(self, *user_ids: str):
+        """Llamar después de cada escritura de datos del usuario (perfil, favoritos, historial)."""
+        if self.store is None:
+            return
+        for user_id in user_ids:
+            try:
+                await self.store.incrementar(self._clave(user_id), self.ttl)
+                self.stats["invalidaciones"] += 1
+            except Exception as e:
+                # Queda a lo sumo USUARIOS_CACHE_TTL segundos desactualizado
+                self.stats["errores"] += 1
+                print(f"Error invalidando el cache del usuario {user_id}: {e}")
+
+    def resumen(self) -> dict:
+        return {**self.stats, "backend": USUARIOS_CACHE_BACKEND, "ttl": self.ttl}
+
+
+def _crear_store():
+    if USUARIOS_CACHE_BACKEND == "redis":
+        return RedisCacheStore()
+    if USUARIOS_CACHE_BACKEND == "memoria":
+        return MemoriaCacheStore(USUARIOS_CACHE_MAX)
+    return None
+
+
+cache_usuarios = CacheUsuarios(_crear_store(), USUARIOS_CACHE_TTL)
@@ -0,0 +1,18 @@
+"""Punto único para propagar las escrituras del catálogo a caches e índices en memoria."""
+from backend.utils import buscador, similitud
+from backend.utils.catalogo_cache import catalogo_cache
+
+INDICES_CATALOGO = [buscador.indice, similitud.indice]
+
+
+def iniciar_indices():
+    for indice in INDICES_CATALOGO:
+        indice.iniciar()
+
+
+async def registrar_cambio(prenda_id: str, doc: dict = None):
+    """Invalida el catálogo y actualiza los índices en memoria (doc=None para borrados)."""
+    anteriores = [indice.version for indice in INDICES_CATALOGO]
+    nueva = await catalogo_cache.invalidar()
+    for indice, anterior in zip(INDICES_CATALOGO, anteriores):
+        indice.aplicar(anterior, nueva, prenda_id, doc)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from pymongo import ReturnDocument
+
+from backend.db.mongo import db
+from backend.utils.respuestas import RespuestaJSON, a_json
+
+CATALOGO_CACHE_MAX_BYTES = int(os.getenv("CATALOGO_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Cada cuánto se relee la versión del catálogo en Mongo (escrituras de otros workers)
+CATALOGO_VERSION_TTL = float(os.getenv("CATALOGO_VERSION_TTL", "1"))
+
+
+class CatalogoCache:
+    """
+    Respuestas serializadas del catálogo (bytes JSON) en un LRU acotado por
+    tamaño. Cada entrada guarda la versión del catálogo con la que se
+    generó; las escrituras incrementan la versión en Mongo (colección meta),
+    lo que invalida todo en este worker y, en a lo sumo CATALOGO_VERSION_TTL
+    segundos, en los demás. La versión también es el ETag de las respuestas.
+    """
+
+    def __init__(self, max_bytes: int, version_ttl: float):
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._entradas: OrderedDict[str, tuple[int, bytes, dict]] = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._version_leida = 0.0
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    async def version(self) -> int:
+        if self._version is None or time.monotonic() - self._version_leida > self.version_ttl:
+            doc = await db["meta"].find_one({"_id": "catalogo"}, {"version": 1})
+            self._fijar_version(doc["version"] if doc else 0)
+        return self._version
+
+    def _fijar_version(self, version: int):
+        if version != self._version:
+            self._entradas.clear()
+            self._bytes = 0
+        self._version = version
+        self._version_leida = time.monotonic()
+
+    async def invalidar(self) -> int:
+        doc = await db["meta"].find_one_and_update(
+            {"_id": "catalogo"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._fijar_version(doc["version"])
+        return doc["version"]
+
+    @staticmethod
+    def etag(version: int) -> str:
+        return f'W/"catalogo-{version}"'
+
+    def _get(self, clave: str, version: int):
+        entrada = self._entradas.get(clave)
+        if entrada is None or entrada[0] != version:
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def _set(self, clave: str, version: int, cuerpo: bytes, headers: dict):
+        anterior = self._entradas.pop(clave, None)
+        if anterior:
+            self._bytes -= len(anterior[1])
+        if len(cuerpo) > self.max_bytes:
+            return
+        self._entradas[clave] = (version, cuerpo, headers)
+        self._bytes += len(cuerpo)
+        while self._bytes > self.max_bytes:
+            _, (_, viejo, _) = self._entradas.popitem(last=False)
+            self._bytes -= len(viejo)
+
+    async def responder(self, request: Request, generar) -> Response:
+        """
+        Devuelve la respuesta cacheada para la URL pedida o la genera con
+        `await generar()` -> (contenido, headers_extra) y la guarda; 304 si
+        el cliente ya tiene la versión vigente (If-None-Match). El 304 sale
+        solo de una respuesta válida: si `generar` falla (p. ej. 404 de una
+        prenda borrada), el error llega igual. El contenido son dicts
+        planos, tal cual van en el JSON.
+        """
+        version = await self.version()
+        etag = self.etag(version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        clave = request.url.path + "?" + "&".join(sorted(request.url.query.split("&")))
+        entrada = self._get(clave, version)
+        if entrada is not None:
+            self.stats["hits"] += 1
+            _, cuerpo, extra = entrada
+        else:
+            self.stats["misses"] += 1
+            contenido, extra = await generar()
+            cuerpo = a_json(contenido)
+            # Si hubo una escritura mientras se generaba, no se guarda algo viejo
+            if version == self._version:
+                self._set(clave, version, cuerpo, extra)
+
+        if coincide_etag(request.headers.get("if-none-match"), etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=cuerpo, media_type=RespuestaJSON.media_type, headers={**headers, **extra})
+
+    def resumen(self) -> dict:
+        return {**self.stats, "entradas": len(self._entradas), "bytes": self._bytes, "version": self._version}
+
+
+def coincide_etag(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparación débil: se ignora el prefijo W/
+    normal = etag.removeprefix("W/")
+    return any(e.strip().removeprefix("W/") == normal for e in if_none_match.split(","))
+
+
+catalogo_cache = CatalogoCache(CATALOGO_CACHE_MAX_BYTES, CATALOGO_VERSION_TTL)
+
+
+class IndiceCatalogo(ABC):
+    """
+    Base de los índices en memoria derivados de `prendas` (búsqueda,
+    similitud visual). Se mantienen incrementalmente con las escrituras
+    propias (`aplicar`); si la versión del catálogo muestra escrituras de
+    otro worker se reconstruyen en segundo plano sin dejar de responder con
+    el índice anterior. Las subclases definen `proyeccion` e implementan
+    `agregar` y `quitar`, y deben poder construirse sin argumentos.
+    """
+
+    proyeccion: dict = {}
+
+    def __init__(self):
+        self.version = None
+        self._reconstruyendo: asyncio.Task = None
+
+    @abstractmethod
+    def agregar(self, prenda_id: str, doc: dict):
+        ...
+
+    @abstractmethod
+    def quitar(self, prenda_id: str):
+        ...
+
+    async def reconstruir(self):
+        version = await catalogo_cache.version()
+        nuevo = type(self)()
+        async for d in db["prendas"].find({}, self.proyeccion):
+            nuevo.agregar(str(d["_id"]), d)
+        # Se reemplazan las estructuras de una vez, sin tocar el estado de control
+        for k, v in vars(nuevo).items():
+            if k not in ("version", "_reconstruyendo"):
+                setattr(self, k, v)
+        self.version = version
+
+    def iniciar(self):
+        """Carga inicial en segundo plano (desde el lifespan)."""
+        self._reconstruyendo = asyncio.create_task(self.reconstruir())
+
+    async def asegurar_vigente(self):
+        version = await catalogo_cache.version()
+        if version == self.version:
+            return
+        en_curso = self._reconstruyendo is not None and not self._reconstruyendo.done()
+        if self.version is None:
+            # Nunca se cargó: no hay nada que servir mientras tanto
+            await (self._reconstruyendo if en_curso else self.reconstruir())
+        elif not en_curso:
+            self._reconstruyendo = asyncio.create_task(self.reconstruir())
+
+    def aplicar(self, version_anterior, version_nueva: int, prenda_id: str, doc: dict = None):
+        """
+        Aplica la escritura propia de un handler (doc=None para borrados). Si
+        entre medio hubo otras escrituras el índice queda desactualizado y se
+        reconstruye en la próxima consulta.
+        """
+        if doc is None:
+            self.quitar(prenda_id)
+        else:
+            self.agregar(prenda_id, doc)
+        if self.version is not None and self.version == version_anterior and version_nueva == version_anterior + 1:
+            self.version = version_nueva
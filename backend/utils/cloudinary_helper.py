@@ -1,56 +1,110 @@
 import cloudinary
+import cloudinary.api
 import cloudinary.uploader
-from PIL import Image
-from io import BytesIO
+import cloudinary.utils
 
-import os
-from fastapi import UploadFile
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from backend.db.clientes import clientes
+from backend.utils.imagenes import IMAGEN_MAX_LADO_ORIGINAL, ImagenDemasiadoGrande, normalizar_imagen
+from backend.utils.subidas import archivo_subido
+from backend.utils.metricas import etapa
 
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True,
-)
+# Derivados que se generan al subir (eager) para grillas e historial; "full" es el original
+TAMANOS_IMAGEN = {
+    "thumb": {"width": 200, "crop": "limit", "quality": "auto"},
+    "card": {"width": 480, "crop": "limit", "quality": "auto"},
+}
+FORMATO_DERIVADOS = "webp"
+
+def url_en_tamano(url: str, tamano: str = None) -> str:
+    """
+    URL de un derivado de una imagen de Cloudinary. Se arma insertando la
+    transformación en la URL original, así que también sirve para imágenes
+    subidas antes de que existieran los derivados (Cloudinary los genera en
+    el primer pedido). Con tamano None/"full" o URLs ajenas devuelve la original.
+    """
+    if tamano in (None, "full"):
+        return url
+    return _url_transformada(url, TAMANOS_IMAGEN[tamano], FORMATO_DERIVADOS)
+
+def url_limitada(url: str, lado: int) -> str:
+    """La imagen como JPEG de lado mayor `lado` como mucho, escalada por Cloudinary."""
+    return _url_transformada(url, {"width": lado, "height": lado, "crop": "limit"}, "jpg")
+
+def _url_transformada(url: str, transformacion: dict, formato: str) -> str:
+    if not url or "/image/upload/" not in url:
+        return url
+    transformacion = cloudinary.utils.generate_transformation_string(**transformacion)[0]
+    base, ruta = url.split("/image/upload/", 1)
+    ruta = ruta.rsplit(".", 1)[0] + "." + formato
+    return f"{base}/image/upload/{transformacion}/{ruta}"
+
+async def descargar_imagen(url: str) -> bytes:
+    """Baja una imagen con el cliente HTTP compartido; los errores HTTP se propagan."""
+    with etapa("cloudinary", "descargar"):
+        respuesta = await clientes.http().get(url)
+        respuesta.raise_for_status()
+    return respuesta.content
+
+def imagen_en_tamano(url: str, imagenes: dict, tamano: str = None) -> str:
+    """El derivado guardado en el documento o, si no lo tiene, armado desde la URL."""
+    return (imagenes or {}).get(tamano) or url_en_tamano(url, tamano)
+
+def urls_derivadas(url: str) -> dict:
+    """{"thumb": ..., "card": ..., "full": ...} para guardar junto a la imagen."""
+    return {**{t: url_en_tamano(url, t) for t in TAMANOS_IMAGEN}, "full": url}
 
 async def upload_image_to_cloudinary(file_or_bytes, folder="default"):
     """
-    Acepta UploadFile, bytes o BytesIO, convierte a JPEG y lo sube a Cloudinary.
+    Acepta UploadFile, bytes o un archivo binario (BytesIO, spool), convierte a JPEG y lo sube a Cloudinary.
     Devuelve (secure_url, public_id).
+    Un JPEG RGB de hasta IMAGEN_MAX_LADO_ORIGINAL (p. ej. la salida de
+    normalizar_imagen) se sube sin volver a decodificarlo; uno más grande se
+    decodifica ya reducido. Un UploadFile se lee desde su spool, sin
+    cargarlo entero antes. La conversión y la subida (SDK bloqueante)
+    corren en el threadpool.
     """
-    # 1) Extraer bytes raw
+    # 1) La fuente: un UploadFile (de FastAPI o de Starlette), bytes o un archivo binario
     if hasattr(file_or_bytes, "file"):
-        raw = file_or_bytes.file.read()
-    elif isinstance(file_or_bytes, BytesIO):
-        file_or_bytes.seek(0)
-        raw = file_or_bytes.read()
-    elif isinstance(file_or_bytes, (bytes, bytearray)):
-        raw = file_or_bytes
+        fuente = archivo_subido(file_or_bytes)
+    elif isinstance(file_or_bytes, (bytes, bytearray)) or hasattr(file_or_bytes, "read"):
+        fuente = file_or_bytes
     else:
         raise ValueError("Tipo de archivo no soportado")
 
-    # 2) Convertir a JPEG con PIL
-    try:
-        img = Image.open(BytesIO(raw)).convert("RGB")
-    except Exception as e:
-        raise ValueError(f"Error al decodificar imagen: {e}")
-
-    buf = BytesIO()
-    img.save(buf, format="JPEG", quality=90)
-    buf.seek(0)
+    # 2) Convertir a JPEG con PIL (no-op si ya es JPEG RGB dentro del tamaño)
+    with etapa("cloudinary", "normalizar"):
+        try:
+            jpeg = await run_in_threadpool(normalizar_imagen, fuente, IMAGEN_MAX_LADO_ORIGINAL)
+        except ImagenDemasiadoGrande as e:
+            raise HTTPException(status_code=413, detail=f"La imagen es demasiado grande: {e}")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="La imagen no es válida")
 
     # 3) Subir el JPEG a Cloudinary
-    result = cloudinary.uploader.upload(
-        buf,
-        folder=folder,
-        format="jpg",        # fuerza extensión .jpg
-        overwrite=True,
-    )
+    clientes.cloudinary()
+    with etapa("cloudinary", "subir"):
+        result = await run_in_threadpool(
+            cloudinary.uploader.upload,
+            jpeg,
+            folder=folder,
+            format="jpg",        # fuerza extensión .jpg
+            overwrite=True,
+            # Los derivados se generan en segundo plano en Cloudinary: no demoran la subida
+            eager=[{**t, "format": FORMATO_DERIVADOS} for t in TAMANOS_IMAGEN.values()],
+            eager_async=True,
+        )
 
     return result["secure_url"], result["public_id"]
     
-async def delete_image_cloudinary(public_id: str):
-    try:
-        cloudinary.uploader.destroy(public_id)
-    except Exception as e:
-        print(f"Error eliminando imagen: {e}")
+async def delete_images_cloudinary(public_ids: list[str]) -> dict:
+    """
+    Borra hasta 100 imágenes en un solo llamado a la Admin API.
+    Devuelve {public_id: "deleted" | "not_found" | ...}; los errores se propagan.
+    Los handlers no llaman a esto directamente: encolan en utils/borrados.py.
+    """
+    clientes.cloudinary()
+    with etapa("cloudinary", "borrar"):
+        result = await run_in_threadpool(cloudinary.api.delete_resources, public_ids)
+    return result.get("deleted", {})
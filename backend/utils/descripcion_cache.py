@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from backend.db.mongo import db
+
+DESCRIPCION_CACHE_MAX = int(os.getenv("DESCRIPCION_CACHE_MAX", "1024"))
+DESCRIPCION_CACHE_TTL = int(os.getenv("DESCRIPCION_CACHE_TTL", str(30 * 24 * 3600)))  # segundos
+
+
+class DescripcionCache:
+    """
+    Cache de descripciones de prendas indexado por el hash (sha256) de los
+    bytes normalizados de la imagen. Un LRU en memoria va delante de una
+    colección de Mongo con índice TTL (declarado en db/indices.py), así las
+    descripciones sobreviven a reinicios y se comparten entre workers.
+    """
+
+    def __init__(self, coleccion: str, max_items: int, ttl: int):
+        self.coleccion = coleccion
+        self.max_items = max_items
+        self.ttl = ttl
+        self._lru: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._en_curso: dict[str, asyncio.Future] = {}
+        self.stats = {"hits_memoria": 0, "hits_mongo": 0, "misses": 0, "errores_mongo": 0}
+
+    @staticmethod
+    def clave(contenido: bytes) -> str:
+        return hashlib.sha256(contenido).hexdigest()
+
+    def _get_memoria(self, clave: str):
+        item = self._lru.get(clave)
+        if item is None:
+            return None
+        expira, descripcion = item
+        if expira < time.monotonic():
+            del self._lru[clave]
+            return None
+        self._lru.move_to_end(clave)
+        return descripcion
+
+    def _set_memoria(self, clave: str, descripcion: str, ttl: float):
+        self._lru[clave] = (time.monotonic() + ttl, descripcion)
+        self._lru.move_to_end(clave)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    async def _get_mongo(self, clave: str):
+        doc = await db[self.coleccion].find_one({"_id": clave}, {"descripcion": 1, "creado": 1})
+        if not doc:
+            return None
+        creado = doc["creado"]
+        if creado.tzinfo is None:
+            creado = creado.replace(tzinfo=timezone.utc)
+        restante = (creado + timedelta(seconds=self.ttl) - datetime.now(timezone.utc)).total_seconds()
+        # El monitor TTL de Mongo corre cada ~60s, puede quedar algún vencido
+        if restante <= 0:
+            return None
+        return doc["descripcion"], restante
+
+    async def _set_mongo(self, clave: str, descripcion: str):
+        await db[self.coleccion].update_one(
+            {"_id": clave},
+            {"$set": {"descripcion": descripcion, "creado": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    async def obtener_o_calcular(self, contenido: bytes, calcular) -> str:
+        """
+        Devuelve la descripción cacheada para `contenido` o la calcula con
+        `await calcular()`. Pedidos simultáneos de la misma imagen esperan
+        una única llamada al modelo. Si se cancela el pedido que la estaba
+        calculando (p. ej. el cliente cortó), los que esperaban no heredan
+        la cancelación: uno de ellos la vuelve a calcular.
+        """
+        clave = self.clave(contenido)
+
+        while True:
+            descripcion = self._get_memoria(clave)
+            if descripcion is not None:
+                self.stats["hits_memoria"] += 1
+                return descripcion
+
+            en_curso = self._en_curso.get(clave)
+            if en_curso is None:
+                break
+            try:
+                return await asyncio.shield(en_curso)
+            except asyncio.CancelledError:
+                # Solo se propaga si cancelaron a este pedido, no al que calculaba
+                if en_curso.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_curso[clave] = futuro
+        try:
+            try:
+                encontrado = await self._get_mongo(clave)
+            except Exception:
+                self.stats["errores_mongo"] += 1
+                encontrado = None
+
+            if encontrado is not None:
+                descripcion, restante = encontrado
+                self.stats["hits_mongo"] += 1
+                self._set_memoria(clave, descripcion, restante)
+            else:
+                self.stats["misses"] += 1
+                descripcion = await calcular()
+                self._set_memoria(clave, descripcion, self.ttl)
+                try:
+                    await self._set_mongo(clave, descripcion)
+                except Exception:
+                    self.stats["errores_mongo"] += 1
+
+            futuro.set_result(descripcion)
+            return descripcion
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            # Evita el warning de "exception never retrieved" si nadie esperaba
+            futuro.exception()
+            raise
+        finally:
+            del self._en_curso[clave]
+
+    def resumen(self) -> dict:
+        total = self.stats["hits_memoria"] + self.stats["hits_mongo"] + self.stats["misses"]
+        aciertos = self.stats["hits_memoria"] + self.stats["hits_mongo"]
+        return {
+            **self.stats,
+            "items_memoria": len(self._lru),
+            "hit_ratio": round(aciertos / total, 4) if total else 0.0,
+        }
+
+
+descripcion_cache = DescripcionCache("descripciones_prenda", DESCRIPCION_CACHE_MAX, DESCRIPCION_CACHE_TTL)
@@ -0,0 +1,98 @@
+"""
+Exportación en streaming de colecciones enteras (NDJSON o CSV) para
+dashboards de admin y volcados de datos.
+
+Se recorre un cursor de Mongo ordenado por _id (el índice de siempre, sin
+ordenar en memoria) con batches de EXPORT_LOTE documentos y se escribe de a
+EXPORT_LOTE filas: la memoria del worker no depende del tamaño de la
+colección y el primer byte sale enseguida.
+
+Reanudación: cada fila lleva su `id`. Si la descarga se corta, se pide de
+nuevo con `?cursor=<último id recibido>` y sigue desde el siguiente.
+"""
+import csv
+import io
+import json
+import os
+from typing import Callable, Literal, Optional
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from backend.db.mongo import db
+from backend.utils.respuestas import a_json
+
+EXPORT_LOTE = int(os.getenv("EXPORT_LOTE", "500"))
+
+FormatoExport = Literal["ndjson", "csv"]
+
+_MEDIA = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _celda(valor) -> str:
+    # Listas y dicts (favoritos, imagenes) van como JSON dentro de la celda
+    if valor is None:
+        return ""
+    if isinstance(valor, (list, dict)):
+        return json.dumps(valor, ensure_ascii=False)
+    return valor
+
+
+def exportar(
+    coleccion: str,
+    filtro: dict,
+    proyeccion: dict,
+    fila: Callable[[dict], dict],
+    columnas: tuple,
+    formato: FormatoExport,
+    cursor: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    StreamingResponse con los documentos de `coleccion` que cumplen `filtro`,
+    cada uno convertido con `fila` (que devuelve "id" y `columnas`).
+    """
+    if cursor:
+        try:
+            filtro = {**filtro, "_id": {"$gt": ObjectId(cursor)}}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    encabezado = ("id", *columnas)
+
+    def escribir(filas: list[dict]) -> bytes:
+        if formato == "ndjson":
+            return b"".join(a_json(f) + b"\n" for f in filas)
+        buf = io.StringIO()
+        escritor = csv.writer(buf)
+        escritor.writerows([_celda(f.get(c)) for c in encabezado] for f in filas)
+        return buf.getvalue().encode()
+
+    async def filas():
+        if formato == "csv":
+            buf = io.StringIO()
+            csv.writer(buf).writerow(encabezado)
+            yield buf.getvalue().encode()
+        pendientes = []
+        docs = db[coleccion].find(filtro, proyeccion).sort("_id", 1).batch_size(EXPORT_LOTE)
+        try:
+            async for d in docs:
+                pendientes.append(fila(d))
+                if len(pendientes) >= EXPORT_LOTE:
+                    yield escribir(pendientes)
+                    pendientes = []
+            if pendientes:
+                yield escribir(pendientes)
+        finally:
+            # Si el cliente corta, se libera el cursor en el servidor
+            await docs.close()
+
+    return StreamingResponse(
+        filas(),
+        media_type=_MEDIA[formato],
+        headers={
+            "Content-Disposition": f'attachment; filename="{coleccion}.{formato}"',
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
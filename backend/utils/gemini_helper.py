@@ -0,0 +1,163 @@
+"""
+Acceso a Gemini con control de admisión:
+
+- un semáforo global limita las llamadas simultáneas (GEMINI_CONCURRENCIA)
+  con una cola de espera acotada en tamaño y tiempo;
+- cada usuario tiene un token bucket (GEMINI_CUPO_USUARIO pruebas de
+  ráfaga, recargando GEMINI_CUPO_POR_MINUTO) que se cobra con
+  `cobrar_cupo` antes de empezar, así no se gasta trabajo en algo que
+  después se va a rechazar;
+- los errores transitorios del proveedor (429/5xx, timeouts, red) se
+  reintentan con backoff exponencial con jitter, esperando fuera del
+  semáforo (cada intento vuelve a pedir turno).
+
+Cuando no hay lugar se responde 429 con Retry-After en vez de un 500. Los
+contadores (en espera, en curso, rechazos, reintentos) van a /metrics. El
+estado es por proceso: con varios workers los límites son por worker.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import HTTPException
+from google.genai import errors
+from prometheus_client import Counter, Gauge
+
+from backend.db.clientes import clientes
+
+GEMINI_CONCURRENCIA = int(os.getenv("GEMINI_CONCURRENCIA", "8"))
+GEMINI_MAX_EN_ESPERA = int(os.getenv("GEMINI_MAX_EN_ESPERA", "32"))
+GEMINI_ESPERA_MAX = float(os.getenv("GEMINI_ESPERA_MAX", "20"))            # segundos en la cola
+GEMINI_CUPO_USUARIO = float(os.getenv("GEMINI_CUPO_USUARIO", "5"))         # pruebas de ráfaga
+GEMINI_CUPO_POR_MINUTO = float(os.getenv("GEMINI_CUPO_POR_MINUTO", "3"))
+GEMINI_REINTENTOS = int(os.getenv("GEMINI_REINTENTOS", "3"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1"))         # segundos
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "16"))          # segundos
+GEMINI_MAX_USUARIOS = int(os.getenv("GEMINI_MAX_USUARIOS", "10000"))       # buckets en memoria
+
+EN_ESPERA = Gauge("gemini_en_espera", "Llamadas a Gemini esperando lugar")
+EN_CURSO = Gauge("gemini_en_curso", "Llamadas a Gemini en curso")
+RECHAZOS = Counter("gemini_rechazos_total", "Llamadas a Gemini rechazadas con 429", ["motivo"])
+REINTENTOS = Counter("gemini_reintentos_total", "Reintentos de llamadas a Gemini", ["causa"])
+
+_CODIGOS_TRANSITORIOS = (408, 429, 500, 502, 503, 504)
+
+
+def rechazar(motivo: str, retry_after: float, detalle: str):
+    RECHAZOS.labels(motivo).inc()
+    raise HTTPException(
+        status_code=429,
+        detail=detalle,
+        headers={"Retry-After": str(max(1, round(retry_after)))},
+    )
+
+
+class TokenBucket:
+    def __init__(self, capacidad: float, por_segundo: float):
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.tokens = capacidad
+        self.actualizado = time.monotonic()
+
+    def tomar(self, costo: float = 1) -> float:
+        """Consume `costo` tokens; si no alcanzan devuelve cuántos segundos faltan (0 si pudo)."""
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.por_segundo)
+        self.actualizado = ahora
+        if self.tokens >= costo:
+            self.tokens -= costo
+            return 0.0
+        return (costo - self.tokens) / self.por_segundo
+
+
+class Admision:
+    def __init__(self):
+        self._semaforo = asyncio.Semaphore(GEMINI_CONCURRENCIA)
+        self._en_espera = 0
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def cobrar(self, user_id: str):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(GEMINI_CUPO_USUARIO, GEMINI_CUPO_POR_MINUTO / 60)
+            if len(self._buckets) > GEMINI_MAX_USUARIOS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+        espera = bucket.tomar()
+        if espera:
+            rechazar("cupo_usuario", espera, "Llegaste al límite de pruebas por minuto, probá de nuevo en un rato")
+
+    @asynccontextmanager
+    async def turno(self):
+        if self._semaforo.locked() and self._en_espera >= GEMINI_MAX_EN_ESPERA:
+            rechazar("cola_llena", GEMINI_ESPERA_MAX, "El probador está saturado, reintentá en unos segundos")
+        self._en_espera += 1
+        EN_ESPERA.inc()
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), GEMINI_ESPERA_MAX)
+        except asyncio.TimeoutError:
+            rechazar("espera_agotada", GEMINI_ESPERA_MAX, "El probador está saturado, reintentá en unos segundos")
+        finally:
+            self._en_espera -= 1
+            EN_ESPERA.dec()
+        EN_CURSO.inc()
+        try:
+            yield
+        finally:
+            EN_CURSO.dec()
+            self._semaforo.release()
+
+
+admision = Admision()
+
+
+def cobrar_cupo(user_id: str):
+    """Descuenta una prueba del cupo del usuario o responde 429."""
+    admision.cobrar(user_id)
+
+
+def _transitorio(e: Exception):
+    """Etiqueta de la causa si vale la pena reintentar, None si no."""
+    if isinstance(e, errors.APIError) and e.code in _CODIGOS_TRANSITORIOS:
+        return str(e.code)
+    if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(e, httpx.TransportError):
+        return "red"
+    return None
+
+
+def _backoff(intento: int) -> float:
+    # Full jitter: reparte los reintentos de muchos requests en vez de sincronizarlos
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** intento))
+
+
+async def generar_contenido(model: str, contents: list, config=None):
+    """
+    Llama a Gemini con el cliente asíncrono (client.aio), así la espera
+    del modelo no bloquea el event loop del worker. El cliente se crea en
+    el primer llamado (sin GOOGLE_API_KEY falla recién acá).
+    """
+    for intento in range(GEMINI_REINTENTOS + 1):
+        # Un turno por intento: quien espera el backoff no ocupa lugar de los demás
+        async with admision.turno():
+            try:
+                return await clientes.genai().aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                )
+            except Exception as e:
+                causa = _transitorio(e)
+                if causa is None:
+                    raise
+                if intento == GEMINI_REINTENTOS:
+                    if causa == "429":
+                        rechazar("proveedor", GEMINI_BACKOFF_MAX, "Gemini está limitando pedidos, reintentá en unos segundos")
+                    raise HTTPException(status_code=503, detail=f"Gemini no está disponible: {e}")
+                REINTENTOS.labels(causa).inc()
+        await asyncio.sleep(_backoff(intento))
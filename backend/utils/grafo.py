@@ -0,0 +1,300 @@
+"""
+Espejo en Neo4j de usuarios, prendas, favoritos y pruebas del probador, y
+motor de recomendaciones "también probaron / también guardaron".
+
+Los handlers solo encolan eventos (`grafo.registrar`); una tarea de fondo
+los escribe en lotes con UNWIND. Otra tarea recalcula cada tanto la
+proyección de similitud por co-ocurrencia y la deja en memoria, así
+`recomendar` no recorre el grafo en cada request.
+
+Para cargar los datos existentes:
+
+    python -m backend.utils.grafo backfill
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import Counter, deque
+
+from neo4j import RoutingControl
+
+from backend.db.clientes import clientes
+from backend.db.mongo import db
+from backend.db.neo4j import driver
+from backend.utils.metricas import medir_neo4j
+
+GRAFO_FLUSH_INTERVALO = float(os.getenv("GRAFO_FLUSH_INTERVALO", "2"))      # segundos
+GRAFO_LOTE = int(os.getenv("GRAFO_LOTE", "500"))
+GRAFO_MAX_COLA = int(os.getenv("GRAFO_MAX_COLA", "50000"))
+RECOMENDACIONES_REFRESCO = float(os.getenv("RECOMENDACIONES_REFRESCO", "600"))  # segundos
+RECOMENDACIONES_TOP = int(os.getenv("RECOMENDACIONES_TOP", "50"))
+
+ESCRITURAS = {
+    "usuario": """
+        UNWIND $filas AS f
+        MERGE (:Usuario {id: f.id})
+    """,
+    "usuario_borrado": """
+        UNWIND $filas AS f
+        MATCH (u:Usuario {id: f.id})
+        DETACH DELETE u
+    """,
+    "prenda": """
+        UNWIND $filas AS f
+        MERGE (p:Prenda {id: f.id})
+        SET p.tipo = f.tipo, p.marca = f.marca
+    """,
+    "prenda_borrada": """
+        UNWIND $filas AS f
+        MATCH (p:Prenda {id: f.id})
+        DETACH DELETE p
+    """,
+    "favorito": """
+        UNWIND $filas AS f
+        MERGE (u:Usuario {id: f.user_id})
+        MERGE (p:Prenda {id: f.prenda_id})
+        MERGE (u)-[:FAVORITO]->(p)
+    """,
+    "favorito_quitado": """
+        UNWIND $filas AS f
+        MATCH (:Usuario {id: f.user_id})-[r:FAVORITO]->(:Prenda {id: f.prenda_id})
+        DELETE r
+    """,
+    "prueba": """
+        UNWIND $filas AS f
+        MERGE (u:Usuario {id: f.user_id})
+        MERGE (p:Prenda {id: f.prenda_id})
+        MERGE (u)-[r:PROBO]->(p)
+        ON CREATE SET r.veces = 0
+        SET r.veces = r.veces + 1, r.ultima = timestamp()
+    """,
+}
+
+# Sin estas constraints cada MERGE por id recorre todos los nodos de la etiqueta
+CONSTRAINTS = [
+    "CREATE CONSTRAINT usuario_id IF NOT EXISTS FOR (u:Usuario) REQUIRE u.id IS UNIQUE",
+    "CREATE CONSTRAINT prenda_id IF NOT EXISTS FOR (p:Prenda) REQUIRE p.id IS UNIQUE",
+]
+
+CONSULTA_SIMILARES = """
+    MATCH (p1:Prenda)<-[:FAVORITO|PROBO]-(u:Usuario)-[:FAVORITO|PROBO]->(p2:Prenda)
+    WHERE p1 <> p2
+    WITH p1, p2, count(DISTINCT u) AS comunes
+    ORDER BY comunes DESC
+    WITH p1, collect([p2.id, comunes])[..$top] AS similares
+    RETURN p1.id AS id, similares
+"""
+
+CONSULTA_ITEMS_USUARIO = """
+    MATCH (u:Usuario)-[:FAVORITO|PROBO]->(p:Prenda)
+    RETURN u.id AS id, collect(DISTINCT p.id) AS items
+"""
+
+CONSULTA_POPULARES = """
+    MATCH (p:Prenda)<-[:FAVORITO|PROBO]-(u:Usuario)
+    RETURN p.id AS id, count(DISTINCT u) AS usuarios
+    ORDER BY usuarios DESC
+    LIMIT $top
+"""
+
+
+class Grafo:
+    def __init__(self):
+        self._pendientes: deque[tuple[str, dict]] = deque()
+        self._hay_lote = asyncio.Event()
+        self._tareas: list[asyncio.Task] = []
+        self.similares: dict[str, list[tuple[str, int]]] = {}
+        self.items_por_usuario: dict[str, set[str]] = {}
+        self.populares: list[str] = []
+        self.refrescado = None
+        self.stats = {"encolados": 0, "escritos": 0, "descartados": 0, "errores": 0}
+
+    async def iniciar(self):
+        # Todo en segundo plano: un Neo4j lento o caído no demora el arranque
+        self._tareas = [
+            asyncio.create_task(self._crear_constraints()),
+            asyncio.create_task(self._bucle_flush()),
+            asyncio.create_task(self._bucle_refresco()),
+        ]
+
+    async def _crear_constraints(self):
+        for constraint in CONSTRAINTS:
+            try:
+                with medir_neo4j("constraint"):
+                    await driver.execute_query(constraint)
+            except Exception as e:
+                print(f"No se pudo crear la constraint en Neo4j: {e}")
+
+    async def detener(self):
+        for t in self._tareas:
+            t.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        # Lo que quedó en cola se intenta escribir antes de cerrar
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"No se pudo vaciar la cola del grafo: {e}")
+
+    def registrar(self, evento: str, **fila):
+        """Encola un evento; nunca bloquea ni falla en el request."""
+        if len(self._pendientes) >= GRAFO_MAX_COLA:
+            self._pendientes.popleft()
+            self.stats["descartados"] += 1
+        self._pendientes.append((evento, fila))
+        self.stats["encolados"] += 1
+        if len(self._pendientes) >= GRAFO_LOTE:
+            self._hay_lote.set()
+
+    async def flush(self):
+        """Escribe los eventos pendientes: tramos consecutivos del mismo evento van en un UNWIND."""
+        while self._pendientes:
+            evento = self._pendientes[0][0]
+            filas = []
+            while self._pendientes and self._pendientes[0][0] == evento and len(filas) < GRAFO_LOTE:
+                filas.append(self._pendientes.popleft()[1])
+            try:
+                with medir_neo4j(evento):
+                    await driver.execute_query(ESCRITURAS[evento], filas=filas)
+                self.stats["escritos"] += len(filas)
+            except Exception:
+                # Se devuelven al frente para reintentar en la próxima vuelta
+                self._pendientes.extendleft((evento, f) for f in reversed(filas))
+                raise
+
+    async def _bucle_flush(self):
+        while True:
+            # wait_for (3.11) se traga una cancelación que llega junto con el evento
+            # y detener() quedaba colgado; asyncio.wait la deja pasar
+            espera = asyncio.ensure_future(self._hay_lote.wait())
+            try:
+                await asyncio.wait({espera}, timeout=GRAFO_FLUSH_INTERVALO)
+            finally:
+                espera.cancel()
+            self._hay_lote.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                self.stats["errores"] += 1
+                print(f"Error escribiendo en Neo4j: {e}")
+
+    async def refrescar(self):
+        """Recalcula la proyección de similitud y la reemplaza en memoria de una vez."""
+        leer = {"routing_": RoutingControl.READ}
+        with medir_neo4j("similares"):
+            registros, _, _ = await driver.execute_query(CONSULTA_SIMILARES, top=RECOMENDACIONES_TOP, **leer)
+        similares = {r["id"]: [(s[0], s[1]) for s in r["similares"]] for r in registros}
+        with medir_neo4j("items_usuario"):
+            registros, _, _ = await driver.execute_query(CONSULTA_ITEMS_USUARIO, **leer)
+        items = {r["id"]: set(r["items"]) for r in registros}
+        with medir_neo4j("populares"):
+            registros, _, _ = await driver.execute_query(CONSULTA_POPULARES, top=RECOMENDACIONES_TOP, **leer)
+        populares = [r["id"] for r in registros]
+
+        self.similares, self.items_por_usuario, self.populares = similares, items, populares
+        self.refrescado = time.time()
+
+    async def _bucle_refresco(self):
+        while True:
+            try:
+                await self.refrescar()
+            except Exception as e:
+                self.stats["errores"] += 1
+                print(f"Error refrescando recomendaciones: {e}")
+            await asyncio.sleep(RECOMENDACIONES_REFRESCO)
+
+    def recomendar(self, user_id: str, limit: int) -> list[str]:
+        """Ids de prendas recomendadas, solo desde la proyección en memoria."""
+        propios = self.items_por_usuario.get(user_id, set())
+        puntajes: Counter[str] = Counter()
+        for item in propios:
+            for otra, comunes in self.similares.get(item, ()):
+                if otra not in propios:
+                    puntajes[otra] += comunes
+        ids = [i for i, _ in puntajes.most_common(limit)]
+        # Usuarios nuevos o sin co-ocurrencias: se completa con lo más popular
+        for i in self.populares:
+            if len(ids) >= limit:
+                break
+            if i not in propios and i not in ids:
+                ids.append(i)
+        return ids
+
+    def resumen(self) -> dict:
+        return {
+            **self.stats,
+            "pendientes": len(self._pendientes),
+            "prendas_con_similares": len(self.similares),
+            "refrescado": self.refrescado,
+        }
+
+
+async def prenda_id_por_imagen(image_url: str):
+    """Los favoritos guardan URLs: se resuelve a qué prenda del catálogo corresponde."""
+    doc = await db["prendas"].find_one({"image_path": image_url}, {"_id": 1})
+    return str(doc["_id"]) if doc else None
+
+
+async def prenda_ids_por_imagen(image_urls: list[str]) -> dict[str, str]:
+    """Igual que prenda_id_por_imagen pero para muchas URLs en una sola consulta."""
+    if not image_urls:
+        return {}
+    docs = db["prendas"].find({"image_path": {"$in": image_urls}}, {"image_path": 1})
+    return {d["image_path"]: str(d["_id"]) async for d in docs}
+
+
+grafo = Grafo()
+
+
+async def backfill() -> int:
+    """
+    Escribe en Neo4j lo que ya está en Mongo. Va en lotes de GRAFO_LOTE
+    directo desde los cursores, sin pasar por la cola acotada de `registrar`
+    (que descarta lo que no entra): si una escritura falla, el backfill
+    falla. Los MERGE lo hacen idempotente, se puede volver a correr.
+    """
+    lotes: dict[str, list[dict]] = {"prenda": [], "usuario": [], "favorito": []}
+    escritos = 0
+
+    async def escribir(evento: str):
+        nonlocal escritos
+        filas, lotes[evento] = lotes[evento], []
+        if filas:
+            with medir_neo4j(evento):
+                await driver.execute_query(ESCRITURAS[evento], filas=filas)
+            escritos += len(filas)
+
+    async def agregar(evento: str, **fila):
+        lotes[evento].append(fila)
+        if len(lotes[evento]) >= GRAFO_LOTE:
+            await escribir(evento)
+
+    async for p in db["prendas"].find({}, {"tipo": 1, "marca": 1}):
+        await agregar("prenda", id=str(p["_id"]), tipo=p.get("tipo"), marca=p.get("marca"))
+    await escribir("prenda")
+    prendas_por_url = {
+        p["image_path"]: str(p["_id"])
+        async for p in db["prendas"].find({"image_path": {"$ne": None}}, {"image_path": 1})
+    }
+    async for u in db["usuarios"].find({}, {"favoritos": 1}):
+        user_id = str(u["_id"])
+        await agregar("usuario", id=user_id)
+        for url in u.get("favoritos", []):
+            if url in prendas_por_url:
+                await agregar("favorito", user_id=user_id, prenda_id=prendas_por_url[url])
+    await escribir("usuario")
+    await escribir("favorito")
+    return escritos
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        async def main():
+            try:
+                print(f"{await backfill()} eventos escritos en Neo4j")
+            finally:
+                await clientes.cerrar()
+        asyncio.run(main())
+    else:
+        print("uso: python -m backend.utils.grafo backfill")
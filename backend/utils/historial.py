@@ -0,0 +1,176 @@
+"""
+Historial del probador en su propia colección (`historial`), un documento
+por imagen generada, en vez de un array dentro del usuario: el documento
+del usuario no crece con el uso y el historial se lee paginado.
+
+Retención: cada entrada vence a los HISTORIAL_RETENCION_DIAS (índice TTL
+sobre `creado`) y al crearla ya queda agendado en la cola de borrados el
+borrado de su imagen en Cloudinary para ese mismo momento.
+
+Los usuarios con el historial embebido de antes se migran al arrancar
+(`migrar_embebidos`, hasta que queda la marca en `migraciones`), o a mano
+con:
+
+    python -m backend.utils.historial
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+from backend.db.mongo import db
+from backend.utils.borrados import borrados
+from backend.utils.cache_usuarios import cache_usuarios
+from backend.utils.cloudinary_helper import imagen_en_tamano, urls_derivadas
+
+HISTORIAL_RETENCION_DIAS = int(os.getenv("HISTORIAL_RETENCION_DIAS", "30"))
+HISTORIAL_PAGINA = int(os.getenv("HISTORIAL_PAGINA", "20"))
+HISTORIAL_PAGINA_MAX = int(os.getenv("HISTORIAL_PAGINA_MAX", "100"))
+
+_RETENCION = timedelta(days=HISTORIAL_RETENCION_DIAS)
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def urls(entradas: list[dict], tamano: Optional[str] = None) -> list[str]:
+    """Con `tamano` (thumb/card/full) cada URL apunta a ese derivado."""
+    return [imagen_en_tamano(e["url"], e.get("imagenes"), tamano) for e in entradas]
+
+
+async def agregar(user_id: str, url: str, public_id: str):
+    creado = _ahora()
+    await db["historial"].insert_one({
+        "user_id": ObjectId(user_id),
+        "url": url,
+        "public_id": public_id,
+        "imagenes": urls_derivadas(url),
+        "creado": creado,
+    })
+    await cache_usuarios.invalidar(user_id)
+    # Cuando el TTL expulse la entrada su imagen ya tiene el borrado agendado
+    await borrados.encolar(public_id, cuando=creado + _RETENCION)
+
+
+async def pagina(user_id: str, limit: int = HISTORIAL_PAGINA, cursor: Optional[str] = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Entradas del usuario de la más nueva a la más vieja, paginadas por keyset
+    sobre _id. Devuelve (entradas, cursor de la página siguiente o None).
+    """
+    filtro = {"user_id": ObjectId(user_id)}
+    if cursor:
+        try:
+            filtro["_id"] = {"$lt": ObjectId(cursor)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    docs = await db["historial"].find(filtro, {"url": 1, "imagenes": 1}).sort("_id", -1).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, str(docs[-1]["_id"])
+    return docs, None
+
+
+async def primeras_paginas(user_ids: list[ObjectId], limit: int = HISTORIAL_PAGINA) -> dict[ObjectId, list[dict]]:
+    """La primera página de `pagina` de varios usuarios con una sola consulta (listados)."""
+    por_usuario = {u: [] for u in user_ids}
+    async for e in db["historial"].find(
+        {"user_id": {"$in": user_ids}}, {"user_id": 1, "url": 1, "imagenes": 1}
+    ).sort([("user_id", 1), ("_id", -1)]):
+        entradas = por_usuario[e["user_id"]]
+        if len(entradas) < limit:
+            entradas.append(e)
+    return por_usuario
+
+
+async def quitar(user_id: str, idx: int) -> bool:
+    """Quita la entrada `idx` (en el orden de `pagina`) y borra su imagen. False si no existe."""
+    if idx < 0:
+        return False
+    docs = await db["historial"].find(
+        {"user_id": ObjectId(user_id)}, {"public_id": 1}
+    ).sort("_id", -1).skip(idx).limit(1).to_list(1)
+    if not docs:
+        return False
+    # Si otro request la borró entre medio, el resultado es el mismo
+    await db["historial"].delete_one({"_id": docs[0]["_id"]})
+    await cache_usuarios.invalidar(user_id)
+    await borrados.encolar(docs[0].get("public_id"))
+    return True
+
+
+async def borrar_de_usuario(user_id: str):
+    """Borra todo el historial del usuario (y sus imágenes, en segundo plano)."""
+    filtro = {"user_id": ObjectId(user_id)}
+    public_ids = [d.get("public_id") async for d in db["historial"].find(filtro, {"public_id": 1})]
+    await db["historial"].delete_many(filtro)
+    await cache_usuarios.invalidar(user_id)
+    await borrados.encolar(*public_ids)
+
+
+def _id_migrado(user_id: ObjectId, pos: int, total: int) -> ObjectId:
+    """
+    _id fijo para la entrada `pos` (de `total`) del historial embebido:
+    reintentar la migración no la duplica. Su fecha son los segundos previos
+    al alta del usuario, así ordena por posición y antes que las entradas nuevas.
+    """
+    segundos = int(user_id.generation_time.timestamp()) - total + pos
+    return ObjectId(segundos.to_bytes(4, "big") + user_id.binary[4:])
+
+
+async def migrar_embebidos(forzar: bool = False) -> int:
+    """
+    Pasa a la colección los historiales que todavía están dentro del usuario.
+    Devuelve cuántos usuarios migró. Al terminar deja una marca en
+    `migraciones` y los arranques siguientes no recorren los usuarios (el
+    filtro no tiene índice); `forzar` recorre igual.
+    """
+    if not forzar and await db["migraciones"].find_one({"_id": "historial_embebido"}, {"_id": 1}):
+        return 0
+    migrados = 0
+    ahora = _ahora()
+    try:
+        async for u in db["usuarios"].find({"historial": {"$exists": True}}, {"historial": 1}):
+            entradas = [e for e in u["historial"] if isinstance(e, dict) and e.get("url")]
+            if entradas:
+                # Primero se copia y recién después se quita del usuario: si algo
+                # se corta, el próximo intento vuelve a copiar con los mismos _id.
+                # Sin fecha original la retención corre desde la migración.
+                try:
+                    await db["historial"].insert_many([
+                        {
+                            "_id": _id_migrado(u["_id"], pos, len(entradas)),
+                            "user_id": u["_id"],
+                            "url": e["url"],
+                            "public_id": e.get("public_id"),
+                            "imagenes": e.get("imagenes") or urls_derivadas(e["url"]),
+                            "creado": ahora,
+                        }
+                        for pos, e in enumerate(entradas)
+                    ], ordered=False)
+                except BulkWriteError as e:
+                    # Las que ya copió un intento anterior (u otro worker) no son un error
+                    if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                        raise
+                await borrados.encolar(*(e.get("public_id") for e in entradas), cuando=ahora + _RETENCION)
+            await db["usuarios"].update_one({"_id": u["_id"]}, {"$unset": {"historial": ""}})
+            await cache_usuarios.invalidar(str(u["_id"]))
+            migrados += 1
+        await db["migraciones"].update_one(
+            {"_id": "historial_embebido"},
+            {"$set": {"completado": _ahora()}, "$inc": {"usuarios": migrados}},
+            upsert=True,
+        )
+    except Exception as e:
+        # Corre en el arranque: el resto queda para el próximo
+        print(f"No se pudo migrar el historial embebido: {e}")
+    return migrados
+
+
+if __name__ == "__main__":
+    print(f"Usuarios migrados: {asyncio.run(migrar_embebidos(forzar=True))}")
@@ -0,0 +1,78 @@
+import os
+from io import BytesIO
+from typing import BinaryIO, Optional, Union
+
+from PIL import Image
+
+IMAGEN_MAX_LADO = int(os.getenv("IMAGEN_MAX_LADO", "1536"))         # px, lo que se manda a Gemini
+IMAGEN_CALIDAD_JPEG = int(os.getenv("IMAGEN_CALIDAD_JPEG", "90"))
+# Originales que se guardan en Cloudinary: más grandes se achican al subir
+IMAGEN_MAX_LADO_ORIGINAL = int(os.getenv("IMAGEN_MAX_LADO_ORIGINAL", "3072"))
+# Se rechaza antes de decodificar (solo se lee la cabecera)
+IMAGEN_MAX_PIXELES = int(os.getenv("IMAGEN_MAX_PIXELES", str(50_000_000)))
+
+# Bytes en memoria o un archivo binario (p. ej. el spool de un UploadFile)
+FuenteImagen = Union[bytes, BinaryIO]
+
+class ImagenDemasiadoGrande(ValueError):
+    pass
+
+def get_mime_type_bytes(data: bytes) -> str:
+    header = data[:12]
+    if header.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+def _archivo(fuente: FuenteImagen) -> BinaryIO:
+    if isinstance(fuente, (bytes, bytearray)):
+        return BytesIO(fuente)
+    fuente.seek(0)
+    return fuente
+
+def abrir_imagen(fuente: FuenteImagen) -> Image.Image:
+    """
+    Abre la imagen sin decodificarla (PIL solo lee la cabecera) y rechaza
+    las de más de IMAGEN_MAX_PIXELES antes de reservar memoria para ellas.
+    """
+    img = Image.open(_archivo(fuente))
+    ancho, alto = img.size
+    if ancho * alto > IMAGEN_MAX_PIXELES:
+        raise ImagenDemasiadoGrande(f"La imagen tiene {ancho}x{alto} px, el máximo es {IMAGEN_MAX_PIXELES} px")
+    return img
+
+def normalizar_imagen(fuente: FuenteImagen, max_lado: Optional[int] = IMAGEN_MAX_LADO) -> bytes:
+    """
+    Única etapa de normalización: devuelve un JPEG RGB cuyo lado mayor no
+    supera `max_lado` (None = sin límite).
+    Si la entrada ya es un JPEG RGB dentro del tamaño se devuelve tal cual,
+    sin decodificar. Si no, se decodifica una única vez, se achica y se
+    codifica una única vez. Un JPEG grande se decodifica directo a 1/2, 1/4
+    u 1/8 de su resolución (draft), sin pasar nunca por el tamaño completo.
+    Lanza ValueError (ImagenDemasiadoGrande si excede IMAGEN_MAX_PIXELES)
+    si los bytes no son una imagen válida.
+    """
+    try:
+        img = abrir_imagen(fuente)
+        if img.format == "JPEG" and img.mode == "RGB" and (max_lado is None or max(img.size) <= max_lado):
+            return fuente if isinstance(fuente, (bytes, bytearray)) else _archivo(fuente).read()
+
+        if max_lado is not None and max(img.size) > max_lado:
+            if img.mode in ("1", "P", "I", "F", "I;16"):
+                # En estos modos resize usa NEAREST: se convierte antes de achicar
+                img = img.convert("RGB")
+            # Con reducing_gap, thumbnail pide el draft (JPEG) a 2x del destino y
+            # hace el último paso con LANCZOS: se achica antes de convertir a RGB
+            img.thumbnail((max_lado, max_lado), Image.LANCZOS, reducing_gap=2.0)
+        img = img.convert("RGB")
+    except ImagenDemasiadoGrande:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error al decodificar imagen: {e}")
+
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=IMAGEN_CALIDAD_JPEG)
+    return buf.getvalue()
@@ -0,0 +1,190 @@
+"""
+Métricas de Prometheus (/metrics) y cabecera Server-Timing.
+
+- `MiddlewareMetricas`: duración de cada request por ruta (la plantilla, no
+  la URL, para no explotar la cardinalidad).
+- `etapa(...)` / `Cronometro`: tiempos de las etapas de una operación
+  (probador, cloudinary, ...).
+- `MonitorMongo`: CommandListener de pymongo con la duración de cada comando.
+- `medir_neo4j(...)`: duración de las consultas a Neo4j.
+
+Todo lo medido durante un request se suma por nombre y, si se pidió, vuelve
+en `Server-Timing` (METRICAS_SERVER_TIMING=1 para todos los requests, o
+por request con la cabecera `X-Server-Timing: 1`).
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+
+METRICAS_SERVER_TIMING = os.getenv("METRICAS_SERVER_TIMING", "0") == "1"
+
+# Rangos pensados para la API (ms) y para el probador (decenas de segundos)
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+HTTP = Histogram(
+    "http_request_duration_seconds", "Duración de los requests HTTP",
+    ["method", "ruta", "status"], buckets=_BUCKETS,
+)
+ETAPAS = Histogram(
+    "etapa_duration_seconds", "Duración de cada etapa de una operación",
+    ["operacion", "etapa"], buckets=_BUCKETS,
+)
+MONGO = Histogram(
+    "mongo_command_duration_seconds", "Duración de los comandos a Mongo",
+    ["comando", "coleccion", "resultado"], buckets=_BUCKETS,
+)
+NEO4J = Histogram(
+    "neo4j_query_duration_seconds", "Duración de las consultas a Neo4j",
+    ["consulta", "resultado"], buckets=_BUCKETS,
+)
+
+# {nombre: [segundos, veces]} de lo medido en el request en curso (None si no se pidió)
+_tiempos: ContextVar = ContextVar("tiempos_request", default=None)
+
+
+def anotar(nombre: str, segundos: float):
+    tiempos = _tiempos.get()
+    if tiempos is not None:
+        acumulado = tiempos.setdefault(nombre, [0.0, 0])
+        acumulado[0] += segundos
+        acumulado[1] += 1
+
+
+@contextmanager
+def etapa(operacion: str, nombre: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        ETAPAS.labels(operacion, nombre).observe(segundos)
+        anotar(f"{operacion}-{nombre}", segundos)
+
+
+class Cronometro:
+    """
+    Etapas consecutivas de una operación: `marcar(nombre)` cierra la etapa
+    anterior y abre la siguiente; `terminar()` cierra la última.
+    """
+
+    def __init__(self, operacion: str):
+        self.operacion = operacion
+        self._etapa = None
+        self._inicio = 0.0
+
+    def marcar(self, nombre: str = None):
+        ahora = time.perf_counter()
+        if self._etapa:
+            segundos = ahora - self._inicio
+            ETAPAS.labels(self.operacion, self._etapa).observe(segundos)
+            anotar(f"{self.operacion}-{self._etapa}", segundos)
+        self._etapa, self._inicio = nombre, ahora
+
+    def terminar(self):
+        self.marcar(None)
+
+
+@contextmanager
+def medir_neo4j(consulta: str):
+    inicio = time.perf_counter()
+    resultado = "ok"
+    try:
+        yield
+    except Exception:
+        resultado = "error"
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        NEO4J.labels(consulta, resultado).observe(segundos)
+        anotar("neo4j", segundos)
+
+
+class MonitorMongo(monitoring.CommandListener):
+    """Se registra en el cliente (event_listeners=[...]); corre en el mismo contexto que el request."""
+
+    def __init__(self):
+        self._colecciones: dict[tuple, str] = {}
+
+    def started(self, event):
+        coleccion = event.command.get(event.command_name)
+        self._colecciones[(event.connection_id, event.request_id)] = (
+            coleccion if isinstance(coleccion, str) else ""
+        )
+
+    def _terminar(self, event, resultado: str):
+        coleccion = self._colecciones.pop((event.connection_id, event.request_id), "")
+        segundos = event.duration_micros / 1e6
+        MONGO.labels(event.command_name, coleccion, resultado).observe(segundos)
+        anotar("mongo", segundos)
+
+    def succeeded(self, event):
+        self._terminar(event, "ok")
+
+    def failed(self, event):
+        self._terminar(event, "error")
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI: mide hasta el último byte (también en respuestas en streaming)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        pedir_timing = METRICAS_SERVER_TIMING or any(
+            k == b"x-server-timing" and v == b"1" for k, v in scope["headers"]
+        )
+        token = _tiempos.set({} if pedir_timing else None)
+        inicio = time.perf_counter()
+        status = 500
+
+        async def enviar(mensaje):
+            nonlocal status
+            if mensaje["type"] == "http.response.start":
+                status = mensaje["status"]
+                tiempos = _tiempos.get()
+                if tiempos is not None:
+                    headers = MutableHeaders(scope=mensaje)
+                    total = (time.perf_counter() - inicio) * 1000
+                    partes = [
+                        f'{nombre};dur={seg * 1000:.1f};desc="x{veces}"'
+                        for nombre, (seg, veces) in tiempos.items()
+                    ]
+                    headers.append("Server-Timing", ", ".join(partes + [f"app;dur={total:.1f}"]))
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            HTTP.labels(scope["method"], plantilla_ruta(scope), str(status)).observe(time.perf_counter() - inicio)
+            _tiempos.reset(token)
+
+
+def plantilla_ruta(scope) -> str:
+    """
+    La ruta con los parámetros como {nombre} (p. ej. /api/prendas/{prenda_id}),
+    para que cada id no sea una serie distinta. "sin_ruta" si no matcheó ninguna.
+    """
+    ruta = scope.get("route")
+    plantilla = getattr(ruta, "path_format", None)
+    if plantilla is None:
+        return "sin_ruta"
+    # La plantilla es la de la ruta que matcheó (sin conversores: {idx}, no {idx:int}).
+    # Con include_router(prefix=...) puede venir sin el prefijo: ese tramo sale del path
+    # real, contando segmentos, sin comparar valores de parámetros
+    sobrantes = scope["path"].count("/") - plantilla.count("/")
+    if sobrantes <= 0:
+        return plantilla
+    return "/".join(scope["path"].split("/")[:sobrantes + 1]) + plantilla
+
+
+def exportar() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
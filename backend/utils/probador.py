@@ -0,0 +1,330 @@
+import asyncio
+import os
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from bson.objectid import ObjectId
+from google.genai import types
+
+from backend.db.mongo import db
+from backend.utils.cloudinary_helper import upload_image_to_cloudinary
+from backend.utils import historial
+from backend.utils.gemini_helper import cobrar_cupo, generar_contenido
+from backend.utils.descripcion_cache import descripcion_cache
+from backend.utils.cache_prendas import cache_prendas
+from backend.utils.imagenes import FuenteImagen, ImagenDemasiadoGrande, get_mime_type_bytes, normalizar_imagen
+from backend.utils.grafo import grafo
+from backend.utils.metricas import Cronometro
+
+# Prendas de un lote que se prueban a la vez
+PROBADOR_LOTE_CONCURRENCIA = int(os.getenv("PROBADOR_LOTE_CONCURRENCIA", "3"))
+PROBADOR_LOTE_MAX = int(os.getenv("PROBADOR_LOTE_MAX", "5"))
+
+def parte_jpeg(jpeg: bytes) -> types.Part:
+    # Se manda el JPEG ya codificado: el SDK no vuelve a serializar una imagen PIL
+    return types.Part.from_bytes(data=jpeg, mime_type="image/jpeg")
+
+async def descripcion_prenda(jpeg_prenda: bytes) -> str:
+    response = await generar_contenido(
+        model="gemini-2.0-flash",
+        contents=[
+            "SOLO DAME LA DESCRIPCION EL TIPO DE PRENDA Y CARACTERISTICAS SOBRE SALIENTES, "
+            "Ejemplo de salida (Anorak: Ligero, de nailon, con cremallera corta, capucha con cordón y detalles en bloques de color (azul y negro) en los hombros y las mangas. Logotipo KINGOFTHEKONGO, ADIDAS, etc.). "
+            "LA SALIDA ESPERADA TIENE QUE SER EN INGLÉS",
+            parte_jpeg(jpeg_prenda)
+        ],
+        config=types.GenerateContentConfig(response_modalities=['Text'])
+    )
+    return response.candidates[0].content.parts[0].text
+
+def construir_prompt(prenda: str) -> str:
+    return (f"""Replace the {prenda} worn by the subject in Image 2 with the exact {prenda} from Image 1, ensuring a realistic and seamless integration. The face and background of Image 2 MUST remain completely unaltered.
+
+    I. Prenda Extraction and Preservation (Image1):
+
+    Precisely isolate the {prenda} in (Image1), excluding all other elements (background, subject's body, especially the face).
+    Maintain the exact color, texture, shape, dimensions, patterns (e.g., 'KINGOFTHEKONGO' if applicable), logos, seams, and all other details of the {prenda}. Include all attachments like pockets, buttons, and zippers.
+    II. Integration into Image 2:
+
+    Completely replace the existing garment in Image 2 with the extracted {prenda}. Do not combine or blend any elements of the original garment in (Image2).
+    Adjust the scale, perspective, and angle of the extracted {prenda} to perfectly match the subject's pose in Image 2, ensuring it drapes and fits naturally.
+    Realistically adapt the lighting, shadows, and reflections on the inserted {prenda} to match the light source in Image 2, creating a three-dimensional appearance and natural contact shadows.
+    III. Image 2 Preservation (Non-Negotiable):
+
+    The subject's face in Image 2 must remain 100% identical to the original.
+    All other elements of the subject (hair, accessories, other clothing) and the entire background of Image 2 must remain unchanged.
+    The editing should be strictly limited to the area of the replaced {prenda}, without any spillover or alterations to surrounding areas.
+    Negative Constraints:
+
+    Do not combine or fuse any features of the original garment in Image 2 with the {prenda} from Image 1.
+    Absolutely no modifications to the subject's face, hair, or expression are allowed.
+    Do not alter any accessories, other clothing, or background elements in Image 2.
+    Do not add any new shadows, reflections, or effects that are not directly a result of the inserted {prenda} and its interaction with the existing lighting.
+    Avoid any blending or merging that compromises the natural appearance and volume of the inserted {prenda}."
+    Key Changes in the Revision:
+
+    More Direct Opening: Starts with the core task and immediate constraints.
+    Streamlined Language: Uses slightly less technical jargon where the outcome is clearer.
+    Emphasis on Non-Negotiables: Highlights the critical preservation aspects early and repeats them in the negative constraints.
+    Focus on Outcome: Describes the desired visual effect rather than the specific technical steps the AI should take (which it doesn't directly control)."""
+    "Asegúrate de que la prenda insertada se adapte de forma realista a la forma del cuerpo del sujeto en la Imagen 2, respetando los contornos, pliegues naturales y cómo caería la tela según su postura."
+    f"La salida esperada es la image2 con la nueva prenda {prenda} integrada de forma realista y natural, manteniendo la cara y el fondo sin cambios. El resultado debe ser una imagen que parezca auténtica y profesional, como si la prenda siempre hubiera estado en la imagen original."
+    f"The expected output is the image2 with the new {prenda} integrated realistically and naturally, keeping the face and background unchanged. The result should be an image that looks authentic and professional, as if the {prenda} had always been in the original image."
+    )
+
+async def _sin_aviso(etapa: str):
+    pass
+
+def error_publico(e: Exception) -> dict:
+    """El error de una prueba como lo ve el cliente (jobs y lotes)."""
+    if isinstance(e, HTTPException):
+        error = {"status": e.status_code, "detail": e.detail}
+        if e.headers and "Retry-After" in e.headers:
+            error["retry_after"] = int(e.headers["Retry-After"])
+        return error
+    return {"status": 500, "detail": str(e)}
+
+async def decodificar(fuente: FuenteImagen, quien: str) -> bytes:
+    """
+    Cada entrada se decodifica a lo sumo una vez (en el threadpool) y queda
+    como JPEG achicado a IMAGEN_MAX_LADO, que es lo que viaja a Gemini.
+    `fuente` puede ser el archivo subido (backend/utils/subidas.py): se lee
+    desde el spool y se decodifica ya reducida.
+    """
+    try:
+        return await run_in_threadpool(normalizar_imagen, fuente)
+    except ImagenDemasiadoGrande as e:
+        raise HTTPException(status_code=413, detail=f"La imagen {quien} es demasiado grande: {e}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"La imagen {quien} no es válida")
+
+async def insumos_catalogo(prenda_id: str) -> tuple[bytes, str]:
+    """
+    Imagen normalizada (del cache local) y descripción precalculada de una
+    prenda del catálogo. Las prendas anteriores al cache se completan la
+    primera vez que se prueban.
+    """
+    if not ObjectId.is_valid(prenda_id):
+        raise HTTPException(status_code=400, detail="prenda_id inválido")
+    prenda = await db["prendas"].find_one(
+        {"_id": ObjectId(prenda_id)},
+        {"image_path": 1, "probador_clave": 1, "probador_descripcion": 1},
+    )
+    if not prenda:
+        raise HTTPException(status_code=404, detail="Prenda no encontrada")
+    try:
+        clave, jpeg = await cache_prendas.obtener(prenda.get("image_path"), prenda.get("probador_clave"))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"No se pudo obtener la imagen de la prenda: {e}")
+
+    descripcion = prenda.get("probador_descripcion")
+    if clave != prenda.get("probador_clave") or not descripcion:
+        descripcion = await descripcion_cache.obtener_o_calcular(jpeg, lambda: descripcion_prenda(jpeg))
+        await db["prendas"].update_one(
+            {"_id": prenda["_id"], "image_path": prenda.get("image_path")},
+            {"$set": {"probador_clave": clave, "probador_descripcion": descripcion}},
+        )
+    return jpeg, descripcion
+
+async def _insumos_prenda(contenido_prenda: FuenteImagen, prenda_id: str) -> tuple[bytes, str]:
+    """(jpeg, descripción o None): del archivo subido si vino, si no del catálogo."""
+    if contenido_prenda is not None:
+        return await decodificar(contenido_prenda, "de la prenda"), None
+    if prenda_id:
+        return await insumos_catalogo(prenda_id)
+    raise HTTPException(status_code=400, detail="Falta file_prenda o prenda_id")
+
+# Descripciones que se están precalculando (referencia para que no las junte el GC)
+_precalculos: set[asyncio.Task] = set()
+
+def precalcular_descripcion(prenda_id: str, clave: str, jpeg: bytes):
+    """
+    Al crear/editar una prenda: describe en segundo plano la imagen
+    normalizada (la que quedó en el cache local con `clave`), así la primera
+    prueba no espera al modelo. Si falla, se calcula en la primera prueba.
+    """
+    async def precalcular():
+        try:
+            descripcion = await descripcion_cache.obtener_o_calcular(jpeg, lambda: descripcion_prenda(jpeg))
+            # Si la imagen cambió mientras tanto, esta descripción ya no corresponde
+            await db["prendas"].update_one(
+                {"_id": ObjectId(prenda_id), "probador_clave": clave},
+                {"$set": {"probador_descripcion": descripcion}},
+            )
+        except Exception as e:
+            print(f"No se pudo precalcular la descripción de la prenda {prenda_id}: {e}")
+
+    tarea = asyncio.create_task(precalcular())
+    _precalculos.add(tarea)
+    tarea.add_done_callback(_precalculos.discard)
+
+async def ejecutar_probador(
+    user_id: str,
+    contenido_prenda: FuenteImagen,
+    contenido_usuario: FuenteImagen,
+    on_etapa=_sin_aviso,
+    prenda_id: str = None,
+) -> str:
+    """
+    Pipeline completo del probador: decodifica, describe la prenda, genera la
+    imagen con Gemini, la sube a Cloudinary y la agrega al historial.
+    Sin `contenido_prenda` usa la prenda `prenda_id` del catálogo: imagen ya
+    normalizada y descripción precalculada, sin decodificar ni describir.
+    Avisa cada etapa con `await on_etapa(nombre)` y devuelve la URL generada.
+    Si la prenda es del catálogo (`prenda_id`), la prueba queda en el grafo.
+    La duración de cada etapa va a las métricas (etapa_duration_seconds).
+    """
+    # Antes de decodificar nada; el cupo se cobra solo a un usuario válido y existente
+    await _usuario_existe(user_id)
+    cobrar_cupo(user_id)
+    crono = Cronometro("probador")
+
+    async def etapa(nombre: str):
+        crono.marcar(nombre)
+        await on_etapa(nombre)
+
+    try:
+        await etapa("decodificando")
+        jpeg_prenda, descripcion = await _insumos_prenda(contenido_prenda, prenda_id)
+        jpeg_usuario = await decodificar(contenido_usuario, "del usuario")
+        return await _probar(user_id, jpeg_prenda, jpeg_usuario, etapa, prenda_id, descripcion)
+    finally:
+        crono.terminar()
+
+async def ejecutar_probador_lote(
+    user_id: str,
+    contenido_usuario: FuenteImagen,
+    prendas: list[tuple[FuenteImagen, str]],
+    latido: float = None,
+):
+    """
+    Prueba varias prendas (contenido, prenda_id) sobre la misma foto del
+    usuario; sin contenido se usa la prenda del catálogo. Valida el lote, decodifica la foto una sola vez (los errores
+    salen acá, antes de empezar) y las prendas subidas, y devuelve un generador asíncrono con un
+    dict por prenda en el orden en que terminan:
+    {"indice", "prenda_id", "img_generada"} o {"indice", "prenda_id", "error"}.
+    Las prendas corren de a PROBADOR_LOTE_CONCURRENCIA (y siempre dentro del
+    control de admisión de Gemini); el error de una no corta las demás. Si
+    pasan `latido` segundos sin resultados genera None, para que quien
+    transmite mande un keep-alive.
+    """
+    if not 0 < len(prendas) <= PROBADOR_LOTE_MAX:
+        raise HTTPException(status_code=400, detail=f"Un lote lleva entre 1 y {PROBADOR_LOTE_MAX} prendas")
+    await _usuario_existe(user_id)
+    jpeg_usuario = await decodificar(contenido_usuario, "del usuario")
+    # Las prendas subidas también se leen acá: el framework cierra los
+    # archivos del form al volver el endpoint, antes de que corra el stream
+    subidas = await asyncio.gather(*(_prenda_subida(contenido) for contenido, _ in prendas))
+    return _lote(user_id, jpeg_usuario, [(*subida, prenda_id) for subida, (_, prenda_id) in zip(subidas, prendas)], latido)
+
+async def _prenda_subida(contenido_prenda: FuenteImagen) -> tuple[bytes, HTTPException]:
+    """(jpeg, None), o (None, error) para informarlo en el resultado de esa prenda."""
+    if contenido_prenda is None:
+        return None, None
+    try:
+        return await decodificar(contenido_prenda, "de la prenda"), None
+    except HTTPException as e:
+        return None, e
+
+async def _usuario_existe(user_id: str):
+    # Se chequea antes de gastar Gemini; el historial se guarda sin volver a leer el usuario
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=400, detail="user_id inválido")
+    if not await db["usuarios"].find_one({"_id": ObjectId(user_id)}, {"_id": 1}):
+        raise HTTPException(404, "Usuario no encontrado")
+
+async def _lote(user_id, jpeg_usuario, prendas, latido):
+    limite = asyncio.Semaphore(PROBADOR_LOTE_CONCURRENCIA)
+
+    async def una(indice: int, jpeg_prenda: bytes, error: HTTPException, prenda_id: str) -> dict:
+        resultado = {"indice": indice, "prenda_id": prenda_id}
+        async with limite:
+            crono = Cronometro("probador_lote")
+
+            async def etapa(nombre: str):
+                crono.marcar(nombre)
+
+            try:
+                if error is not None:
+                    raise error
+                cobrar_cupo(user_id)
+                descripcion = None
+                if jpeg_prenda is None:
+                    await etapa("decodificando")
+                    jpeg_prenda, descripcion = await _insumos_prenda(None, prenda_id)
+                resultado["img_generada"] = await _probar(
+                    user_id, jpeg_prenda, jpeg_usuario, etapa, prenda_id, descripcion
+                )
+            except Exception as e:
+                resultado["error"] = error_publico(e)
+            finally:
+                crono.terminar()
+        return resultado
+
+    pendientes = {
+        asyncio.create_task(una(i, jpeg_prenda, error, prenda_id))
+        for i, (jpeg_prenda, error, prenda_id) in enumerate(prendas)
+    }
+    try:
+        while pendientes:
+            listas, pendientes = await asyncio.wait(
+                pendientes, timeout=latido, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not listas:
+                yield None
+            for tarea in listas:
+                yield tarea.result()
+    finally:
+        # Si el cliente cortó la conexión no se sigue gastando Gemini en su lote
+        for tarea in pendientes:
+            tarea.cancel()
+
+async def _probar(user_id, jpeg_prenda, jpeg_usuario, on_etapa, prenda_id, descripcion=None) -> str:
+    prenda = descripcion
+    if prenda is None:
+        await on_etapa("describiendo")
+        # Misma imagen de prenda => misma descripción, se evita la llamada a Gemini
+        prenda = await descripcion_cache.obtener_o_calcular(
+            jpeg_prenda, lambda: descripcion_prenda(jpeg_prenda)
+        )
+
+    await on_etapa("generando")
+    prompt = construir_prompt(prenda)
+
+    response = await generar_contenido(
+        model="gemini-2.0-flash-exp-image-generation",
+        contents=[
+            prompt,
+            parte_jpeg(jpeg_prenda),
+            parte_jpeg(jpeg_usuario)
+        ],
+        config=types.GenerateContentConfig(response_modalities=['Text', 'Image'])
+    )
+
+    img_result = None
+    for part in response.candidates[0].content.parts:
+        if hasattr(part, "inline_data") and part.inline_data:
+            img_result = part.inline_data.data
+            break
+
+    if img_result is None:
+        raise HTTPException(status_code=500, detail="Gemini no devolvió imagen resultante")
+
+    # 1. Subir a Cloudinary: si Gemini ya devolvió JPEG pasa directo, sin decodificar
+    await on_etapa("subiendo")
+    if get_mime_type_bytes(img_result) != "image/jpeg":
+        try:
+            img_result = await run_in_threadpool(normalizar_imagen, img_result, None)
+        except ValueError:
+            raise HTTPException(status_code=500, detail="Gemini devolvió una imagen inválida")
+    url_result, public_id = await upload_image_to_cloudinary(img_result, folder="historial")
+
+    # 2) Una entrada nueva en la colección del historial (con su retención ya agendada)
+    await on_etapa("guardando")
+    await historial.agregar(user_id, url_result, public_id)
+
+    if prenda_id:
+        grafo.registrar("prueba", user_id=user_id, prenda_id=prenda_id)
+
+    # 3) Devuelve únicamente la URL de la nueva imagen
+    return url_result
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from bson.binary import Binary
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from backend.db.mongo import db
+from backend.utils.probador import ejecutar_probador, error_publico
+
+PROBADOR_JOBS_STORE = os.getenv("PROBADOR_JOBS_STORE", "mongo")  # "mongo" o "memoria"
+PROBADOR_JOBS_CONCURRENCIA = int(os.getenv("PROBADOR_JOBS_CONCURRENCIA", "4"))
+PROBADOR_JOBS_MAX_COLA = int(os.getenv("PROBADOR_JOBS_MAX_COLA", "100"))
+PROBADOR_JOBS_LEASE = int(os.getenv("PROBADOR_JOBS_LEASE", "300"))           # segundos
+# Cada cuánto el worker renueva el lease de un job en curso
+PROBADOR_JOBS_LATIDO = int(os.getenv("PROBADOR_JOBS_LATIDO", str(max(1, PROBADOR_JOBS_LEASE // 3))))  # segundos
+PROBADOR_JOBS_BARRIDO = int(os.getenv("PROBADOR_JOBS_BARRIDO", "60"))         # segundos
+PROBADOR_JOBS_RETENCION = int(os.getenv("PROBADOR_JOBS_RETENCION", "86400"))  # segundos
+
+ESTADOS_FINALES = ("completado", "error")
+
+logger = logging.getLogger(__name__)
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def job_publico(job: dict) -> dict:
+    """Lo que ve el cliente: sin las imágenes de entrada ni datos internos."""
+    return {
+        "job_id": job["_id"],
+        "estado": job["estado"],
+        "etapa": job.get("etapa"),
+        "img_generada": job.get("img_generada"),
+        "error": job.get("error"),
+        "creado": job["creado"].isoformat(),
+        "actualizado": job["actualizado"].isoformat(),
+    }
+
+
+class MemoriaJobStore:
+    """Backend en memoria, para tests y desarrollo local."""
+
+    def __init__(self):
+        self._jobs: dict[str, dict] = {}
+
+    async def crear(self, job: dict):
+        self._jobs[job["_id"]] = dict(job)
+
+    async def obtener(self, job_id: str):
+        job = self._jobs.get(job_id)
+        return {k: v for k, v in job.items() if k != "entradas"} if job else None
+
+    async def actualizar(self, job_id: str, cambios: dict, token: str = None) -> bool:
+        job = self._jobs.get(job_id)
+        if not job or (token and not self._tomado_por(job, token)):
+            return False
+        job.update(cambios)
+        job["actualizado"] = _ahora()
+        if cambios.get("estado") in ESTADOS_FINALES:
+            for k in ("entradas", "lease_hasta", "token"):
+                job.pop(k, None)
+        return True
+
+    async def reclamar(self, job_id: str, lease: int):
+        job = self._jobs.get(job_id)
+        if not job or not self._reclamable(job):
+            return None
+        job.update(estado="en_proceso", lease_hasta=_ahora() + timedelta(seconds=lease), token=uuid.uuid4().hex)
+        return dict(job)
+
+    async def renovar(self, job_id: str, token: str, lease: int) -> bool:
+        job = self._jobs.get(job_id)
+        if not job or not self._tomado_por(job, token):
+            return False
+        job["lease_hasta"] = _ahora() + timedelta(seconds=lease)
+        return True
+
+    async def reclamables(self) -> list[str]:
+        return [j["_id"] for j in self._jobs.values() if self._reclamable(j)]
+
+    @staticmethod
+    def _reclamable(job: dict) -> bool:
+        if job["estado"] == "pendiente":
+            return True
+        return job["estado"] == "en_proceso" and job.get("lease_hasta", _ahora()) < _ahora()
+
+    @staticmethod
+    def _tomado_por(job: dict, token: str) -> bool:
+        return job["estado"] == "en_proceso" and job.get("token") == token
+
+
+class MongoJobStore:
+    """
+    Jobs persistidos en Mongo: un reinicio no los pierde. Los jobs en curso
+    tienen un lease que el worker renueva mientras corre; si el proceso
+    muere, otro worker los vuelve a tomar al vencer. Cada reclamo lleva un
+    token nuevo y las escrituras del worker lo exigen, así uno que perdió el
+    job no pisa el resultado del otro. Los terminados expiran por índice TTL
+    sobre `expira`.
+    """
+
+    def __init__(self, coleccion: str = "probador_jobs"):
+        self.coleccion = coleccion
+
+    async def crear(self, job: dict):
+        job = dict(job)
+        job["entradas"] = {k: Binary(v) for k, v in job["entradas"].items()}
+        await db[self.coleccion].insert_one(job)
+
+    async def obtener(self, job_id: str):
+        return await db[self.coleccion].find_one({"_id": job_id}, {"entradas": 0})
+
+    async def actualizar(self, job_id: str, cambios: dict, token: str = None) -> bool:
+        update = {"$set": {**cambios, "actualizado": _ahora()}}
+        if cambios.get("estado") in ESTADOS_FINALES:
+            update["$set"]["expira"] = _ahora() + timedelta(seconds=PROBADOR_JOBS_RETENCION)
+            update["$unset"] = {"entradas": "", "lease_hasta": "", "token": ""}
+        filtro = {"_id": job_id}
+        if token:
+            filtro.update(estado="en_proceso", token=token)
+        res = await db[self.coleccion].update_one(filtro, update)
+        return res.matched_count > 0
+
+    def _filtro_reclamable(self) -> dict:
+        return {"$or": [
+            {"estado": "pendiente"},
+            {"estado": "en_proceso", "lease_hasta": {"$lt": _ahora()}},
+        ]}
+
+    async def reclamar(self, job_id: str, lease: int):
+        job = await db[self.coleccion].find_one_and_update(
+            {"_id": job_id, **self._filtro_reclamable()},
+            {"$set": {
+                "estado": "en_proceso",
+                "lease_hasta": _ahora() + timedelta(seconds=lease),
+                "token": uuid.uuid4().hex,
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job:
+            job["entradas"] = {k: bytes(v) for k, v in job["entradas"].items()}
+        return job
+
+    async def renovar(self, job_id: str, token: str, lease: int) -> bool:
+        res = await db[self.coleccion].update_one(
+            {"_id": job_id, "estado": "en_proceso", "token": token},
+            {"$set": {"lease_hasta": _ahora() + timedelta(seconds=lease)}},
+        )
+        return res.matched_count > 0
+
+    async def reclamables(self) -> list[str]:
+        cursor = db[self.coleccion].find(self._filtro_reclamable(), {"_id": 1}).sort("creado", 1)
+        return [d["_id"] async for d in cursor]
+
+
+class ProbadorWorkers:
+    """Pool acotado de workers que ejecuta el pipeline del probador en segundo plano."""
+
+    def __init__(self, store, concurrencia: int, max_cola: int):
+        self.store = store
+        self.concurrencia = concurrencia
+        self.cola: asyncio.Queue[str] = asyncio.Queue(maxsize=max_cola)
+        self._tareas: list[asyncio.Task] = []
+        # Un evento por cada request que espera (long-poll), agrupados por job
+        self._cambios: dict[str, set[asyncio.Event]] = {}
+        self._encolados: set[str] = set()
+
+    async def iniciar(self):
+        self._tareas = [asyncio.create_task(self._worker()) for _ in range(self.concurrencia)]
+        self._tareas.append(asyncio.create_task(self._barrer()))
+
+    async def detener(self):
+        for t in self._tareas:
+            t.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    async def encolar(self, user_id: str, contenido_prenda: bytes, contenido_usuario: bytes, prenda_id: str = None) -> dict:
+        if self.cola.full():
+            raise HTTPException(status_code=503, detail="El probador está saturado, reintentá en unos segundos")
+        ahora = _ahora()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "prenda_id": prenda_id,
+            "estado": "pendiente",
+            "etapa": None,
+            "creado": ahora,
+            "actualizado": ahora,
+            # Sin imagen de prenda el worker usa la del catálogo (prenda_id)
+            "entradas": {"usuario": contenido_usuario, **({"prenda": contenido_prenda} if contenido_prenda else {})},
+        }
+        await self.store.crear(job)
+        # Si la cola se llenó durante el await, queda pendiente y lo toma el barrido
+        self._poner_en_cola(job["_id"])
+        return await self.store.obtener(job["_id"])
+
+    def _poner_en_cola(self, job_id: str) -> bool:
+        if job_id in self._encolados:
+            return True
+        try:
+            self.cola.put_nowait(job_id)
+        except asyncio.QueueFull:
+            return False
+        self._encolados.add(job_id)
+        return True
+
+    async def esperar_cambio(self, job_id: str, timeout: float):
+        """Espera un aviso local de cambio; si el job corre en otro proceso, vence el timeout."""
+        evento = asyncio.Event()
+        oyentes = self._cambios.setdefault(job_id, set())
+        oyentes.add(evento)
+        try:
+            await asyncio.wait_for(evento.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Quien escucha relee el job en cada vuelta: el evento solo despierta antes
+            oyentes.discard(evento)
+            if not oyentes:
+                self._cambios.pop(job_id, None)
+
+    async def _actualizar(self, job_id: str, cambios: dict, token: str) -> bool:
+        """Solo escribe si el job sigue reclamado con `token`."""
+        if not await self.store.actualizar(job_id, cambios, token):
+            return False
+        for evento in self._cambios.get(job_id, ()):
+            evento.set()
+        return True
+
+    async def _worker(self):
+        while True:
+            job_id = await self.cola.get()
+            self._encolados.discard(job_id)
+            try:
+                await self._ejecutar(job_id)
+            except Exception:
+                logger.exception("Error en job del probador %s", job_id)
+            finally:
+                self.cola.task_done()
+
+    async def _ejecutar(self, job_id: str):
+        job = await self.store.reclamar(job_id, PROBADOR_JOBS_LEASE)
+        if not job:
+            return  # otro worker ya lo tomó o terminó
+        token = job["token"]
+        ejecucion = asyncio.create_task(ejecutar_probador(
+            job["user_id"], job["entradas"].get("prenda"), job["entradas"]["usuario"],
+            lambda etapa: self._etapa(job_id, token, etapa),
+            prenda_id=job.get("prenda_id"),
+        ))
+        latido = asyncio.create_task(self._latido(job_id, token, ejecucion))
+        try:
+            url = await ejecucion
+        except asyncio.CancelledError:
+            if latido.done():
+                logger.warning("Job del probador %s tomado por otro worker: se abandona", job_id)
+                return
+            raise
+        except Exception as e:
+            cambios = {"estado": "error", "error": error_publico(e)}
+        else:
+            cambios = {"estado": "completado", "etapa": "completado", "img_generada": url}
+        finally:
+            latido.cancel()
+            if not ejecucion.done():
+                ejecucion.cancel()
+        if not await self._actualizar(job_id, cambios, token):
+            logger.warning("Job del probador %s ya no es de este worker: no se guarda el resultado", job_id)
+
+    async def _etapa(self, job_id: str, token: str, etapa: str):
+        # Cada cambio de etapa también renueva el lease
+        cambios = {"etapa": etapa, "lease_hasta": _ahora() + timedelta(seconds=PROBADOR_JOBS_LEASE)}
+        await self._actualizar(job_id, cambios, token)
+
+    async def _latido(self, job_id: str, token: str, ejecucion: asyncio.Task):
+        """Renueva el lease mientras corre el job; si otro worker lo tomó, cancela la ejecución."""
+        while True:
+            await asyncio.sleep(PROBADOR_JOBS_LATIDO)
+            try:
+                vigente = await self.store.renovar(job_id, token, PROBADOR_JOBS_LEASE)
+            except Exception:
+                # Un fallo suelto no lo pierde: el lease dura varios latidos
+                logger.warning("Error renovando el lease del job %s", job_id, exc_info=True)
+                continue
+            if not vigente:
+                ejecucion.cancel()
+                return
+
+    async def _barrer(self):
+        """Retoma jobs pendientes o con lease vencido (p. ej. tras un reinicio)."""
+        while True:
+            try:
+                for job_id in await self.store.reclamables():
+                    if not self._poner_en_cola(job_id):
+                        break
+            except Exception:
+                logger.exception("Error recuperando jobs del probador")
+            await asyncio.sleep(PROBADOR_JOBS_BARRIDO)
+
+
+def crear_store():
+    if PROBADOR_JOBS_STORE == "memoria":
+        return MemoriaJobStore()
+    return MongoJobStore()
+
+
+probador_workers = ProbadorWorkers(crear_store(), PROBADOR_JOBS_CONCURRENCIA, PROBADOR_JOBS_MAX_COLA)
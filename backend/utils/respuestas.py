@@ -0,0 +1,25 @@
+"""
+Camino rápido de las respuestas de listados: los documentos de Mongo se
+pasan directo a dicts planos con los campos de la respuesta y se
+serializan con orjson, sin construir un modelo de pydantic por fila ni
+pasar por jsonable_encoder.
+
+Los endpoints conservan su response_model, así el esquema de OpenAPI no
+cambia; como devuelven una Response ya armada, FastAPI no vuelve a
+validar ni a serializar cada elemento. Quien arma los dicts es
+responsable de que respeten el modelo (solo tipos JSON: str, None,
+listas y dicts).
+"""
+import orjson
+from fastapi import Response
+
+
+def a_json(contenido) -> bytes:
+    return orjson.dumps(contenido)
+
+
+class RespuestaJSON(Response):
+    media_type = "application/json"
+
+    def render(self, contenido) -> bytes:
+        return a_json(contenido)
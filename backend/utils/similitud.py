@@ -0,0 +1,177 @@
+"""
+Firma visual de las prendas (hash perceptual + histograma de color) e índice
+vectorizado de vecinos más cercanos para "prendas similares".
+
+La firma se calcula al subir la imagen en crear_prenda/editar_prenda. Para
+las prendas que ya existían:
+
+    python -m backend.utils.similitud backfill
+"""
+import asyncio
+import os
+import sys
+
+import numpy as np
+from bson.objectid import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+
+from backend.db.clientes import clientes
+from backend.db.mongo import db
+from backend.utils.catalogo_cache import IndiceCatalogo, catalogo_cache
+from backend.utils.cloudinary_helper import descargar_imagen
+from backend.utils.imagenes import FuenteImagen, abrir_imagen
+
+# Peso del hash perceptual (forma/estructura) frente al histograma (color)
+SIMILITUD_PESO_PHASH = float(os.getenv("SIMILITUD_PESO_PHASH", "0.5"))
+
+_LADO_DCT = 32
+_BINS_HSV = (8, 4, 4)
+
+
+def _matriz_dct(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+_DCT = _matriz_dct(_LADO_DCT)
+
+
+def firma_visual(contenido: FuenteImagen) -> dict:
+    """
+    pHash de 64 bits (DCT de la imagen en grises a 32x32, bloque 8x8 de
+    bajas frecuencias contra su mediana) e histograma HSV normalizado de
+    8x4x4 bins. Decodifica a baja resolución (draft) porque solo hace falta
+    una miniatura.
+    """
+    img = abrir_imagen(contenido)
+    img.draft("RGB", (64, 64))
+    img = img.convert("RGB")
+
+    gris = np.asarray(img.convert("L").resize((_LADO_DCT, _LADO_DCT), Image.LANCZOS), dtype=np.float64)
+    bajas = (_DCT @ gris @ _DCT.T)[:8, :8].ravel()
+    bits = bajas > np.median(bajas[1:])
+    phash = int("".join("1" if b else "0" for b in bits), 2)
+
+    hsv = np.asarray(img.resize((64, 64)).convert("HSV")).reshape(-1, 3)
+    hist, _ = np.histogramdd(hsv, bins=_BINS_HSV, range=((0, 256), (0, 256), (0, 256)))
+    hist = hist.ravel() / hist.sum()
+
+    return {"phash": f"{phash:016x}", "histograma": [round(float(v), 5) for v in hist]}
+
+
+def _bits(phash: str) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(bytes.fromhex(phash), dtype=np.uint8))
+
+
+class IndiceVisual(IndiceCatalogo):
+    """
+    Matrices numpy con los bits del pHash y los histogramas de todo el
+    catálogo: una consulta es una operación vectorizada sobre todas las
+    filas. Las matrices crecen duplicando su capacidad y los borrados mueven
+    la última fila al hueco.
+    """
+
+    proyeccion = {"firma_visual": 1}
+
+    def __init__(self):
+        super().__init__()
+        self.ids: list[str] = []
+        self.filas: dict[str, int] = {}
+        self.bits = np.zeros((64, 64), dtype=np.uint8)
+        self.histogramas = np.zeros((64, int(np.prod(_BINS_HSV))), dtype=np.float32)
+
+    def agregar(self, prenda_id: str, doc: dict):
+        firma = doc.get("firma_visual")
+        if not firma:
+            self.quitar(prenda_id)
+            return
+        bits = _bits(firma["phash"])
+        hist = np.asarray(firma["histograma"], dtype=np.float32)
+        if prenda_id in self.filas:
+            fila = self.filas[prenda_id]
+            self.bits[fila], self.histogramas[fila] = bits, hist
+            return
+        fila = len(self.ids)
+        if fila == len(self.bits):
+            self.bits = np.concatenate([self.bits, np.zeros_like(self.bits)])
+            self.histogramas = np.concatenate([self.histogramas, np.zeros_like(self.histogramas)])
+        self.filas[prenda_id] = fila
+        self.ids.append(prenda_id)
+        self.bits[fila], self.histogramas[fila] = bits, hist
+
+    def quitar(self, prenda_id: str):
+        fila = self.filas.pop(prenda_id, None)
+        if fila is None:
+            return
+        ultima = len(self.ids) - 1
+        if fila != ultima:
+            movido = self.ids[ultima]
+            self.ids[fila] = movido
+            self.filas[movido] = fila
+            self.bits[fila] = self.bits[ultima]
+            self.histogramas[fila] = self.histogramas[ultima]
+        self.ids.pop()
+
+    def similares(self, prenda_id: str, limit: int) -> list[tuple[str, float]]:
+        fila = self.filas.get(prenda_id)
+        if fila is None or len(self.ids) < 2:
+            return []
+        n = len(self.ids)
+        bits, histogramas = self.bits[:n], self.histogramas[:n]
+        # Distancia de Hamming normalizada + (1 - intersección de histogramas)
+        d_hash = (bits != bits[fila]).mean(axis=1)
+        d_color = 1.0 - np.minimum(histogramas, histogramas[fila]).sum(axis=1)
+        distancia = SIMILITUD_PESO_PHASH * d_hash + (1 - SIMILITUD_PESO_PHASH) * d_color
+        distancia[fila] = np.inf
+
+        k = min(limit, n - 1)
+        mejores = np.argpartition(distancia, k - 1)[:k]
+        mejores = mejores[np.argsort(distancia[mejores])]
+        return [(self.ids[i], float(distancia[i])) for i in mejores]
+
+
+indice = IndiceVisual()
+
+
+async def backfill(concurrencia: int = 8):
+    """Calcula la firma de las prendas que no la tienen, descargando su imagen."""
+    limite = asyncio.Semaphore(concurrencia)
+    ok, errores = 0, 0
+
+    async def procesar(doc):
+        nonlocal ok, errores
+        async with limite:
+            try:
+                contenido = await descargar_imagen(doc["image_path"])
+                firma = await run_in_threadpool(firma_visual, contenido)
+                await db["prendas"].update_one({"_id": ObjectId(doc["_id"])}, {"$set": {"firma_visual": firma}})
+                ok += 1
+            except Exception as e:
+                errores += 1
+                print(f"Sin firma para {doc['_id']}: {e}")
+
+    docs = await db["prendas"].find(
+        {"firma_visual": {"$exists": False}, "image_path": {"$ne": None}},
+        {"image_path": 1},
+    ).to_list(None)
+    await asyncio.gather(*(procesar(d) for d in docs))
+    if ok:
+        # Los índices de los workers en marcha se reconstruyen con la nueva versión
+        await catalogo_cache.invalidar()
+    print(f"{ok} firmas calculadas, {errores} errores")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        async def main():
+            try:
+                await backfill()
+            finally:
+                await clientes.cerrar()
+        asyncio.run(main())
+    else:
+        print("uso: python -m backend.utils.similitud backfill")
@@ -0,0 +1,139 @@
+"""
+Subidas directas a Cloudinary: el cliente sube la imagen con parámetros que
+firmamos nosotros y la API solo maneja JSON chico (los bytes no pasan por
+el proceso).
+
+1. `firmar(destino, destino_id)`: parámetros de subida firmados con el
+   api_secret (public_id fijo en la carpeta del destino, formato, lado
+   máximo y derivados eager) y un token propio, de vida corta
+   (SUBIDA_FIRMA_TTL), que ata ese public_id al destino.
+2. El cliente hace POST de `campos` + `file` a `url`. Cloudinary rechaza
+   cualquier cambio a los parámetros firmados.
+3. `verificar(...)`: valida el token, que el public_id sea el firmado y la
+   firma de la respuesta de Cloudinary (public_id + version), y revisa el
+   recurso con la Admin API (formato y tamaño) antes de asociarlo.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+
+import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
+import cloudinary.utils
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from backend.db.clientes import clientes
+from backend.utils.borrados import borrados
+from backend.utils.cloudinary_helper import FORMATO_DERIVADOS, TAMANOS_IMAGEN
+from backend.utils.imagenes import IMAGEN_MAX_LADO_ORIGINAL
+from backend.utils.subidas import SUBIDA_MAX_BYTES
+
+SUBIDA_FIRMA_TTL = int(os.getenv("SUBIDA_FIRMA_TTL", "600"))     # segundos
+SUBIDA_FORMATOS = os.getenv("SUBIDA_FORMATOS", "jpg,png,webp")  # formatos de entrada aceptados
+
+CARPETAS_SUBIDA = {"prenda": "prendas", "perfil": "usuarios/profile"}
+
+
+def _config():
+    clientes.cloudinary()
+    config = cloudinary.config()
+    if not (config.api_key and config.api_secret):
+        raise HTTPException(status_code=503, detail="Las subidas directas no están configuradas")
+    return config
+
+
+def _b64(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode()
+
+
+def _de_b64(texto: str) -> bytes:
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _mac(cuerpo: str, secreto: str) -> str:
+    return _b64(hmac.new(secreto.encode(), cuerpo.encode(), hashlib.sha256).digest())
+
+
+def _token(datos: dict, secreto: str) -> str:
+    cuerpo = _b64(json.dumps(datos, separators=(",", ":")).encode())
+    return f"{cuerpo}.{_mac(cuerpo, secreto)}"
+
+
+def _leer_token(token: str, secreto: str) -> dict:
+    try:
+        cuerpo, mac = token.split(".")
+        valido = hmac.compare_digest(mac, _mac(cuerpo, secreto))
+        datos = json.loads(_de_b64(cuerpo)) if valido else None
+    except ValueError:
+        datos = None
+    if not datos:
+        raise HTTPException(status_code=403, detail="Token de subida inválido")
+    if datos["e"] < time.time():
+        raise HTTPException(status_code=403, detail="El token de subida venció, pedí una firma nueva")
+    return datos
+
+
+def parametros_subida(public_id: str) -> dict:
+    """Lo que se firma: fija dónde queda la imagen, en qué formato y de qué tamaño."""
+    return {
+        "public_id": public_id,
+        "timestamp": str(int(time.time())),
+        "format": "jpg",
+        "allowed_formats": SUBIDA_FORMATOS,
+        # Transformación entrante: Cloudinary guarda el original ya limitado
+        "transformation": cloudinary.utils.generate_transformation_string(
+            width=IMAGEN_MAX_LADO_ORIGINAL, height=IMAGEN_MAX_LADO_ORIGINAL, crop="limit",
+        )[0],
+        "eager": cloudinary.utils.build_eager(
+            [{**t, "format": FORMATO_DERIVADOS} for t in TAMANOS_IMAGEN.values()]
+        ),
+        "eager_async": "true",
+    }
+
+
+def firmar(destino: str, destino_id: str = None) -> dict:
+    config = _config()
+    public_id = f"{CARPETAS_SUBIDA[destino]}/{uuid.uuid4().hex}"
+    campos = cloudinary.utils.sign_request(parametros_subida(public_id), {})
+    expira = int(time.time()) + SUBIDA_FIRMA_TTL
+    return {
+        "url": cloudinary.utils.cloudinary_api_url("upload", resource_type="image"),
+        "campos": campos,
+        "token": _token({"d": destino, "i": destino_id, "p": public_id, "e": expira}, config.api_secret),
+        "expira": expira,
+    }
+
+
+async def verificar(token: str, public_id: str, version: int, signature: str) -> dict:
+    """
+    Comprueba una subida terminada y devuelve {"destino", "destino_id",
+    "public_id", "url"}. Una imagen firmada pero fuera de límites se manda a
+    borrar y responde 413.
+    """
+    config = _config()
+    datos = _leer_token(token, config.api_secret)
+    if public_id != datos["p"]:
+        raise HTTPException(status_code=403, detail="El public_id no es el de la firma")
+    if not cloudinary.utils.verify_api_response_signature(public_id, version, signature):
+        raise HTTPException(status_code=403, detail="Firma de Cloudinary inválida")
+
+    try:
+        recurso = await run_in_threadpool(cloudinary.api.resource, public_id)
+    except cloudinary.exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="La imagen no está en Cloudinary")
+    if recurso.get("format") != "jpg" or recurso.get("bytes", 0) > SUBIDA_MAX_BYTES:
+        await borrados.encolar(public_id)
+        raise HTTPException(status_code=413, detail="La imagen subida excede los límites")
+
+    return {
+        "destino": datos["d"],
+        "destino_id": datos["i"],
+        "public_id": public_id,
+        "url": recurso["secure_url"],
+    }
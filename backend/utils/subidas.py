@@ -0,0 +1,78 @@
+"""
+Ingesta de archivos subidos con memoria acotada.
+
+- `LimiteCuerpo` (middleware ASGI) corta con 413 los requests cuyo cuerpo
+  supera SUBIDA_MAX_CUERPO: por Content-Length sin leer nada, o al pasarse
+  mientras llega (cuerpos chunked).
+- El parser multipart de Starlette guarda cada archivo en un
+  SpooledTemporaryFile: pasado SUBIDA_SPOOL_BYTES va a disco en vez de
+  quedar en memoria.
+- `archivo_subido(...)` valida el tamaño de cada archivo (SUBIDA_MAX_BYTES)
+  y devuelve el archivo en disco/spool en vez de sus bytes: la imagen se
+  abre desde ahí (backend/utils/imagenes.py) y se decodifica ya reducida,
+  así nunca están en memoria el archivo entero y su decodificación a
+  resolución completa.
+"""
+import os
+from typing import BinaryIO
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.formparsers import MultiPartParser
+
+SUBIDA_MAX_BYTES = int(os.getenv("SUBIDA_MAX_BYTES", str(15 * 1024 * 1024)))     # por archivo
+SUBIDA_MAX_CUERPO = int(os.getenv("SUBIDA_MAX_CUERPO", str(60 * 1024 * 1024)))   # por request (lotes)
+SUBIDA_SPOOL_BYTES = int(os.getenv("SUBIDA_SPOOL_BYTES", str(256 * 1024)))
+
+# Umbral a partir del cual Starlette pasa cada archivo del multipart a disco
+MultiPartParser.spool_max_size = SUBIDA_SPOOL_BYTES
+
+
+def _legible(n: int) -> str:
+    return f"{n // (1024 * 1024)} MB" if n >= 1024 * 1024 else f"{n // 1024} KB"
+
+
+def _demasiado_grande(maximo: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"La subida supera el máximo de {_legible(maximo)}")
+
+
+def archivo_subido(file: UploadFile, quien: str = "") -> BinaryIO:
+    """El archivo (spool) de un UploadFile, al principio; 413 si supera SUBIDA_MAX_BYTES."""
+    if file.size is not None and file.size > SUBIDA_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"La imagen {quien}".rstrip() + f" supera el máximo de {_legible(SUBIDA_MAX_BYTES)}",
+        )
+    file.file.seek(0)
+    return file.file
+
+
+class LimiteCuerpo:
+    """Middleware ASGI que rechaza cuerpos de más de `max_bytes` lo antes posible."""
+
+    def __init__(self, app, max_bytes: int = SUBIDA_MAX_CUERPO):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        largo = dict(scope["headers"]).get(b"content-length")
+        if largo is not None and largo.isdigit() and int(largo) > self.max_bytes:
+            respuesta = JSONResponse({"detail": _demasiado_grande(self.max_bytes).detail}, status_code=413)
+            return await respuesta(scope, receive, send)
+
+        recibidos = 0
+
+        async def recibir():
+            nonlocal recibidos
+            mensaje = await receive()
+            if mensaje["type"] == "http.request":
+                recibidos += len(mensaje.get("body", b""))
+                if recibidos > self.max_bytes:
+                    # FastAPI deja pasar las HTTPException del parseo del cuerpo: sale como 413
+                    raise _demasiado_grande(self.max_bytes)
+            return mensaje
+
+        await self.app(scope, recibir, send)
@@ -0,0 +1,313 @@
+"""
+Carga mixta contra la app con Mongo, Cloudinary, Neo4j y Gemini locales
+(bench/fakes.py). Reporta p50/p95/p99 y throughput por endpoint y compara
+con la línea base guardada en bench/baseline.json.
+
+    pip install -r bench/requirements.txt
+    python -m bench.carga                       # corre y compara con la base
+    python -m bench.carga --guardar-baseline    # corre y guarda la base
+    python -m bench.carga --estricto            # sale con 1 si hay regresiones
+
+Las peticiones van en proceso (httpx + ASGITransport): se mide el costo de
+la app y sus dependencias locales, sin red.
+
+El cache de usuarios usa el backend en memoria; con
+USUARIOS_CACHE_BACKEND=redis corre contra fakeredis. mongomock no cede el
+event loop y fakeredis sí, así que en ese modo cada ida a Redis espera a los
+demás usuarios virtuales: sirve para probar el backend compartido, no para
+comparar latencias con la base.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from bench.fakes import imagen_jpeg, instalar
+
+BASELINE = Path(__file__).with_name("baseline.json")
+
+TIPOS = ["remera", "buzo", "campera", "pantalon", "short", "vestido"]
+MARCAS = ["Nike", "Adidas", "Puma", "Reebok", "Fila", "Topper", "Kappa", "Umbro"]
+PALABRAS = ["basica", "oversize", "estampada", "lisa", "rayas", "deportiva", "algodon", "friza", "nylon", "jean"]
+
+# (escenario, peso): mezcla aproximada de una sesión de uso real
+MEZCLA = [
+    ("catalogo", 25),
+    ("catalogo_pagina_2", 8),
+    ("prenda", 15),
+    ("por_tipo", 10),
+    ("buscar", 10),
+    ("login", 10),
+    ("perfil", 8),
+    ("agregar_favorito", 8),
+    ("ver_favoritos", 7),
+    ("quitar_favorito", 4),
+    ("ver_historial", 5),
+    ("probador", 3),
+    ("subida_directa", 2),
+]
+
+
+async def sembrar(db, prendas: int, usuarios: int, rnd: random.Random) -> dict:
+    """Carga el catálogo y los usuarios directo en la base, sin pasar por la API."""
+    docs = []
+    for i in range(prendas):
+        url = f"https://res.cloudinary.com/bench/image/upload/v1/prendas/seed{i}.jpg"
+        docs.append({
+            "nombre": f"{rnd.choice(PALABRAS).capitalize()} {rnd.choice(PALABRAS)} {i}",
+            "tipo": rnd.choice(TIPOS),
+            "descripcion": " ".join(rnd.choices(PALABRAS, k=8)),
+            "marca": rnd.choice(MARCAS),
+            "image_path": url,
+            "image_public_id": f"prendas/seed{i}",
+        })
+    res = await db["prendas"].insert_many(docs)
+    res_u = await db["usuarios"].insert_many([
+        {"username": f"u{i}", "email": f"u{i}@example.com", "password": "bench", "rol": "final",
+         "favoritos": []}
+        for i in range(usuarios)
+    ])
+    return {
+        "prendas": [str(i) for i in res.inserted_ids],
+        "urls": [d["image_path"] for d in docs],
+        "usuarios": [(str(i), f"u{n}@example.com") for n, i in enumerate(res_u.inserted_ids)],
+    }
+
+
+class Escenarios:
+    """Cada escenario hace una petición y devuelve (etiqueta del endpoint, respuesta)."""
+
+    def __init__(self, cliente, datos: dict, rnd: random.Random, cloudinary):
+        self.c = cliente
+        self.cloudinary = cloudinary
+        self.datos = datos
+        self.rnd = rnd
+        self.imagen_prenda = imagen_jpeg((200, 30, 30))
+        self.imagen_usuario = imagen_jpeg((40, 40, 200))
+
+    def _usuario(self):
+        return self.rnd.choice(self.datos["usuarios"])
+
+    async def catalogo(self):
+        r = await self.c.get("/api/prendas", params={"limit": 24, "tamano": "thumb"})
+        return "GET /api/prendas", r
+
+    async def catalogo_pagina_2(self):
+        r = await self.c.get("/api/prendas", params={"limit": 24, "tamano": "thumb"})
+        cursor = r.headers.get("x-next-cursor")
+        if cursor:
+            r = await self.c.get("/api/prendas", params={"limit": 24, "tamano": "thumb", "cursor": cursor})
+        return "GET /api/prendas?cursor", r
+
+    async def prenda(self):
+        r = await self.c.get(f"/api/prendas/{self.rnd.choice(self.datos['prendas'])}", params={"tamano": "card"})
+        return "GET /api/prendas/{id}", r
+
+    async def por_tipo(self):
+        r = await self.c.get(f"/api/prendas/tipo/{self.rnd.choice(TIPOS)}", params={"limit": 24})
+        return "GET /api/prendas/tipo/{tipo}", r
+
+    async def buscar(self):
+        modo = self.rnd.choice(["relevancia", "prefijo"])
+        q = self.rnd.choice(PALABRAS)
+        r = await self.c.get("/api/prendas/buscar", params={"q": q if modo == "relevancia" else q[:3], "modo": modo})
+        return f"GET /api/prendas/buscar ({modo})", r
+
+    async def login(self):
+        _, email = self._usuario()
+        r = await self.c.get("/api/usuarios/login", params={"email": email, "password": "bench"})
+        return "GET /api/usuarios/login", r
+
+    async def perfil(self):
+        user_id, _ = self._usuario()
+        r = await self.c.get(f"/api/usuarios/{user_id}", params={"tamano": "thumb"})
+        return "GET /api/usuarios/{id}", r
+
+    async def agregar_favorito(self):
+        user_id, _ = self._usuario()
+        r = await self.c.post(f"/api/usuarios/{user_id}/favoritos", data={"image_url": self.rnd.choice(self.datos["urls"])})
+        return "POST /api/usuarios/{id}/favoritos", r
+
+    async def ver_favoritos(self):
+        user_id, _ = self._usuario()
+        r = await self.c.get(f"/api/usuarios/{user_id}/favoritos")
+        return "GET /api/usuarios/{id}/favoritos", r
+
+    async def quitar_favorito(self):
+        user_id, _ = self._usuario()
+        r = await self.c.delete(f"/api/usuarios/{user_id}/favoritos/0")
+        return "DELETE /api/usuarios/{id}/favoritos/{idx}", r
+
+    async def ver_historial(self):
+        user_id, _ = self._usuario()
+        r = await self.c.get(f"/api/usuarios/{user_id}/historial", params={"tamano": "thumb"})
+        return "GET /api/usuarios/{id}/historial", r
+
+    async def probador(self):
+        user_id, _ = self._usuario()
+        r = await self.c.post(
+            "/api/probador",
+            data={"user_id": user_id, "prenda_id": self.rnd.choice(self.datos["prendas"])},
+            files={
+                "file_prenda": ("prenda.jpg", self.imagen_prenda, "image/jpeg"),
+                "file_usuario": ("usuario.jpg", self.imagen_usuario, "image/jpeg"),
+            },
+        )
+        return "POST /api/probador", r
+
+    async def subida_directa(self):
+        """Firma, subida al Cloudinary local (como haría el navegador) y confirmación."""
+        user_id, _ = self._usuario()
+        r = await self.c.post("/api/subidas/firma", json={"destino": "perfil", "destino_id": user_id})
+        if r.status_code != 200:
+            return "POST /api/subidas (firma+confirmar)", r
+        firma = r.json()
+        subida = self.cloudinary.subida_directa(firma["campos"], self.imagen_usuario)
+        r = await self.c.post("/api/subidas/confirmar", json={
+            "token": firma["token"],
+            "public_id": subida["public_id"],
+            "version": subida["version"],
+            "signature": subida["signature"],
+        })
+        return "POST /api/subidas (firma+confirmar)", r
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentil por rango más cercano sobre una lista ordenada."""
+    if not valores:
+        return 0.0
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+
+def resumir(muestras: dict, duracion: float) -> dict:
+    resumen = {}
+    for etiqueta, filas in sorted(muestras.items()):
+        tiempos = sorted(t for t, _ in filas)
+        resumen[etiqueta] = {
+            "n": len(filas),
+            "rps": round(len(filas) / duracion, 2),
+            "p50_ms": round(percentil(tiempos, 50) * 1000, 2),
+            "p95_ms": round(percentil(tiempos, 95) * 1000, 2),
+            "p99_ms": round(percentil(tiempos, 99) * 1000, 2),
+            "errores": sum(1 for _, ok in filas if not ok),
+        }
+    return resumen
+
+
+async def correr(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-cloudinary-") as directorio:
+        locales = instalar(Path(directorio), args.latencia_gemini)
+
+        import httpx
+        from backend.main import app
+
+        rnd = random.Random(args.semilla)
+        datos = await sembrar(locales.db, args.prendas, args.usuarios, rnd)
+
+        muestras: dict[str, list[tuple[float, bool]]] = defaultdict(list)
+        nombres, pesos = zip(*MEZCLA)
+
+        async with app.router.lifespan_context(app):
+            transporte = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=60) as cliente:
+
+                async def usuario_virtual(n: int, hasta: float):
+                    escenarios = Escenarios(cliente, datos, random.Random(args.semilla + n), locales.cloudinary)
+                    while time.perf_counter() < hasta:
+                        nombre = escenarios.rnd.choices(nombres, pesos)[0]
+                        inicio = time.perf_counter()
+                        try:
+                            etiqueta, r = await getattr(escenarios, nombre)()
+                            ok = r.status_code < 500
+                        except Exception as e:
+                            etiqueta, ok = nombre, False
+                            print(f"{nombre}: {e!r}")
+                        muestras[etiqueta].append((time.perf_counter() - inicio, ok))
+
+                # Calentamiento: carga de índices, caches y primeras conexiones
+                await asyncio.gather(*(usuario_virtual(n, time.perf_counter() + args.calentamiento)
+                                       for n in range(args.concurrencia)))
+                muestras.clear()
+
+                inicio = time.perf_counter()
+                await asyncio.gather(*(usuario_virtual(n, inicio + args.duracion)
+                                       for n in range(args.concurrencia)))
+                duracion = time.perf_counter() - inicio
+
+    total = [m for filas in muestras.values() for m in filas]
+    return {
+        "config": {k: getattr(args, k) for k in ("prendas", "usuarios", "concurrencia", "duracion", "latencia_gemini", "semilla")},
+        "total": {
+            "n": len(total),
+            "rps": round(len(total) / duracion, 2),
+            "errores": sum(1 for _, ok in total if not ok),
+        },
+        "endpoints": resumir(muestras, duracion),
+    }
+
+
+def imprimir(resultado: dict, regresiones: dict):
+    print(f"\n{'endpoint':45} {'n':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err':>5}")
+    for etiqueta, r in resultado["endpoints"].items():
+        marca = "  <- " + regresiones[etiqueta] if etiqueta in regresiones else ""
+        print(f"{etiqueta:45} {r['n']:>6} {r['rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['errores']:>5}{marca}")
+    t = resultado["total"]
+    print(f"{'TOTAL':45} {t['n']:>6} {t['rps']:>8} {'':>9} {'':>9} {'':>9} {t['errores']:>5}")
+
+
+def comparar(resultado: dict, base: dict, tolerancia: float) -> dict:
+    """Endpoints cuyo p95 empeoró o cuyo throughput cayó más que la tolerancia."""
+    regresiones = {}
+    for etiqueta, r in resultado["endpoints"].items():
+        b = base.get("endpoints", {}).get(etiqueta)
+        if not b:
+            continue
+        if b["p95_ms"] and r["p95_ms"] > b["p95_ms"] * (1 + tolerancia):
+            regresiones[etiqueta] = f"p95 {b['p95_ms']} -> {r['p95_ms']} ms"
+        elif b["rps"] and r["rps"] < b["rps"] * (1 - tolerancia):
+            regresiones[etiqueta] = f"rps {b['rps']} -> {r['rps']}"
+    if base.get("config") != resultado["config"]:
+        print("Aviso: la línea base se tomó con otra configuración; la comparación es orientativa.")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga mixta con servicios locales.")
+    parser.add_argument("--prendas", type=int, default=2000)
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=20, help="usuarios virtuales simultáneos")
+    parser.add_argument("--duracion", type=float, default=20, help="segundos de medición")
+    parser.add_argument("--calentamiento", type=float, default=3, help="segundos antes de medir")
+    parser.add_argument("--latencia-gemini", type=float, default=0.5, help="segundos por llamada a Gemini")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento admitido vs la base")
+    parser.add_argument("--salida", type=Path, help="guardar el resultado en este JSON")
+    parser.add_argument("--guardar-baseline", action="store_true")
+    parser.add_argument("--estricto", action="store_true", help="salir con 1 si hay regresiones")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(correr(args))
+
+    regresiones = {}
+    if BASELINE.exists() and not args.guardar_baseline:
+        regresiones = comparar(resultado, json.loads(BASELINE.read_text()), args.tolerancia)
+    imprimir(resultado, regresiones)
+
+    if args.salida:
+        args.salida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False))
+    if args.guardar_baseline:
+        BASELINE.write_text(json.dumps(resultado, indent=2, ensure_ascii=False) + "\n")
+        print(f"\nLínea base guardada en {BASELINE}")
+    elif regresiones:
+        print(f"\n{len(regresiones)} endpoint(s) con regresión (tolerancia {args.tolerancia:.0%})")
+        if args.estricto:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
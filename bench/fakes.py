@@ -0,0 +1,186 @@
+"""
+Reemplazos locales de Mongo, Redis, Cloudinary, Neo4j y Gemini para correr la app
+sin servicios externos. `instalar()` los inyecta en el registro de clientes
+(backend/db/clientes.py) antes de arrancar la app.
+"""
+import asyncio
+import io
+import itertools
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+from PIL import Image
+
+# Credenciales de mentira: alcanzan para firmar y verificar como lo hace Cloudinary
+CLOUDINARY_BENCH = {
+    "CLOUDINARY_CLOUD_NAME": "bench",
+    "CLOUDINARY_API_KEY": "bench-key",
+    "CLOUDINARY_API_SECRET": "bench-secret",
+}
+
+
+def imagen_jpeg(color=(200, 30, 30), tamano=(768, 1024)) -> bytes:
+    b = io.BytesIO()
+    Image.new("RGB", tamano, color).save(b, format="JPEG", quality=90)
+    return b.getvalue()
+
+
+class CloudinaryEnDisco:
+    """
+    upload/delete_resources/resource sobre archivos en `directorio`, la
+    subida firmada que hace el cliente directo a Cloudinary
+    (`subida_directa`) y un transporte httpx que sirve las URLs de entrega.
+    """
+
+    def __init__(self, directorio: Path, secreto: str):
+        self.directorio = directorio
+        self.secreto = secreto
+        self._contador = itertools.count()
+
+    def upload(self, contenido, folder="default", **opciones):
+        public_id = f"{folder}/{next(self._contador)}"
+        ruta = self.directorio / f"{public_id}.jpg"
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        ruta.write_bytes(contenido)
+        # Misma forma que una URL real, así funcionan los derivados (?tamano=)
+        return {
+            "secure_url": f"https://res.cloudinary.com/bench/image/upload/v1/{public_id}.jpg",
+            "public_id": public_id,
+        }
+
+    def resource(self, public_id, **opciones):
+        from cloudinary.exceptions import NotFound
+        ruta = self.directorio / f"{public_id}.jpg"
+        if not ruta.exists():
+            raise NotFound(f"Resource not found - {public_id}")
+        return {
+            "public_id": public_id,
+            "format": "jpg",
+            "bytes": ruta.stat().st_size,
+            "secure_url": f"https://res.cloudinary.com/bench/image/upload/v1/{public_id}.jpg",
+        }
+
+    def subida_directa(self, campos: dict, contenido: bytes) -> dict:
+        """
+        Lo que hace el endpoint de upload de Cloudinary con una subida
+        firmada: verifica la firma y su vigencia, aplica allowed_formats y
+        devuelve public_id, version y la firma de la respuesta.
+        """
+        from cloudinary.utils import api_sign_request
+        firmados = {k: v for k, v in campos.items() if k not in ("signature", "api_key")}
+        if campos.get("signature") != api_sign_request(firmados, self.secreto):
+            raise ValueError("Invalid Signature")
+        if time.time() - int(campos["timestamp"]) > 3600:
+            raise ValueError("Stale request")
+        formato = Image.open(io.BytesIO(contenido)).format.lower().replace("jpeg", "jpg")
+        if formato not in campos["allowed_formats"].split(","):
+            raise ValueError(f"Image file format {formato} not allowed")
+
+        public_id = campos["public_id"]
+        ruta = self.directorio / f"{public_id}.jpg"
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        ruta.write_bytes(contenido)
+        version = int(time.time())
+        return {
+            "public_id": public_id,
+            "version": version,
+            "signature": api_sign_request({"public_id": public_id, "version": version}, self.secreto, signature_version=1),
+            "secure_url": f"https://res.cloudinary.com/bench/image/upload/v{version}/{public_id}.jpg",
+        }
+
+    def transporte(self) -> httpx.MockTransport:
+        """Entrega de imágenes: ignora la transformación y devuelve el archivo guardado."""
+        def servir(request: httpx.Request) -> httpx.Response:
+            ruta = request.url.path.split("/image/upload/", 1)[-1]
+            # .../<transformación>/v<version>/<public_id>.<ext>
+            partes = ruta.split("/")
+            while partes and not (partes[0].startswith("v") and partes[0][1:].isdigit()):
+                partes.pop(0)
+            archivo = self.directorio / ("/".join(partes[1:]).rsplit(".", 1)[0] + ".jpg")
+            if not archivo.exists():
+                return httpx.Response(404)
+            return httpx.Response(200, content=archivo.read_bytes(), headers={"content-type": "image/jpeg"})
+
+        return httpx.MockTransport(servir)
+
+    def delete_resources(self, public_ids, **opciones):
+        deleted = {}
+        for p in public_ids:
+            ruta = self.directorio / f"{p}.jpg"
+            if ruta.exists():
+                ruta.unlink()
+                deleted[p] = "deleted"
+            else:
+                deleted[p] = "not_found"
+        return {"deleted": deleted}
+
+
+class GeminiFalso:
+    """generate_content con latencia fija: texto para describir, una imagen fija para generar."""
+
+    def __init__(self, latencia: float):
+        self.latencia = latencia
+        self.imagen = imagen_jpeg((30, 160, 60))
+        self.llamadas = 0
+
+    async def generate_content(self, model, contents, config=None):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia)
+        if "image" in model:
+            parte = SimpleNamespace(text=None, inline_data=SimpleNamespace(data=self.imagen, mime_type="image/jpeg"))
+        else:
+            parte = SimpleNamespace(text="T-shirt: cotton, crew neck, red", inline_data=None)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[parte]))])
+
+
+class Neo4jFalso:
+    """Acepta cualquier consulta y no devuelve registros."""
+
+    def __init__(self):
+        self.consultas = 0
+
+    async def execute_query(self, consulta, *args, **kwargs):
+        self.consultas += 1
+        return [], None, []
+
+    async def verify_connectivity(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def instalar(directorio: Path, latencia_gemini: float) -> SimpleNamespace:
+    # mongomock no implementa $text: la búsqueda usa el índice en memoria
+    os.environ.setdefault("BUSCADOR_USAR_MONGO", "0")
+    # El bench mide la app, no el cupo por usuario del probador
+    os.environ.setdefault("GEMINI_CUPO_USUARIO", "1000000")
+    for nombre, valor in CLOUDINARY_BENCH.items():
+        os.environ[nombre] = valor
+
+    import fakeredis
+    from mongomock_motor import AsyncMongoMockClient
+
+    from backend.db.clientes import clientes
+    gemini = GeminiFalso(latencia_gemini)
+    mongo = AsyncMongoMockClient()
+    clientes.reemplazar(
+        mongo=mongo,
+        neo4j=Neo4jFalso(),
+        genai=SimpleNamespace(aio=SimpleNamespace(models=gemini)),
+        # Solo se usa con USUARIOS_CACHE_BACKEND=redis
+        redis=fakeredis.FakeAsyncRedis(),
+    )
+
+    import cloudinary.api
+    import cloudinary.uploader
+    cloudinary_falso = CloudinaryEnDisco(directorio, CLOUDINARY_BENCH["CLOUDINARY_API_SECRET"])
+    cloudinary.uploader.upload = cloudinary_falso.upload
+    cloudinary.api.delete_resources = cloudinary_falso.delete_resources
+    cloudinary.api.resource = cloudinary_falso.resource
+    clientes.reemplazar(http=httpx.AsyncClient(transport=cloudinary_falso.transporte()))
+
+    return SimpleNamespace(db=clientes.db(), cloudinary=cloudinary_falso, gemini=gemini, neo4j=clientes.neo4j())
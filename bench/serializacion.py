@@ -0,0 +1,125 @@
+"""
+Costo de CPU por elemento de serializar los listados (catálogo y usuarios):
+el camino con modelos de pydantic (un modelo por fila + validación y
+serialización del response_model, como hacía FastAPI) contra el camino
+rápido (dicts planos + orjson, backend/utils/respuestas.py).
+
+    python -m bench.serializacion                  # 10k prendas y 10k usuarios
+    python -m bench.serializacion --items 50000
+
+Parte de documentos como los devuelve Mongo (con _id ObjectId) y llega
+hasta los bytes de la respuesta; no incluye la consulta.
+"""
+import argparse
+import json
+import random
+import time
+
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from backend.models.prenda import PrendaParcial
+from backend.models.user import UserParcial
+from backend.routers.prendas import CAMPOS_PRENDA, datos_prenda
+from backend.routers.users import CAMPOS_USUARIO_EXPORT, normalize_user
+from backend.utils.respuestas import a_json
+
+PALABRAS = ["basica", "oversize", "estampada", "lisa", "rayas", "deportiva", "algodon", "friza", "nylon", "jean"]
+
+
+def prendas(n: int, rnd: random.Random) -> list[dict]:
+    docs = []
+    for i in range(n):
+        url = f"https://res.cloudinary.com/bench/image/upload/v1/prendas/seed{i}.jpg"
+        docs.append({
+            "_id": ObjectId(),
+            "nombre": f"{rnd.choice(PALABRAS).capitalize()} {rnd.choice(PALABRAS)} {i}",
+            "tipo": rnd.choice(["remera", "buzo", "campera"]),
+            "descripcion": " ".join(rnd.choices(PALABRAS, k=8)),
+            "marca": rnd.choice(["Nike", "Adidas", "Puma"]),
+            "image_path": url,
+            "imagenes": {
+                "thumb": url.replace("/upload/", "/upload/c_limit,q_auto,w_200/"),
+                "card": url.replace("/upload/", "/upload/c_limit,q_auto,w_480/"),
+                "full": url,
+            },
+        })
+    return docs
+
+
+def usuarios(n: int, urls: list[str], rnd: random.Random) -> list[dict]:
+    return [
+        {
+            "_id": ObjectId(),
+            "username": f"u{i}",
+            "email": f"u{i}@example.com",
+            "rol": "final",
+            "profile_image_path": None,
+            "profile_imagenes": None,
+            "favoritos": rnd.sample(urls, 5),
+        }
+        for i in range(n)
+    ]
+
+
+def medir(funcion, repeticiones: int) -> float:
+    """Mejor tiempo de CPU (segundos) de `repeticiones` corridas."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.process_time()
+        funcion()
+        mejor = min(mejor, time.process_time() - inicio)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU por elemento de la serialización de listados.")
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semilla)
+    docs_prendas = prendas(args.items, rnd)
+    docs_usuarios = usuarios(args.items, [d["image_path"] for d in docs_prendas], rnd)
+    proyeccion = {c: 1 for c in CAMPOS_PRENDA}
+    lista_usuarios = TypeAdapter(list[UserParcial])
+
+    def prendas_modelos():
+        # Un PrendaParcial por fila + jsonable_encoder + json.dumps
+        filas = [PrendaParcial(**datos_prenda(d, proyeccion, "thumb")) for d in docs_prendas]
+        return json.dumps(
+            jsonable_encoder(filas, exclude_unset=True), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    def prendas_rapido():
+        return a_json([datos_prenda(d, proyeccion, "thumb") for d in docs_prendas])
+
+    def usuarios_modelos():
+        # response_model=list[UserParcial]: valida cada fila (EmailStr incluido) y serializa
+        filas = [normalize_user(u, None, CAMPOS_USUARIO_EXPORT) for u in docs_usuarios]
+        return lista_usuarios.dump_json(lista_usuarios.validate_python(filas), exclude_unset=True)
+
+    def usuarios_rapido():
+        return a_json([normalize_user(u, None, CAMPOS_USUARIO_EXPORT) for u in docs_usuarios])
+
+    # Los dos caminos tienen que producir el mismo JSON
+    assert json.loads(prendas_modelos()) == json.loads(prendas_rapido())
+    assert json.loads(usuarios_modelos()) == json.loads(usuarios_rapido())
+
+    print(f"{'listado':<12}{'camino':<10}{'total ms':>10}{'µs/item':>10}{'bytes':>12}")
+    for listado, caminos in (
+        ("prendas", (("modelos", prendas_modelos), ("rapido", prendas_rapido))),
+        ("usuarios", (("modelos", usuarios_modelos), ("rapido", usuarios_rapido))),
+    ):
+        tiempos = {}
+        for camino, funcion in caminos:
+            tiempos[camino] = medir(funcion, args.repeticiones)
+            print(f"{listado:<12}{camino:<10}{tiempos[camino] * 1000:>10.1f}"
+                  f"{tiempos[camino] / args.items * 1e6:>10.2f}{len(funcion()):>12}")
+        print(f"{'':<12}{'':<10}{tiempos['modelos'] / tiempos['rapido']:>9.1f}x más rápido\n")
+
+
+if __name__ == "__main__":
+    main()
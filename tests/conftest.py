@@ -0,0 +1,15 @@
+"""
+Las pruebas corren contra los reemplazos locales de bench/fakes.py: sin
+Mongo, Redis, Cloudinary, Neo4j ni Gemini reales.
+
+    pip install -r tests/requirements.txt
+    python -m pytest
+"""
+import pytest
+
+from bench.fakes import instalar
+
+
+@pytest.fixture
+def locales(tmp_path):
+    return instalar(tmp_path, latencia_gemini=0)
@@ -0,0 +1,52 @@
+import asyncio
+
+from backend.utils.descripcion_cache import DescripcionCache
+
+
+def test_cancelar_al_que_calcula_no_cancela_a_los_que_esperan(locales):
+    async def escenario():
+        cache = DescripcionCache("descripciones_prueba", 10, 60)
+        empezo = asyncio.Event()
+
+        async def lenta():
+            empezo.set()
+            await asyncio.sleep(10)
+            return "no debería llegar"
+
+        async def rapida():
+            return "remera roja"
+
+        duenio = asyncio.create_task(cache.obtener_o_calcular(b"imagen", lenta))
+        await empezo.wait()
+        espera = asyncio.create_task(cache.obtener_o_calcular(b"imagen", rapida))
+        await asyncio.sleep(0)
+        duenio.cancel()
+
+        assert await asyncio.wait_for(espera, 1) == "remera roja"
+        assert duenio.cancelled()
+        assert cache._en_curso == {}
+
+    asyncio.run(escenario())
+
+
+def test_cancelar_al_que_espera_no_corta_el_calculo(locales):
+    async def escenario():
+        cache = DescripcionCache("descripciones_prueba", 10, 60)
+        sigue = asyncio.Event()
+
+        async def calcular():
+            await sigue.wait()
+            return "buzo gris"
+
+        duenio = asyncio.create_task(cache.obtener_o_calcular(b"imagen", calcular))
+        await asyncio.sleep(0)
+        espera = asyncio.create_task(cache.obtener_o_calcular(b"imagen", calcular))
+        await asyncio.sleep(0)
+        espera.cancel()
+        await asyncio.sleep(0)
+        sigue.set()
+
+        assert await duenio == "buzo gris"
+        assert espera.cancelled()
+
+    asyncio.run(escenario())
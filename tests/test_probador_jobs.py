@@ -0,0 +1,136 @@
+import asyncio
+from datetime import timedelta
+
+from backend.utils import probador_jobs
+from backend.utils.probador_jobs import MemoriaJobStore, ProbadorWorkers, _ahora
+
+
+def nuevo_job(job_id: str = "j1") -> dict:
+    ahora = _ahora()
+    return {
+        "_id": job_id,
+        "user_id": "u1",
+        "prenda_id": None,
+        "estado": "pendiente",
+        "etapa": None,
+        "creado": ahora,
+        "actualizado": ahora,
+        "entradas": {"usuario": b"usuario", "prenda": b"prenda"},
+    }
+
+
+def test_job_reclamado_por_otro_worker_no_guarda_su_resultado(monkeypatch):
+    monkeypatch.setattr(probador_jobs, "PROBADOR_JOBS_LATIDO", 0.01, raising=False)
+
+    async def escenario():
+        store = MemoriaJobStore()
+        workers = ProbadorWorkers(store, 1, 10)
+        await store.crear(nuevo_job())
+        corriendo = asyncio.Event()
+        cancelada = []
+
+        async def probador_lento(user_id, contenido_prenda, contenido_usuario, on_etapa, prenda_id=None):
+            corriendo.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelada.append(True)
+                raise
+            return "https://viejo"
+
+        monkeypatch.setattr(probador_jobs, "ejecutar_probador", probador_lento)
+        ejecucion = asyncio.create_task(workers._ejecutar("j1"))
+        await corriendo.wait()
+
+        # El lease venció y otro worker lo reclamó con un token nuevo
+        store._jobs["j1"]["lease_hasta"] = _ahora() - timedelta(seconds=1)
+        assert await store.reclamar("j1", 300)
+        await asyncio.wait_for(ejecucion, 1)
+
+        assert cancelada
+        job = await store.obtener("j1")
+        assert job["estado"] == "en_proceso"
+        assert "img_generada" not in job
+
+    asyncio.run(escenario())
+
+
+def test_resultado_tardio_de_un_token_viejo_se_descarta(monkeypatch):
+    async def escenario():
+        store = MemoriaJobStore()
+        workers = ProbadorWorkers(store, 1, 10)
+        await store.crear(nuevo_job())
+        sigue = asyncio.Event()
+
+        async def probador(user_id, contenido_prenda, contenido_usuario, on_etapa, prenda_id=None):
+            await sigue.wait()
+            return "https://viejo"
+
+        monkeypatch.setattr(probador_jobs, "ejecutar_probador", probador)
+        ejecucion = asyncio.create_task(workers._ejecutar("j1"))
+        await asyncio.sleep(0)
+
+        store._jobs["j1"]["lease_hasta"] = _ahora() - timedelta(seconds=1)
+        assert await store.reclamar("j1", 300)
+        # Termina antes de que el latido note que perdió el job
+        sigue.set()
+        await asyncio.wait_for(ejecucion, 1)
+
+        job = await store.obtener("j1")
+        assert job["estado"] == "en_proceso"
+        assert "img_generada" not in job
+
+    asyncio.run(escenario())
+
+
+def test_el_latido_mantiene_el_lease_y_el_job_corre_una_vez(monkeypatch):
+    monkeypatch.setattr(probador_jobs, "PROBADOR_JOBS_LEASE", 0.2)
+    monkeypatch.setattr(probador_jobs, "PROBADOR_JOBS_LATIDO", 0.05, raising=False)
+
+    async def escenario():
+        store = MemoriaJobStore()
+        uno, otro = ProbadorWorkers(store, 1, 10), ProbadorWorkers(store, 1, 10)
+        await store.crear(nuevo_job())
+        llamadas = []
+        corriendo = asyncio.Event()
+
+        async def probador(user_id, contenido_prenda, contenido_usuario, on_etapa, prenda_id=None):
+            llamadas.append(user_id)
+            corriendo.set()
+            # Dura varias veces el lease
+            await asyncio.sleep(0.6)
+            return "https://ok"
+
+        monkeypatch.setattr(probador_jobs, "ejecutar_probador", probador)
+        ejecucion = asyncio.create_task(uno._ejecutar("j1"))
+        await corriendo.wait()
+        while not ejecucion.done():
+            await otro._ejecutar("j1")
+            await asyncio.sleep(0.05)
+
+        assert len(llamadas) == 1
+        job = await store.obtener("j1")
+        assert job["estado"] == "completado"
+        assert job["img_generada"] == "https://ok"
+
+    asyncio.run(escenario())
+
+
+def test_cada_oyente_recibe_el_aviso():
+    async def escenario():
+        store = MemoriaJobStore()
+        workers = ProbadorWorkers(store, 1, 10)
+        await store.crear(nuevo_job())
+        token = (await store.reclamar("j1", 300))["token"]
+
+        b = asyncio.create_task(workers.esperar_cambio("j1", 5))
+        # Uno que vence y se va, y otro que llega después
+        await workers.esperar_cambio("j1", 0.01)
+        c = asyncio.create_task(workers.esperar_cambio("j1", 5))
+        await asyncio.sleep(0)
+
+        await workers._actualizar("j1", {"etapa": "generando"}, token)
+        await asyncio.wait_for(asyncio.gather(b, c), 1)
+        assert workers._cambios == {}
+
+    asyncio.run(escenario())
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import httpx
+from bson import ObjectId
+
+from bench.fakes import imagen_jpeg
+
+
+def test_lote_con_prendas_subidas(locales):
+    async def escenario():
+        from backend.main import app
+
+        user_id = str(ObjectId())
+        await locales.db["usuarios"].insert_one(
+            {"_id": ObjectId(user_id), "username": "u", "email": "u@example.com", "favoritos": []}
+        )
+        async with app.router.lifespan_context(app):
+            transporte = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://test") as c:
+                r = await c.post(
+                    "/api/probador/batch",
+                    data={"user_id": user_id},
+                    files=[
+                        ("file_usuario", ("yo.jpg", imagen_jpeg((40, 40, 200)), "image/jpeg")),
+                        ("files_prenda", ("a.jpg", imagen_jpeg((200, 30, 30)), "image/jpeg")),
+                        ("files_prenda", ("b.jpg", imagen_jpeg((30, 200, 30)), "image/jpeg")),
+                    ],
+                )
+        return r
+
+    r = asyncio.run(escenario())
+    assert r.status_code == 200
+    lineas = [json.loads(l) for l in r.text.splitlines() if l.strip()]
+    resultados, fin = lineas[:-1], lineas[-1]
+    assert sorted(x["indice"] for x in resultados) == [0, 1]
+    assert all("img_generada" in x for x in resultados), resultados
+    assert fin == {"fin": True, "ok": 2, "errores": 0}
+
+
+def test_lote_prenda_invalida_no_corta_las_demas(locales):
+    async def escenario():
+        from backend.main import app
+
+        user_id = str(ObjectId())
+        await locales.db["usuarios"].insert_one(
+            {"_id": ObjectId(user_id), "username": "u", "email": "u@example.com", "favoritos": []}
+        )
+        async with app.router.lifespan_context(app):
+            transporte = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://test") as c:
+                return await c.post(
+                    "/api/probador/batch",
+                    data={"user_id": user_id},
+                    files=[
+                        ("file_usuario", ("yo.jpg", imagen_jpeg((40, 40, 200)), "image/jpeg")),
+                        ("files_prenda", ("a.jpg", b"no es una imagen", "image/jpeg")),
+                        ("files_prenda", ("b.jpg", imagen_jpeg((30, 200, 30)), "image/jpeg")),
+                    ],
+                )
+
+    r = asyncio.run(escenario())
+    assert r.status_code == 200
+    lineas = {x["indice"]: x for x in (json.loads(l) for l in r.text.splitlines() if l.strip()) if "indice" in x}
+    assert lineas[0]["error"]["status"] == 400
+    assert "img_generada" in lineas[1]